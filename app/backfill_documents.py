@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+
+from sqlalchemy import or_, select
+
+from app.core.db import SessionLocal
+from app.models.invoice import DocumentFetch, Invoice
+from app.services.document_queue import DocumentQueue, enqueue_documents
+from app.services.facturama_client import http_pool
+
+
+async def _drain() -> int:
+    try:
+        return await DocumentQueue(workers=0).drain()
+    finally:
+        await http_pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Encola la descarga de PDF/XML/ZIP de las facturas timbradas que no tienen archivos."
+    )
+    parser.add_argument("--run", action="store_true", help="procesa la cola en este proceso hasta vaciarla")
+    args = parser.parse_args(argv)
+
+    with SessionLocal() as session:
+        invoices = session.scalars(
+            select(Invoice).where(
+                Invoice.status == "success",
+                Invoice.facturama_id.is_not(None),
+                or_(Invoice.pdf_path.is_(None), Invoice.xml_path.is_(None)),
+            )
+        ).all()
+        active = set(
+            session.scalars(
+                select(DocumentFetch.invoice_id).where(DocumentFetch.status.in_(["pending", "running"]))
+            )
+        )
+        queued = 0
+        for invoice in invoices:
+            if invoice.id not in active:
+                enqueue_documents(session, invoice)
+                queued += 1
+        session.commit()
+    print(f"Facturas encoladas: {queued}")
+
+    if args.run:
+        processed = asyncio.run(_drain())
+        print(f"Descargas procesadas: {processed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,56 @@ class Settings(BaseSettings):
     login_rate_limit_window: int = Field(600, alias="LOGIN_RATE_LIMIT_WINDOW")  # seconds
     session_max_age_seconds: int = Field(1800, alias="SESSION_MAX_AGE_SECONDS")  # 30 min por defecto
     cors_allowed_origins: list[str] = Field(default_factory=lambda: ["*"], alias="CORS_ALLOWED_ORIGINS")
+    excel_reader_engine: str = Field("openpyxl", alias="EXCEL_READER_ENGINE")  # openpyxl | calamine
+    excel_streaming: bool = Field(False, alias="EXCEL_STREAMING")  # lee fila por fila; solo guarda los conceptos
+    excel_pool_workers: int = Field(2, alias="EXCEL_POOL_WORKERS")  # 0 = hilo en lugar de procesos
+    excel_pool_queue_size: int = Field(8, alias="EXCEL_POOL_QUEUE_SIZE")  # archivos en espera antes de rechazar
+    upload_cache_max_entries: int = Field(200, alias="UPLOAD_CACHE_MAX_ENTRIES")  # 0 = sin caché
+    upload_max_bytes: int = Field(50 * 1024 * 1024, alias="UPLOAD_MAX_BYTES")  # 0 = sin límite
+    cfdi_max_items: int = Field(0, alias="CFDI_MAX_ITEMS")  # conceptos por CFDI, 0 = sin dividir
+    cfdi_max_bytes: int = Field(0, alias="CFDI_MAX_BYTES")  # tamaño del JSON por CFDI, 0 = sin dividir
+    facturama_timeout: float = Field(30.0, alias="FACTURAMA_TIMEOUT")  # segundos por petición
+    facturama_connect_timeout: float = Field(10.0, alias="FACTURAMA_CONNECT_TIMEOUT")
+    facturama_create_timeout: float = Field(60.0, alias="FACTURAMA_CREATE_TIMEOUT")  # timbrado (POST /3/cfdis)
+    facturama_query_timeout: float = Field(30.0, alias="FACTURAMA_QUERY_TIMEOUT")  # consulta de CFDIs
+    facturama_download_timeout: float = Field(30.0, alias="FACTURAMA_DOWNLOAD_TIMEOUT")  # cada PDF/XML/ZIP
+    facturama_get_retries: int = Field(3, alias="FACTURAMA_GET_RETRIES")  # solo GET; el timbrado nunca se reintenta
+    facturama_retry_backoff: float = Field(0.5, alias="FACTURAMA_RETRY_BACKOFF")  # segundos, se duplica con jitter
+    facturama_retry_backoff_max: float = Field(8.0, alias="FACTURAMA_RETRY_BACKOFF_MAX")
+    facturama_breaker_threshold: int = Field(5, alias="FACTURAMA_BREAKER_THRESHOLD")  # fallos seguidos, 0 = desactivado
+    facturama_breaker_reset: float = Field(30.0, alias="FACTURAMA_BREAKER_RESET")  # segundos en abierto antes de probar
+    facturama_rate_create: float = Field(0, alias="FACTURAMA_RATE_CREATE")  # timbrados por segundo entre todos los workers, 0 = sin límite
+    facturama_rate_query: float = Field(0, alias="FACTURAMA_RATE_QUERY")  # consultas por segundo
+    facturama_rate_download: float = Field(0, alias="FACTURAMA_RATE_DOWNLOAD")  # descargas PDF/XML/ZIP por segundo
+    facturama_rate_burst: float = Field(5, alias="FACTURAMA_RATE_BURST")  # peticiones seguidas permitidas por endpoint
+    facturama_rate_max_wait: float = Field(30.0, alias="FACTURAMA_RATE_MAX_WAIT")  # segundos en cola antes de fallar
+    facturama_documents_timeout: float = Field(60.0, alias="FACTURAMA_DOCUMENTS_TIMEOUT")  # PDF+XML+ZIP en conjunto
+    facturama_remote_zip: bool = Field(False, alias="FACTURAMA_REMOTE_ZIP")  # false = el ZIP se arma con el PDF y XML guardados
+    facturama_http2: bool = Field(False, alias="FACTURAMA_HTTP2")  # requiere el paquete h2
+    facturama_max_connections: int = Field(20, alias="FACTURAMA_MAX_CONNECTIONS")
+    facturama_max_keepalive: int = Field(10, alias="FACTURAMA_MAX_KEEPALIVE")  # conexiones ociosas reutilizables
+    facturama_keepalive_expiry: float = Field(30.0, alias="FACTURAMA_KEEPALIVE_EXPIRY")  # segundos
+    document_workers: int = Field(2, alias="DOCUMENT_WORKERS")  # tareas que descargan PDF/XML/ZIP, 0 = ninguna
+    document_max_attempts: int = Field(8, alias="DOCUMENT_MAX_ATTEMPTS")
+    document_retry_base: float = Field(30.0, alias="DOCUMENT_RETRY_BASE")  # segundos, se duplica en cada intento
+    document_retry_max: float = Field(3600.0, alias="DOCUMENT_RETRY_MAX")
+    document_poll_interval: float = Field(5.0, alias="DOCUMENT_POLL_INTERVAL")
+    stamp_job_workers: int = Field(2, alias="STAMP_JOB_WORKERS")  # timbrados en segundo plano a la vez por proceso, 0 = ninguno
+    stamp_job_poll_interval: float = Field(2.0, alias="STAMP_JOB_POLL_INTERVAL")
+    stamp_job_lease: float = Field(600.0, alias="STAMP_JOB_LEASE")  # segundos sin avance antes de dar el trabajo por perdido
+    stamp_job_events_interval: float = Field(1.0, alias="STAMP_JOB_EVENTS_INTERVAL")  # cada cuánto se revisa el avance para SSE
+    consultar_window_days: int = Field(7, alias="CONSULTAR_WINDOW_DAYS")  # rangos más amplios se piden por ventanas, 0 = no dividir
+    consultar_concurrency: int = Field(4, alias="CONSULTAR_CONCURRENCY")  # ventanas consultadas a la vez
+    consultar_page_size: int = Field(100, alias="CONSULTAR_PAGE_SIZE")  # filas por página en /consultar
+    consultar_cache_entries: int = Field(100, alias="CONSULTAR_CACHE_ENTRIES")  # 0 = sin caché
+    consultar_cache_ttl_past: float = Field(6 * 3600, alias="CONSULTAR_CACHE_TTL_PAST")  # rangos que terminan antes de hoy - 2
+    consultar_cache_ttl_today: float = Field(60, alias="CONSULTAR_CACHE_TTL_TODAY")  # rangos que llegan a hoy - 2 o después
+    bulk_max_files: int = Field(50, alias="BULK_MAX_FILES")  # archivos por timbrado en lote
+    bulk_concurrency: int = Field(4, alias="BULK_CONCURRENCY")  # archivos validados y CFDIs timbrados a la vez en un lote
+    cfdi_split_concurrency: int = Field(2, alias="CFDI_SPLIT_CONCURRENCY")  # partes timbradas a la vez
+    folio_block_size: int = Field(0, alias="FOLIO_BLOCK_SIZE")  # folios apartados por proceso de una vez, 0 = reservar uno por uno
+    idempotency_wait: float = Field(120.0, alias="IDEMPOTENCY_WAIT")  # segundos que una solicitud repetida espera a la original
+    idempotency_claim_ttl: float = Field(900.0, alias="IDEMPOTENCY_CLAIM_TTL")  # timbrado en curso abandonado tras N s
 
     class Config:
         env_file = ".env"
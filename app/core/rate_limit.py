@@ -0,0 +1,124 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.db import SessionLocal
+from app.models.rate_limit import RateLimitBucket
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, bucket: str, retry_in: float):
+        super().__init__(f"Límite de peticiones '{bucket}' alcanzado; siguiente turno en {retry_in:.1f} s")
+        self.bucket = bucket
+        self.retry_in = retry_in
+
+
+class RateLimiter:
+    """Token buckets kept in the database so every uvicorn worker draws from the same quota.
+
+    `limits` maps a bucket name to (tokens per second, burst). A caller with no token available
+    sleeps until the next one is due; if that would take longer than `max_wait` it gets
+    RateLimitExceeded instead. Bucket rows are updated compare-and-swap on `version`, so two
+    processes can't spend the same token. Buckets with rate 0 (or unknown names) are unlimited.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[float, float]],
+        max_wait: float,
+        session_factory: Callable[[], Session] = SessionLocal,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], Any] = asyncio.sleep,
+    ):
+        self.limits = limits
+        self.max_wait = max_wait
+        self.session_factory = session_factory
+        self.clock = clock
+        self.sleep = sleep
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def enabled(self, bucket: str) -> bool:
+        rate, _ = self.limits.get(bucket, (0, 0))
+        return rate > 0
+
+    async def acquire(self, bucket: str) -> float:
+        """Take one token from `bucket`, waiting for it if needed; returns the seconds waited."""
+        if not self.enabled(bucket):
+            return 0.0
+        started = self.clock()
+        while True:
+            wait = await asyncio.to_thread(self._take, bucket)
+            waited = self.clock() - started
+            if wait is None:
+                continue  # another process updated the bucket first
+            if wait <= 0:
+                self._record(bucket, waited)
+                if waited >= 1:
+                    logger.info("Petición a Facturama ({}) esperó {:.1f}s por el límite de peticiones", bucket, waited)
+                return waited
+            if waited + wait > self.max_wait:
+                self._record(bucket, waited, rejected=True)
+                logger.warning("Límite de peticiones '{}' agotado tras esperar {:.1f}s", bucket, waited)
+                raise RateLimitExceeded(bucket, wait)
+            await self.sleep(wait)
+
+    def _take(self, bucket: str) -> Optional[float]:
+        """0 if a token was taken, the seconds until the next one otherwise, None on a lost race."""
+        rate, burst = self.limits[bucket]
+        burst = max(burst, 1)
+        now = self.clock()
+        with self.session_factory() as session:
+            row = session.get(RateLimitBucket, bucket)
+            if row is None:
+                session.add(RateLimitBucket(name=bucket, tokens=burst - 1, updated_at=now, version=0))
+                try:
+                    session.commit()
+                except IntegrityError:
+                    return None
+                return 0.0
+            tokens = min(burst, row.tokens + max(now - row.updated_at, 0) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            claimed = session.execute(
+                update(RateLimitBucket)
+                .where(RateLimitBucket.name == bucket, RateLimitBucket.version == row.version)
+                .values(tokens=tokens - 1, updated_at=now, version=row.version + 1)
+            ).rowcount
+            session.commit()
+            return 0.0 if claimed else None
+
+    def _record(self, bucket: str, waited: float, rejected: bool = False) -> None:
+        stats = self._stats.setdefault(
+            bucket, {"acquired": 0, "delayed": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0}
+        )
+        if rejected:
+            stats["rejected"] += 1
+        else:
+            stats["acquired"] += 1
+            stats["delayed"] += int(waited > 0.001)
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue-wait metrics of this process per bucket (seconds)."""
+        result = {}
+        for bucket, (rate, burst) in self.limits.items():
+            if rate <= 0:
+                continue
+            stats = self._stats.get(bucket, {})
+            calls = stats.get("acquired", 0) + stats.get("rejected", 0)
+            result[bucket] = {
+                "rate_per_second": rate,
+                "burst": burst,
+                "acquired": stats.get("acquired", 0),
+                "delayed": stats.get("delayed", 0),
+                "rejected": stats.get("rejected", 0),
+                "wait_avg": round(stats.get("wait_total", 0.0) / calls, 3) if calls else 0.0,
+                "wait_max": round(stats.get("wait_max", 0.0), 3),
+            }
+        return result
@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable
+
+from loguru import logger
+
+from app.core.config import settings
+
+
+class PoolBusyError(Exception):
+    pass
+
+
+class CpuPool:
+    """Process pool for CPU-bound work (Excel parsing/validation) with a bounded wait queue.
+
+    At most `workers` jobs run at once; up to `queue_size` more wait for a slot. Beyond that
+    `run` raises PoolBusyError right away instead of piling up requests on the worker.
+    With workers=0 jobs run in a thread, still off the event loop.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._waiting = 0
+
+    def start(self) -> None:
+        if self.workers > 0 and self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._loop is not loop:
+            self._slots = asyncio.Semaphore(max(self.workers, 1))
+            self._loop = loop
+            self._waiting = 0
+        return self._slots
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        slots = self._semaphore()
+        if slots.locked() and self._waiting >= self.queue_size:
+            raise PoolBusyError("El servidor está procesando demasiados archivos. Intenta de nuevo en unos minutos.")
+        self._waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            call = partial(fn, *args, **kwargs)
+            if self.workers <= 0:
+                return await asyncio.to_thread(call)
+            self.start()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+            except BrokenProcessPool:
+                logger.error("El pool de procesos se cayó; se reinicia")
+                self._executor = None
+                self.start()
+                raise
+        finally:
+            slots.release()
+
+
+cpu_pool = CpuPool(settings.excel_pool_workers, settings.excel_pool_queue_size)
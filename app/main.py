@@ -1,3 +1,6 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
@@ -14,14 +17,55 @@ from app.core.session import (
 from app.core.config import settings
 from app.core.db import SessionLocal
 from app.core.logging import setup_logging
+from app.core.workers import cpu_pool
 from app.models.series import Series
+from app.services.document_queue import document_queue
+from app.services.facturama_client import breaker, http_pool, limiter
+from app.services.folio_service import folio_blocks
+from app.services.stamp_jobs import stamp_job_queue
 from app.routers import ui, auth, users
 
 setup_logging()
+
+
+def ensure_default_series():
+    with SessionLocal() as session:
+        if settings.default_serie and not session.get(Series, settings.default_serie):
+            session.add(Series(code=settings.default_serie, description="Serie por defecto", is_active=True))
+            session.commit()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the worker pools and queues in order; on shutdown stop them in reverse order, each
+    one even if stopping a later one failed. Leased folios are handed back once no stamp job runs."""
+    ensure_default_series()
+    cpu_pool.start()
+    try:
+        await http_pool.start()
+        try:
+            document_queue.start()
+            try:
+                stamp_job_queue.start()
+                try:
+                    yield
+                finally:
+                    try:
+                        await stamp_job_queue.stop()
+                    finally:
+                        await asyncio.to_thread(folio_blocks.release_all)
+            finally:
+                await document_queue.stop()
+        finally:
+            await http_pool.close()
+    finally:
+        cpu_pool.shutdown()
+
+
 docs_kwargs = {}
 if settings.environment.lower() == "production":
     docs_kwargs = {"docs_url": None, "redoc_url": None, "openapi_url": None}
-app = FastAPI(title="Factura Global CFDI 4.0", **docs_kwargs)
+app = FastAPI(title="Factura Global CFDI 4.0", lifespan=lifespan, **docs_kwargs)
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 app.include_router(auth.router)
@@ -61,9 +105,6 @@ async def session_middleware(request: Request, call_next):
     return response
 
 
-@app.on_event("startup")
-def ensure_default_series():
-    with SessionLocal() as session:
-        if settings.default_serie and not session.get(Series, settings.default_serie):
-            session.add(Series(code=settings.default_serie, description="Serie por defecto", is_active=True))
-            session.commit()
+@app.get("/health")
+async def health():
+    return {"status": "ok", "facturama": breaker.snapshot(), "rate_limit": limiter.snapshot()}
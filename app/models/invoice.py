@@ -1,6 +1,6 @@
 from datetime import date, datetime
 
-from sqlalchemy import Column, Date, DateTime, ForeignKey, Integer, Numeric, String, Text
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, Integer, Numeric, String, Text
 from sqlalchemy.orm import relationship
 
 from app.core.db import Base
@@ -8,6 +8,7 @@ from app.core.db import Base
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (Index("ix_invoices_serie_folio", "serie", "folio", unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
@@ -18,6 +19,10 @@ class Invoice(Base):
     facturama_id = Column(String(64))
     issue_date = Column(Date)
     excel_filename = Column(String(255))
+    upload_hash = Column(String(64), index=True)
+    batch_id = Column(String(32), index=True)
+    batch_part = Column(Integer)
+    idempotency_key = Column(String(64), index=True)  # same key = same stamping request, see invoicing_service
     request_json = Column(Text)
     response_json = Column(Text)
     error_message = Column(Text)
@@ -45,3 +50,54 @@ class InvoiceItem(Base):
     identification_number = Column(String(100))
 
     invoice = relationship("Invoice", back_populates="items")
+
+
+class DocumentFetch(Base):
+    """Pending PDF/XML/ZIP download for a stamped invoice, processed by the background queue."""
+
+    __tablename__ = "document_fetches"
+
+    id = Column(Integer, primary_key=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False, unique=True)
+    status = Column(String(20), nullable=False, default="pending")  # pending | running | done | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False, index=True)
+    locked_until = Column(DateTime(timezone=True))
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class StampJob(Base):
+    """Stamping run submitted from /timbrar, processed by the stamp job workers."""
+
+    __tablename__ = "stamp_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    user_id = Column(Integer, ForeignKey("users.id"))
+    status = Column(String(20), nullable=False, default="queued")  # queued | running | done | failed
+    stage = Column(String(30), nullable=False, default="queued")  # last stage reached, see STAGES
+    message = Column(Text)
+    serie = Column(String(10), nullable=False)
+    issue_date = Column(Date, nullable=False)
+    expedition_place = Column(String(10))
+    observations = Column(Text)
+    upload_path = Column(String(255), nullable=False)
+    upload_hash = Column(String(64))
+    excel_filename = Column(String(255))
+    idempotency_token = Column(String(255))  # client token sent with the upload, if any
+    result_json = Column(Text)
+    locked_until = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False, index=True)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class IdempotencyClaim(Base):
+    """Stamping request in progress, claimed before its upload is parsed; the unique key makes a
+    duplicate in another process wait for it instead of stamping again. Deleted when it finishes."""
+
+    __tablename__ = "idempotency_claims"
+
+    key = Column(String(64), primary_key=True)  # see invoicing_service.idempotency_key
+    owner = Column(String(32), nullable=False)  # uuid4 hex of the attempt holding the claim
+    claimed_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Float, Integer, String
+
+from app.core.db import Base
+
+
+class RateLimitBucket(Base):
+    """Token bucket shared by every app process; `version` guards concurrent updates."""
+
+    __tablename__ = "rate_limit_buckets"
+
+    name = Column(String(40), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # epoch seconds of the last refill
+    version = Column(Integer, nullable=False, default=0)
@@ -16,3 +16,12 @@ class SeriesCounter(Base):
 
     series_code = Column(String(10), primary_key=True)
     last_folio = Column(Integer, nullable=False, default=0)
+
+
+class SpareFolio(Base):
+    """Folio reserved from the counter but handed back unused (e.g. a leased block at shutdown)."""
+
+    __tablename__ = "spare_folios"
+
+    series_code = Column(String(10), primary_key=True)
+    folio = Column(Integer, primary_key=True)
@@ -1,32 +1,41 @@
+import asyncio
 import json
+import math
 from datetime import date, datetime, timedelta
 from pathlib import Path
 from typing import Optional
+from uuid import uuid4
 
 from fastapi import APIRouter, Depends, File, Form, Request, UploadFile
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import select
+from loguru import logger
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
 from app.core.db import get_session
 from app.dependencies import csrf_protect, require_login
-from app.models.invoice import Invoice
-from app.models.series import Series, SeriesCounter
+from app.models.invoice import DocumentFetch, Invoice
+from app.models.series import Series, SeriesCounter, SpareFolio
+from app.services.cfdi_cache import cfdi_cache
+from app.services.document_storage import build_zip, document_paths
 from app.services.facturama_client import FacturamaClient, FacturamaError
+from app.services.folio_service import FolioService, folio_blocks
 from app.services.invoicing_service import InvoicingService
+from app.services.stamp_jobs import create_job, load_snapshot, stamp_job_queue
+from app.services.upload_storage import (
+    InvalidArchiveError,
+    UploadTooLargeError,
+    extract_zip,
+    save_upload,
+    uploads_dir,
+)
 
 templates = Jinja2Templates(directory="app/templates")
 router = APIRouter(dependencies=[Depends(require_login)])
 
 
-def _storage_uploads_dir() -> Path:
-    uploads = settings.facturas_storage_dir / "uploads"
-    uploads.mkdir(parents=True, exist_ok=True)
-    return uploads
-
-
 def _ctx(request: Request, extra: dict | None = None):
     base = {
         "request": request,
@@ -38,6 +47,12 @@ def _ctx(request: Request, extra: dict | None = None):
     return base
 
 
+def _idempotency_token(request: Request, form_value: Optional[str]) -> Optional[str]:
+    """Client token from the Idempotency-Key header or the hidden field of the /timbrar form."""
+    token = (request.headers.get("Idempotency-Key") or form_value or "").strip()
+    return token[:255] or None
+
+
 @router.get("/")
 async def home(request: Request, session: Session = Depends(get_session)):
     series = session.scalars(select(Series).order_by(Series.code)).all()
@@ -50,11 +65,47 @@ async def home(request: Request, session: Session = Depends(get_session)):
                 "series": series,
                 "selected_serie": selected,
                 "today": date.today().isoformat(),
+                "idempotency_key": uuid4().hex,
+            },
+        ),
+    )
+
+
+@router.get("/timbrar/lote")
+async def timbrar_lote_form(request: Request, session: Session = Depends(get_session)):
+    series = session.scalars(select(Series).order_by(Series.code)).all()
+    selected = settings.default_serie if any(s.code == settings.default_serie for s in series) else (series[0].code if series else "")
+    return templates.TemplateResponse(
+        "timbrar_lote.html",
+        _ctx(
+            request,
+            {
+                "series": series,
+                "selected_serie": selected,
+                "today": date.today().isoformat(),
+                "max_files": settings.bulk_max_files,
             },
         ),
     )
 
 
+def _timbrar_upload_error(request: Request, series, serie: str, error: str, status_code: int = 400):
+    return templates.TemplateResponse(
+        "timbrar.html",
+        _ctx(
+            request,
+            {
+                "series": series,
+                "selected_serie": serie,
+                "error": error,
+                "today": date.today().isoformat(),
+                "idempotency_key": uuid4().hex,
+            },
+        ),
+        status_code=status_code,
+    )
+
+
 @router.post("/timbrar")
 async def timbrar(
     request: Request,
@@ -62,47 +113,52 @@ async def timbrar(
     issue_date: str = Form(...),
     expedition_place: Optional[str] = Form(None),
     observations: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Form(None),
     excel_file: UploadFile = File(...),
     session: Session = Depends(get_session),
     csrf=Depends(csrf_protect),
 ):
     series = session.scalars(select(Series).order_by(Series.code)).all()
     parsed_date = date.fromisoformat(issue_date)
-    upload_dir = _storage_uploads_dir()
-    temp_path = upload_dir / f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{excel_file.filename}"
     try:
-        content = await excel_file.read()
-        temp_path.write_bytes(content)
+        stored = await save_upload(excel_file, uploads_dir())
+    except UploadTooLargeError as exc:
+        return _timbrar_upload_error(request, series, serie, str(exc), status_code=413)
     except Exception:
-        return templates.TemplateResponse(
-            "timbrar.html",
-            _ctx(
-                request,
-                {
-                    "series": series,
-                    "selected_serie": serie,
-                    "error": "No se pudo guardar el archivo. Intenta de nuevo.",
-                    "today": date.today().isoformat(),
-                },
-            ),
-            status_code=400,
-        )
+        logger.exception("No se pudo guardar el archivo subido")
+        return _timbrar_upload_error(request, series, serie, "No se pudo guardar el archivo. Intenta de nuevo.")
 
     service = InvoicingService(session)
     result = await service.process_invoice(
-        excel_path=temp_path,
+        excel_path=stored.path,
         serie=serie,
         issue_date=parsed_date,
         expedition_place=expedition_place,
         observations=observations,
+        upload_hash=stored.sha256,
+        idempotency_token=_idempotency_token(request, idempotency_key),
     )
     context = {
         "series": series,
         "selected_serie": serie,
         "today": date.today().isoformat(),
+        "idempotency_key": uuid4().hex,
     }
-    if result.get("success"):
-        context["message"] = f"Factura timbrada correctamente. Serie {serie}, Folio {result.get('folio')}"
+    if result.get("warnings"):
+        context["warnings"] = result["warnings"]
+    if result.get("parts"):
+        folios = ", ".join(str(f) for f in result["folios"])
+        if result["folios"]:
+            context["message"] = (
+                f"Se timbraron {len(result['folios'])} de {len(result['parts'])} facturas. Serie {serie}, Folios {folios}"
+            )
+        if not result["success"]:
+            context["error"] = result["errors"]
+    elif result.get("success"):
+        context["message"] = (
+            f"Factura timbrada correctamente. Serie {serie}, Folio {result.get('folio')}. "
+            "PDF, XML y ZIP se descargan en segundo plano (ver Historial)."
+        )
     else:
         context["error"] = result.get("errors") or ["Hubo errores al procesar el archivo."]
         if result.get("error_excel"):
@@ -110,6 +166,211 @@ async def timbrar(
     return templates.TemplateResponse("timbrar.html", _ctx(request, context))
 
 
+async def _save_bulk_uploads(excel_files: list[UploadFile]) -> list:
+    """Store every upload; a ZIP is replaced by the workbooks inside it."""
+    stored = []
+    try:
+        for excel_file in excel_files:
+            upload = await save_upload(excel_file, uploads_dir())
+            if Path(upload.filename).suffix.lower() == ".zip":
+                try:
+                    stored.extend(await extract_zip(upload, uploads_dir(), max_files=settings.bulk_max_files))
+                finally:
+                    await asyncio.to_thread(upload.path.unlink, missing_ok=True)
+            else:
+                stored.append(upload)
+            if settings.bulk_max_files and len(stored) > settings.bulk_max_files:
+                raise InvalidArchiveError(f"Se permiten hasta {settings.bulk_max_files} archivos por lote.")
+    except BaseException:
+        for upload in stored:
+            await asyncio.to_thread(upload.path.unlink, missing_ok=True)
+        raise
+    return stored
+
+
+@router.post("/timbrar/lote")
+async def timbrar_lote(
+    request: Request,
+    serie: str = Form(...),
+    issue_date: str = Form(...),
+    expedition_place: Optional[str] = Form(None),
+    observations: Optional[str] = Form(None),
+    excel_files: list[UploadFile] = File(...),
+    session: Session = Depends(get_session),
+    csrf=Depends(csrf_protect),
+):
+    series = session.scalars(select(Series).order_by(Series.code)).all()
+    context = {
+        "series": series,
+        "selected_serie": serie,
+        "today": date.today().isoformat(),
+        "max_files": settings.bulk_max_files,
+    }
+    parsed_date = date.fromisoformat(issue_date)
+    try:
+        uploads = await _save_bulk_uploads(excel_files)
+    except (UploadTooLargeError, InvalidArchiveError) as exc:
+        context["error"] = str(exc)
+        return templates.TemplateResponse("timbrar_lote.html", _ctx(request, context), status_code=400)
+    except Exception:
+        logger.exception("No se pudieron guardar los archivos del lote")
+        context["error"] = "No se pudieron guardar los archivos. Intenta de nuevo."
+        return templates.TemplateResponse("timbrar_lote.html", _ctx(request, context), status_code=400)
+
+    result = await InvoicingService(session).process_bulk(
+        uploads,
+        serie=serie,
+        issue_date=parsed_date,
+        expedition_place=expedition_place,
+        observations=observations,
+    )
+    context["files"] = result["files"]
+    if result["errors"]:
+        context["error"] = result["errors"]
+    elif result["files"]:
+        stamped = sum(1 for f in result["files"] if f["status"] == "success")
+        context["message"] = f"Se timbraron {stamped} de {len(result['files'])} archivos en la serie {serie}."
+    if result.get("error_excel"):
+        context["error_excel"] = f"/timbrar/lote/errores/{Path(result['error_excel']).name}"
+    return templates.TemplateResponse("timbrar_lote.html", _ctx(request, context))
+
+
+@router.get("/timbrar/lote/errores/{filename}")
+async def timbrar_lote_errores(filename: str):
+    path = settings.facturas_storage_dir / Path(filename).name
+    if not (path.name.startswith("lote_") and path.name.endswith("_errores.xlsx") and path.exists()):
+        return RedirectResponse(url="/timbrar/lote", status_code=302)
+    return FileResponse(
+        path, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", filename=path.name
+    )
+
+
+@router.post("/timbrar/jobs")
+async def timbrar_job(
+    request: Request,
+    serie: str = Form(...),
+    issue_date: str = Form(...),
+    expedition_place: Optional[str] = Form(None),
+    observations: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Form(None),
+    excel_file: UploadFile = File(...),
+    session: Session = Depends(get_session),
+    csrf=Depends(csrf_protect),
+):
+    """Queue a stamping run and return right away; progress is read from /jobs/{id}/events."""
+    try:
+        parsed_date = date.fromisoformat(issue_date)
+    except ValueError:
+        return JSONResponse({"errors": ["Fecha de emisión inválida"]}, status_code=400)
+    try:
+        stored = await save_upload(excel_file, uploads_dir())
+    except UploadTooLargeError as exc:
+        return JSONResponse({"errors": [str(exc)]}, status_code=413)
+    except Exception:
+        logger.exception("No se pudo guardar el archivo subido")
+        return JSONResponse({"errors": ["No se pudo guardar el archivo. Intenta de nuevo."]}, status_code=400)
+
+    user = getattr(request.state, "user", None)
+    job = create_job(
+        session,
+        stored,
+        serie=serie,
+        issue_date=parsed_date,
+        expedition_place=expedition_place,
+        observations=observations,
+        user_id=user.id if user else None,
+        idempotency_token=_idempotency_token(request, idempotency_key),
+    )
+    stamp_job_queue.notify()
+    return JSONResponse(
+        {"job_id": job.id, "status_url": f"/jobs/{job.id}", "events_url": f"/jobs/{job.id}/events"}, status_code=202
+    )
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    snapshot = await asyncio.to_thread(load_snapshot, job_id)
+    if snapshot is None:
+        return JSONResponse({"errors": ["Trabajo no encontrado"]}, status_code=404)
+    return JSONResponse(snapshot)
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events: one `data:` message each time the job changes, until it finishes.
+
+    The job row is polled rather than signalled in-process, since another worker process may be
+    running the job. A comment line is sent every ~15 s so proxies keep the connection open.
+    """
+
+    async def stream():
+        last = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            snapshot = await asyncio.to_thread(load_snapshot, job_id)
+            if snapshot is None:
+                yield f"event: missing\ndata: {json.dumps({'id': job_id})}\n\n"
+                return
+            if snapshot != last:
+                yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+                last, idle = snapshot, 0.0
+            elif idle >= 15:
+                yield ": ping\n\n"
+                idle = 0.0
+            if snapshot["finished"]:
+                return
+            await asyncio.sleep(settings.stamp_job_events_interval)
+            idle += settings.stamp_job_events_interval
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/timbrar/validar")
+async def timbrar_validar(
+    serie: Optional[str] = Form(None),
+    issue_date: Optional[str] = Form(None),
+    expedition_place: Optional[str] = Form(None),
+    observations: Optional[str] = Form(None),
+    excel_file: UploadFile = File(...),
+    session: Session = Depends(get_session),
+    csrf=Depends(csrf_protect),
+):
+    try:
+        parsed_date = date.fromisoformat(issue_date) if issue_date else date.today()
+    except ValueError:
+        return JSONResponse({"valid": False, "errors": ["Fecha de emisión inválida"]}, status_code=400)
+    try:
+        stored = await save_upload(excel_file, uploads_dir())
+    except UploadTooLargeError as exc:
+        return JSONResponse({"valid": False, "errors": [str(exc)]}, status_code=413)
+    except Exception:
+        logger.exception("No se pudo guardar el archivo subido")
+        return JSONResponse({"valid": False, "errors": ["No se pudo guardar el archivo. Intenta de nuevo."]}, status_code=400)
+
+    try:
+        result = await InvoicingService(session).validate_invoice(
+            excel_path=stored.path,
+            serie=serie or settings.default_serie,
+            issue_date=parsed_date,
+            expedition_place=expedition_place,
+            observations=observations,
+            upload_hash=stored.sha256,
+        )
+    finally:
+        await asyncio.to_thread(stored.path.unlink, missing_ok=True)
+    return JSONResponse(result, status_code=200 if result["valid"] else 422)
+
+
+def _group_batches(invoices):
+    """Keep the parts of a split upload together, in part order, where the first one appears."""
+    groups: dict = {}
+    for inv in invoices:
+        groups.setdefault(inv.batch_id or f"invoice-{inv.id}", []).append(inv)
+    return [inv for group in groups.values() for inv in sorted(group, key=lambda i: i.batch_part or 0)]
+
+
 @router.get("/historial")
 async def historial(
     request: Request,
@@ -129,14 +390,30 @@ async def historial(
     if status:
         stmt = stmt.where(Invoice.status == status)
     stmt = stmt.order_by(Invoice.created_at.desc())
-    invoices = session.scalars(stmt).all()
+    invoices = _group_batches(session.scalars(stmt).all())
+    batch_ids = {inv.batch_id for inv in invoices if inv.batch_id}
+    batch_sizes = {}
+    if batch_ids:
+        batch_sizes = dict(
+            session.execute(
+                select(Invoice.batch_id, func.count()).where(Invoice.batch_id.in_(batch_ids)).group_by(Invoice.batch_id)
+            ).all()
+        )
     series = session.scalars(select(Series).order_by(Series.code)).all()
     file_map = {}
     for inv in invoices:
         pdf_ok = bool(inv.pdf_path and Path(inv.pdf_path).exists())
         xml_ok = bool(inv.xml_path and Path(inv.xml_path).exists())
-        zip_ok = (settings.facturas_storage_dir / "zip" / f"{inv.serie}-{inv.folio}.zip").exists()
+        zip_ok = document_paths(inv)["zip"].exists() or (pdf_ok and xml_ok and not settings.facturama_remote_zip)
         file_map[inv.id] = {"pdf": pdf_ok, "xml": xml_ok, "zip": zip_ok}
+    fetches = {}
+    if invoices:
+        fetches = {
+            job.invoice_id: job
+            for job in session.scalars(
+                select(DocumentFetch).where(DocumentFetch.invoice_id.in_([inv.id for inv in invoices]))
+            )
+        }
     return templates.TemplateResponse(
         "historial.html",
         _ctx(
@@ -146,6 +423,8 @@ async def historial(
                 "series": series,
                 "filters": {"date_start": date_start, "date_end": date_end, "serie": serie, "status": status},
                 "file_map": file_map,
+                "batch_sizes": batch_sizes,
+                "fetches": fetches,
             },
         ),
     )
@@ -157,7 +436,9 @@ async def download(invoice_id: int, fmt: str, session: Session = Depends(get_ses
     if not invoice:
         return RedirectResponse(url="/historial", status_code=302)
     if fmt == "zip":
-        path = settings.facturas_storage_dir / "zip" / f"{invoice.serie}-{invoice.folio}.zip"
+        path = document_paths(invoice)["zip"]
+        if not path.exists() and not settings.facturama_remote_zip:
+            path = await build_zip(invoice)
     else:
         path = invoice.pdf_path if fmt == "pdf" else invoice.xml_path
     if not path or not Path(path).exists():
@@ -176,6 +457,8 @@ async def download(invoice_id: int, fmt: str, session: Session = Depends(get_ses
 async def series_list(request: Request, session: Session = Depends(get_session)):
     series = session.scalars(select(Series).order_by(Series.code)).all()
     counters = {c.series_code: c.last_folio for c in session.scalars(select(SeriesCounter)).all()}
+    folio_service = FolioService(session)
+    gaps = {s.code: folio_service.gaps(s.code, exclude=folio_blocks.leased(s.code)) for s in series}
     msg = request.query_params.get("msg")
     error = request.query_params.get("error")
     return templates.TemplateResponse(
@@ -185,6 +468,7 @@ async def series_list(request: Request, session: Session = Depends(get_session))
             {
                 "series": series,
                 "counters": counters,
+                "gaps": gaps,
                 "msg": msg,
                 "error": error,
             },
@@ -242,10 +526,21 @@ async def series_update_folio(
         session.add(counter)
     else:
         counter.last_folio = value
+    session.execute(delete(SpareFolio).where(SpareFolio.series_code == code, SpareFolio.folio > value))
     session.commit()
+    folio_blocks.discard(code)
     return RedirectResponse(url="/series?msg=Último folio actualizado", status_code=303)
 
 
+@router.post("/series/{code}/gaps")
+async def series_release_gaps(code: str, session: Session = Depends(get_session), csrf=Depends(csrf_protect)):
+    if not session.get(Series, code):
+        return RedirectResponse(url="/series?error=Serie no encontrada", status_code=303)
+    released = FolioService(session).release_gaps(code, exclude=folio_blocks.leased(code))
+    msg = f"{len(released)} folios sin factura se volverán a asignar"
+    return RedirectResponse(url=f"/series?msg={msg}", status_code=303)
+
+
 @router.get("/consultar")
 async def consultar_form(request: Request):
     return templates.TemplateResponse(
@@ -254,31 +549,36 @@ async def consultar_form(request: Request):
     )
 
 
+def _age_text(seconds: float) -> str:
+    if seconds < 60:
+        return f"{int(seconds)} s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min"
+    return f"{seconds / 3600:.1f} h"
+
+
 @router.post("/consultar")
 async def consultar(
     request: Request,
     date_start: str = Form(...),
     date_end: str = Form(...),
+    refresh: Optional[str] = Form(None),
+    page: int = Form(1),
     csrf=Depends(csrf_protect),
 ):
     client = FacturamaClient()
     error = None
     results = []
     debug = None
+    cached = None
+    cache_key = ("issued", date_start, date_end)
     try:
-        resp = await client.list_cfdis(date_start=date_start, date_end=date_end)
-        if isinstance(resp, dict) and "Data" in resp:
-            results = resp.get("Data") or []
-        elif isinstance(resp, list):
-            results = resp
-        else:
-            error = "Respuesta inesperada de Facturama."
-            debug = {
-                "status_code": None,
-                "url": None,
-                "response_text": json.dumps(resp, ensure_ascii=False, indent=2),
-                "exception": None,
-            }
+        if not refresh:
+            cached = cfdi_cache.get(cache_key)
+        if cached is None:
+            rows = await client.list_cfdis_range(date_start=date_start, date_end=date_end)
+            cached = cfdi_cache.put(cache_key, rows)
+        results = cached.data
     except FacturamaError as exc:
         error = "No se pudieron consultar CFDIs."
         response_text = ""
@@ -303,15 +603,22 @@ async def consultar(
             "response_text": "",
             "exception": str(exc),
         }
+    page_size = max(settings.consultar_page_size, 1)
+    pages = max(math.ceil(len(results) / page_size), 1)
+    page = min(max(page, 1), pages)
     return templates.TemplateResponse(
         "consultar.html",
         _ctx(
             request,
             {
-                "results": results,
+                "results": results[(page - 1) * page_size : page * page_size],
+                "total": len(results),
+                "page": page,
+                "pages": pages,
                 "error": error,
                 "filters": {"date_start": date_start, "date_end": date_end},
                 "debug": debug,
+                "data_age": _age_text(cached.age) if cached else None,
             },
         ),
     )
@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Callable, Optional, Tuple
+
+from app.core.config import settings
+
+CacheKey = Tuple[str, str, str]  # (type, dateStart, dateEnd)
+
+# CFDIs can be issued with a date up to 2 days back, so ranges ending that recently can still change
+BACKDATE_DAYS = 2
+
+
+@dataclass
+class CachedListing:
+    data: Any
+    fetched_at: float  # epoch seconds
+    expires_at: float
+    clock: Callable[[], float] = field(default=time.time, repr=False, compare=False)
+
+    @property
+    def age(self) -> float:
+        return max(self.clock() - self.fetched_at, 0.0)
+
+
+def _parse_date(value: str) -> Optional[date]:
+    try:
+        return date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+class CfdiListCache:
+    """In-process TTL + LRU cache of /consultar listings keyed by (type, dateStart, dateEnd).
+
+    Ranges ending before the backdating window (today - BACKDATE_DAYS) can't get new CFDIs, so
+    they get a long TTL; ranges that reach into the window get a short one, since CFDIs backdated
+    by other workers (whose `invalidate` doesn't reach this cache) may still land in them. Each
+    worker process has its own cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        past_ttl: float,
+        today_ttl: float,
+        clock: Callable[[], float] = time.time,
+        today: Callable[[], date] = date.today,
+    ):
+        self.max_entries = max_entries
+        self.past_ttl = past_ttl
+        self.today_ttl = today_ttl
+        self.clock = clock
+        self.today = today
+        self._entries: "OrderedDict[CacheKey, CachedListing]" = OrderedDict()
+
+    def _ttl(self, key: CacheKey) -> float:
+        end = _parse_date(key[2])
+        if end is None or end >= self.today() - timedelta(days=BACKDATE_DAYS):
+            return self.today_ttl
+        return self.past_ttl
+
+    def get(self, key: CacheKey) -> Optional[CachedListing]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: CacheKey, data: Any) -> CachedListing:
+        now = self.clock()
+        entry = CachedListing(data=data, fetched_at=now, expires_at=now + self._ttl(key), clock=self.clock)
+        if self.max_entries <= 0:
+            return entry
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *days: date) -> int:
+        """Drop cached ranges that contain any of `days`; ranges that can't be parsed are dropped too."""
+        dropped = 0
+        for key in list(self._entries):
+            start, end = _parse_date(key[1]), _parse_date(key[2])
+            if start is None or end is None or any(start <= day <= end for day in days):
+                del self._entries[key]
+                dropped += 1
+        return dropped
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+cfdi_cache = CfdiListCache(
+    settings.consultar_cache_entries, settings.consultar_cache_ttl_past, settings.consultar_cache_ttl_today
+)
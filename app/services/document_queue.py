@@ -0,0 +1,217 @@
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from loguru import logger
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.models.invoice import DocumentFetch, Invoice
+from app.services.document_storage import DOCUMENT_FORMATS, build_zip, document_paths
+from app.services.facturama_client import FacturamaClient
+
+
+def missing_documents(invoice: Invoice) -> list[str]:
+    missing = []
+    if not (invoice.pdf_path and Path(invoice.pdf_path).exists()):
+        missing.append("pdf")
+    if not (invoice.xml_path and Path(invoice.xml_path).exists()):
+        missing.append("xml")
+    if not document_paths(invoice)["zip"].exists():
+        missing.append("zip")
+    return missing
+
+
+def _download(facturama: FacturamaClient, invoice: Invoice, fmt: str, path: Path):
+    if fmt == "zip":
+        return facturama.download_zip(invoice.facturama_id, str(path))
+    return facturama.download_document(invoice.facturama_id, fmt, str(path))
+
+
+async def download_documents(
+    facturama: FacturamaClient, invoice: Invoice, formats: Iterable[str] = DOCUMENT_FORMATS
+) -> Dict[str, str]:
+    """Download documents concurrently within one time budget and set the invoice paths of
+    those saved. A failed or late document doesn't keep the others from being stored; returns
+    the error per format that could not be saved.
+
+    Unless `facturama_remote_zip` is set, the ZIP is not downloaded but built from the stored
+    PDF and XML once those are in place."""
+    formats = list(formats)
+    local_zip = "zip" in formats and not settings.facturama_remote_zip
+    paths = document_paths(invoice)
+    tasks = {
+        fmt: asyncio.ensure_future(_download(facturama, invoice, fmt, paths[fmt]))
+        for fmt in formats
+        if not (fmt == "zip" and local_zip)
+    }
+    pending = set()
+    if tasks:
+        _, pending = await asyncio.wait(tasks.values(), timeout=settings.facturama_documents_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    errors: Dict[str, str] = {}
+    for fmt, task in tasks.items():
+        if task in pending:
+            errors[fmt] = "Tiempo agotado"
+        elif task.exception() is not None:
+            errors[fmt] = str(task.exception())
+        elif not task.result():
+            errors[fmt] = "Facturama no devolvió el documento"
+        elif fmt == "pdf":
+            invoice.pdf_path = str(paths["pdf"])
+        elif fmt == "xml":
+            invoice.xml_path = str(paths["xml"])
+    if local_zip:
+        try:
+            if await build_zip(invoice) is None:
+                errors["zip"] = "Faltan el PDF o el XML para armar el ZIP"
+        except OSError as exc:
+            errors["zip"] = str(exc)
+    for fmt, error in errors.items():
+        logger.warning("No se pudo descargar {} de {}-{}: {}", fmt.upper(), invoice.serie, invoice.folio, error)
+    return errors
+
+
+def enqueue_documents(session: Session, invoice: Invoice) -> DocumentFetch:
+    job = session.scalar(select(DocumentFetch).where(DocumentFetch.invoice_id == invoice.id))
+    if job is None:
+        job = DocumentFetch(invoice_id=invoice.id)
+        session.add(job)
+    job.status = "pending"
+    job.attempts = 0
+    job.next_attempt_at = datetime.utcnow()
+    job.locked_until = None
+    job.last_error = None
+    session.flush()
+    return job
+
+
+def retry_delay(attempts: int) -> float:
+    return min(settings.document_retry_base * 2 ** max(attempts - 1, 0), settings.document_retry_max)
+
+
+class DocumentQueue:
+    """Background workers that download PDF/XML/ZIP for stamped invoices.
+
+    Jobs live in `document_fetches`, so they survive restarts and several app processes can
+    share them: a job is claimed with a conditional UPDATE plus a lease (`locked_until`), and one
+    left `running` by a dead worker is picked up again once its lease expires. Failed downloads
+    are retried with exponential backoff; after `document_max_attempts` the job is marked failed.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        session_factory: Callable[[], Session] = SessionLocal,
+        client_factory: Callable[[], FacturamaClient] = FacturamaClient,
+    ):
+        self.workers = workers
+        self.session_factory = session_factory
+        self.client_factory = client_factory
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+
+    def start(self) -> None:
+        if self.workers <= 0 or self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self.run_once()
+            except Exception:
+                logger.exception("Error en la cola de documentos")
+                processed = False
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.document_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> bool:
+        """Claim and process one due job; False if there is none."""
+        job_id = self._claim()
+        if job_id is None:
+            return False
+        await self._process(job_id)
+        return True
+
+    async def drain(self) -> int:
+        """Process due jobs until none is left (retries scheduled for later are not waited for)."""
+        processed = 0
+        while await self.run_once():
+            processed += 1
+        return processed
+
+    def _claim(self) -> Optional[int]:
+        now = datetime.utcnow()
+        claimable = and_(
+            DocumentFetch.next_attempt_at <= now,
+            or_(
+                DocumentFetch.status == "pending",
+                and_(DocumentFetch.status == "running", DocumentFetch.locked_until < now),
+            ),
+        )
+        lease = timedelta(seconds=settings.facturama_documents_timeout + 60)
+        with self.session_factory() as session:
+            candidates = session.scalars(
+                select(DocumentFetch.id).where(claimable).order_by(DocumentFetch.next_attempt_at).limit(5)
+            ).all()
+            for job_id in candidates:
+                claimed = session.execute(
+                    update(DocumentFetch)
+                    .where(DocumentFetch.id == job_id, claimable)
+                    .values(status="running", locked_until=now + lease, attempts=DocumentFetch.attempts + 1)
+                ).rowcount
+                session.commit()
+                if claimed:
+                    return job_id
+        return None
+
+    async def _process(self, job_id: int) -> None:
+        with self.session_factory() as session:
+            job = session.get(DocumentFetch, job_id)
+            invoice = session.get(Invoice, job.invoice_id)
+            errors: Dict[str, str] = {}
+            if invoice is None or not invoice.facturama_id:
+                errors["cfdi"] = "La factura no tiene ID de Facturama"
+                job.attempts = settings.document_max_attempts
+            else:
+                errors = await download_documents(self.client_factory(), invoice, missing_documents(invoice))
+
+            job.locked_until = None
+            if not errors:
+                job.status = "done"
+                job.last_error = None
+            elif job.attempts >= settings.document_max_attempts:
+                job.status = "failed"
+                job.last_error = "; ".join(f"{fmt}: {error}" for fmt, error in errors.items())
+                logger.error("Se agotaron los reintentos de descarga para la factura {}", job.invoice_id)
+            else:
+                job.status = "pending"
+                job.last_error = "; ".join(f"{fmt}: {error}" for fmt, error in errors.items())
+                job.next_attempt_at = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts))
+            session.commit()
+
+
+document_queue = DocumentQueue(settings.document_workers)
@@ -0,0 +1,42 @@
+import asyncio
+import os
+import zipfile
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.models.invoice import Invoice
+
+DOCUMENT_FORMATS = ("pdf", "xml", "zip")
+
+
+def document_paths(invoice: Invoice) -> Dict[str, Path]:
+    name = f"{invoice.serie}-{invoice.folio}"
+    return {fmt: settings.facturas_storage_dir / fmt / f"{name}.{fmt}" for fmt in DOCUMENT_FORMATS}
+
+
+def _stored(path: Optional[str]) -> Optional[Path]:
+    return Path(path) if path and Path(path).exists() else None
+
+
+def _write_zip(members: Dict[str, Path], target: Path) -> Path:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(f".{target.name}.part")
+    try:
+        with zipfile.ZipFile(partial, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, path in members.items():
+                archive.write(path, arcname=name)
+        os.replace(partial, target)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    return target
+
+
+async def build_zip(invoice: Invoice) -> Optional[Path]:
+    """Bundle the stored PDF and XML into `{serie}-{folio}.zip` (off the event loop), in place of
+    downloading the same files again from Facturama. None if either document isn't stored yet."""
+    pdf, xml = _stored(invoice.pdf_path), _stored(invoice.xml_path)
+    if pdf is None or xml is None:
+        return None
+    return await asyncio.to_thread(_write_zip, {pdf.name: pdf, xml.name: xml}, document_paths(invoice)["zip"])
@@ -1,13 +1,21 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from datetime import date, timedelta
+import csv
+import json
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from itertools import chain
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
 
+import numpy as np
 import pandas as pd
 from loguru import logger
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
 
 from app.core.config import settings
 
@@ -47,6 +55,64 @@ EXPECTED_COLUMNS = [
     "Mail",
 ]
 
+# Column schema: these columns are read as numbers, every other one as text.
+NUMERIC_COLUMNS = [
+    "Cantidad",
+    "Precio Unitario",
+    "Subtotal del Concepto",
+    "IVA del Concepto",
+    "Total del Concepto",
+    "Year",
+]
+
+READER_ENGINES = {"openpyxl", "calamine"}
+
+# Supported upload formats, detected from the file content (see detect_format).
+INPUT_FORMATS = {"xlsx": "Excel", "csv": "CSV", "parquet": "Parquet"}
+
+# Validated per row; an unparseable amount is reported as "<col>: No es un número válido: <valor>".
+AMOUNT_COLUMNS = [
+    "Cantidad",
+    "Subtotal del Concepto",
+    "IVA del Concepto",
+    "Total del Concepto",
+    "Precio Unitario",
+]
+
+REQUIRED_TEXT_COLUMNS = [
+    ("Pedido", "Pedido es obligatorio (IdentificationNumber)"),
+    ("ClaveProdServ", "ClaveProdServ requerida"),
+    ("ClaveUnidad", "ClaveUnidad requerida"),
+    ("Objeto Impuesto", "Objeto Impuesto requerido"),
+]
+
+TOTAL_TOLERANCE = 0.02
+
+# to_decimal rounds half-up to 6 places: amounts below HALF_STEP in absolute value become 0. Frame
+# checks run on floats; rows within EXACT_BAND of a threshold are settled with Decimals instead.
+HALF_STEP = 5e-7
+EXACT_BAND = 1e-5
+
+# pandas.api.types.infer_dtype kinds that can't hide booleans (to_numeric turns True into 1.0).
+PLAIN_NUMBER_KINDS = {"integer", "floating", "mixed-integer-float", "empty"}
+
+# "Importes no pueden ser negativos" points at the first negative one of these.
+NEGATIVE_CHECK_COLUMNS = ["Subtotal del Concepto", "IVA del Concepto", "Total del Concepto"]
+
+ERROR_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+ERROR_FONT = Font(color="9C0006")
+
+
+@dataclass
+class RowError:
+    row: int  # 0-based position among data rows
+    column: Optional[str]
+    message: str
+
+    @property
+    def row_number(self) -> int:
+        return self.row + 2  # account header
+
 
 @dataclass
 class ExcelProcessingResult:
@@ -54,6 +120,30 @@ class ExcelProcessingResult:
     errors: List[str]
     payload: Optional[Dict[str, Any]] = None
     error_excel_path: Optional[Path] = None
+    row_errors: List[RowError] = field(default_factory=list)
+
+
+@dataclass
+class ParsedUpload:
+    """Content-only result of reading an upload: no serie, folio or dates, so it can be cached by file hash."""
+
+    errors: List[str]
+    items: List[Dict[str, Any]] = field(default_factory=list)
+    header: Dict[str, Any] = field(default_factory=dict)  # first row, text view
+    row_errors: List[RowError] = field(default_factory=list)
+    error_excel_path: Optional[Path] = None
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+
+def format_row_errors(row_errors: Iterable[RowError]) -> List[str]:
+    """Group structured errors into the "Fila N: msg; msg" lines shown in the UI."""
+    grouped: Dict[int, List[str]] = defaultdict(list)
+    for err in row_errors:
+        grouped[err.row_number].append(err.message)
+    return [f"Fila {row_num}: " + "; ".join(messages) for row_num, messages in sorted(grouped.items())]
 
 
 def normalize_payment_form(value: Any) -> str:
@@ -80,14 +170,265 @@ def to_decimal(value: Any) -> Decimal:
     if value is None or (isinstance(value, float) and pd.isna(value)):
         return Decimal("0")
     try:
-        return Decimal(str(value)).quantize(Decimal("0.000001"), rounding=ROUND_HALF_UP)
+        number = Decimal(str(value))
+        if not number.is_finite():  # "NaN", "Infinity"
+            raise InvalidOperation
+        return number.quantize(Decimal("0.000001"), rounding=ROUND_HALF_UP)
     except (InvalidOperation, ValueError, TypeError):
         raise InvalidOperation(f"No es un número válido: {value}")
 
 
+def detect_format(path: Path) -> str:
+    with open(path, "rb") as fh:
+        head = fh.read(8)
+    if head.startswith((b"PK\x03\x04", b"\xd0\xcf\x11\xe0")):  # xlsx (zip) / legacy xls
+        return "xlsx"
+    if head.startswith(b"PAR1"):
+        return "parquet"
+    return "csv"
+
+
+def csv_dialect(path: Path) -> tuple[str, str]:
+    """Guess (encoding, delimiter) of an ERP CSV export from its first bytes."""
+    with open(path, "rb") as fh:
+        head = fh.read(64 * 1024)
+    try:
+        text, encoding = head.decode("utf-8-sig"), "utf-8-sig"
+    except UnicodeDecodeError as exc:
+        # A multibyte character cut at the read boundary is not an encoding problem.
+        if exc.start >= len(head) - 3:
+            text, encoding = head[: exc.start].decode("utf-8-sig"), "utf-8-sig"
+        else:
+            text, encoding = head.decode("latin-1"), "latin-1"
+    header = text.splitlines()[0] if text else ""
+    return encoding, max(",;\t|", key=header.count)
+
+
+def read_frames(
+    path: Path, engine: str = "openpyxl", fmt: str | None = None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Parse the upload once and return its (text, numeric) views."""
+    fmt = fmt or detect_format(path)
+    # Only empty cells are missing: text such as "NaN" or "NA" is kept, as in streaming mode.
+    na = {"keep_default_na": False, "na_values": [""]}
+    if fmt == "csv":
+        encoding, sep = csv_dialect(path)
+        raw = pd.read_csv(path, dtype=object, sep=sep, encoding=encoding, **na)
+    elif fmt == "parquet":
+        raw = pd.read_parquet(path).astype(object)
+    else:
+        if engine not in READER_ENGINES:
+            raise ValueError(f"Motor de lectura no soportado: {engine}")
+        raw = pd.read_excel(path, engine=engine, dtype=object, **na)
+    df_text = raw.astype(str).where(raw.notna(), "")
+    df_numbers = raw[[col for col in NUMERIC_COLUMNS if col in raw.columns]]
+    return df_text, df_numbers
+
+
+def iter_rows(path: Path, fmt: str | None = None) -> Iterator[Dict[str, Any]]:
+    """Yield the upload row by row as {column: value}, without loading it in memory."""
+    fmt = fmt or detect_format(path)
+    if fmt == "csv":
+        return _iter_csv_rows(path)
+    if fmt == "parquet":
+        return _iter_parquet_rows(path)
+    return _iter_xlsx_rows(path)
+
+
+def iter_rows_values(path: Path, fmt: str | None = None) -> Iterator[List[Any]]:
+    return (list(row.values()) for row in iter_rows(path, fmt))
+
+
+def _iter_xlsx_rows(path: Path) -> Iterator[Dict[str, Any]]:
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col) if col is not None else "" for col in header]
+        pending_blank = 0
+        for values in rows:
+            if all(value is None for value in values):
+                # Like pandas, trailing blank rows are dropped; blank rows between data are kept.
+                pending_blank += 1
+                continue
+            for _ in range(pending_blank):
+                yield dict.fromkeys(columns)
+            pending_blank = 0
+            yield {
+                col: int(value) if isinstance(value, float) and value.is_integer() else value
+                for col, value in zip(columns, values)
+            }
+    finally:
+        workbook.close()
+
+
+def _iter_csv_rows(path: Path) -> Iterator[Dict[str, Any]]:
+    encoding, sep = csv_dialect(path)
+    with open(path, newline="", encoding=encoding) as fh:
+        reader = csv.reader(fh, delimiter=sep)
+        columns = next(reader, None)
+        if columns is None:
+            return
+        for values in reader:
+            if not values:  # pandas skips empty lines
+                continue
+            values += [""] * (len(columns) - len(values))
+            yield {col: value if value != "" else None for col, value in zip(columns, values)}
+
+
+def _iter_parquet_rows(path: Path, batch_size: int = 1024) -> Iterator[Dict[str, Any]]:
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def split_row(row: Mapping[str, Any]) -> tuple[Dict[str, str], Dict[str, Any]]:
+    """Text and numeric views of one streamed row, matching what read_frames gives per row."""
+    text = {col: "" if value is None else str(value) for col, value in row.items()}
+    numbers = {col: row.get(col) for col in NUMERIC_COLUMNS}
+    return text, numbers
+
+
+def validate_row(row: int, text: Mapping[str, str], numbers: Mapping[str, Any]) -> List[RowError]:
+    """Scalar counterpart of ExcelService._validate_frame for streamed rows; same errors, same order."""
+    errors: List[RowError] = []
+    amounts: Dict[str, Decimal] = {}
+    for col in AMOUNT_COLUMNS:
+        try:
+            amounts[col] = to_decimal(numbers[col])
+        except InvalidOperation as exc:
+            errors.append(RowError(row, col, f"{col}: {exc}"))
+            amounts[col] = Decimal("0")
+
+    quantity = amounts["Cantidad"]
+    subtotal = amounts["Subtotal del Concepto"]
+    iva = amounts["IVA del Concepto"]
+    total = amounts["Total del Concepto"]
+    if quantity <= 0:
+        errors.append(RowError(row, "Cantidad", "Cantidad debe ser mayor a 0"))
+    negative = next((col for col in NEGATIVE_CHECK_COLUMNS if amounts[col] < 0), None)
+    if negative:
+        errors.append(RowError(row, negative, "Importes no pueden ser negativos"))
+    if (total - (subtotal + iva)).copy_abs() > Decimal(str(TOTAL_TOLERANCE)):
+        errors.append(RowError(row, "Total del Concepto", "Total no cuadra con Subtotal + IVA (tolerancia 0.02)"))
+    for col, message in REQUIRED_TEXT_COLUMNS:
+        if not text[col].strip():
+            errors.append(RowError(row, col, message))
+    return errors
+
+
+def _amount_column(raw: pd.Series) -> tuple[np.ndarray, Dict[int, str]]:
+    """Float view of an amount column (0 where empty or invalid) and the `to_decimal` error of each
+    invalid cell by position. Coercion is vectorized; `to_decimal` only sees the cells pandas can't
+    turn into a finite number, and booleans, so both modes accept and reject the same cells."""
+    present = raw.notna().to_numpy()
+    values = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=float, na_value=np.nan, copy=True)
+    suspect = present & ~np.isfinite(values)
+    if pd.api.types.infer_dtype(raw, skipna=True) not in PLAIN_NUMBER_KINDS:
+        suspect |= np.fromiter((isinstance(v, (bool, np.bool_)) for v in raw), dtype=bool, count=len(raw))
+    values[~present] = 0.0
+    problems: Dict[int, str] = {}
+    for pos in np.flatnonzero(suspect).tolist():
+        try:
+            values[pos] = float(to_decimal(raw.iat[pos]))
+        except InvalidOperation as exc:
+            values[pos] = 0.0
+            problems[pos] = str(exc)
+    return values, problems
+
+
+def _quantized(values: np.ndarray) -> np.ndarray:
+    """`float(to_decimal(v))` for every value, converting each distinct amount once."""
+    distinct, inverse = np.unique(values, return_inverse=True)
+    return np.array([float(to_decimal(v)) for v in distinct.tolist()], dtype=float)[inverse]
+
+
+def _settle(mask: np.ndarray, borderline: np.ndarray, exact: Callable[[int], bool]) -> np.ndarray:
+    """`mask` with the `borderline` rows decided by `exact`, a Decimal check by row position."""
+    for pos in np.flatnonzero(borderline).tolist():
+        mask[pos] = exact(pos)
+    return mask
+
+
+def build_item(text: Mapping[str, Any], numbers: Mapping[str, Any]) -> Dict[str, Any]:
+    return _item(text, {col: float(to_decimal(numbers[col])) for col in AMOUNT_COLUMNS})
+
+
+def _item(text: Mapping[str, Any], amounts: Mapping[str, float]) -> Dict[str, Any]:
+    """Payload item from the row's text and its amounts, already rounded as `to_decimal` does."""
+    subtotal = amounts["Subtotal del Concepto"]
+    iva = amounts["IVA del Concepto"]
+    item = {
+        "ProductCode": str(text["ClaveProdServ"]).strip(),
+        "Description": str(text["Concepto"]).strip(),
+        "IdentificationNumber": str(text["Pedido"]).strip(),
+        "UnitCode": str(text["ClaveUnidad"]).strip(),
+        "Unit": str(text["Unidad"]).strip(),
+        "Quantity": amounts["Cantidad"],
+        "UnitPrice": amounts["Precio Unitario"],
+        "Subtotal": subtotal,
+        "TaxObject": str(text["Objeto Impuesto"]).strip(),
+        "Taxes": [],
+        "Total": amounts["Total del Concepto"],
+    }
+    if iva > 0:
+        item["Taxes"].append(
+            {
+                "Name": "IVA",
+                "Rate": 0.16,
+                "IsRetention": False,
+                "Base": subtotal,
+                "Total": iva,
+            }
+        )
+    return item
+
+
+def compute_totals(items: Iterable[Mapping[str, Any]]) -> Dict[str, float]:
+    subtotal = iva = total = Decimal("0")
+    for item in items:
+        subtotal += to_decimal(item["Subtotal"])
+        iva += sum((to_decimal(tax["Total"]) for tax in item.get("Taxes") or []), Decimal("0"))
+        total += to_decimal(item["Total"])
+    return {"subtotal": float(subtotal), "iva": float(iva), "total": float(total)}
+
+
+def _json_size(value: Any) -> int:
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def split_items(
+    items: Sequence[Dict[str, Any]], max_items: int = 0, max_bytes: int = 0, base_bytes: int = 0
+) -> List[List[Dict[str, Any]]]:
+    """Group items into consecutive chunks of at most `max_items` items whose serialized size plus
+    `base_bytes` (the rest of the payload) stays under `max_bytes`. 0 disables a limit; an item
+    that alone exceeds `max_bytes` gets a chunk of its own."""
+    chunks: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    size = base_bytes
+    for item in items:
+        item_bytes = _json_size(item) + 1  # separator
+        full = (max_items and len(current) >= max_items) or (max_bytes and size + item_bytes > max_bytes)
+        if current and full:
+            chunks.append(current)
+            current, size = [], base_bytes
+        current.append(item)
+        size += item_bytes
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+
 class ExcelService:
-    def __init__(self, storage_dir: Path | None = None):
+    def __init__(
+        self, storage_dir: Path | None = None, reader_engine: str | None = None, streaming: bool | None = None
+    ):
         self.storage_dir = storage_dir or settings.facturas_storage_dir
+        self.reader_engine = reader_engine or settings.excel_reader_engine
+        self.streaming = settings.excel_streaming if streaming is None else streaming
 
     def _validate_columns(self, df: pd.DataFrame) -> List[str]:
         missing = [col for col in EXPECTED_COLUMNS if col not in df.columns]
@@ -102,100 +443,101 @@ class ExcelService:
         expedition_place: Optional[str] = None,
         observations: Optional[str] = None,
     ) -> ExcelProcessingResult:
-        errors: List[str] = []
+        return self.build(self.parse(excel_path), serie, folio, issue_date, expedition_place, observations)
+
+    def parse(self, excel_path: Path) -> ParsedUpload:
+        """Read and validate the rows; everything here depends only on the file content."""
+        try:
+            fmt = detect_format(excel_path)
+        except OSError as exc:
+            logger.exception("No se pudo abrir el archivo %s", excel_path)
+            return ParsedUpload([f"No se pudo leer el archivo: {exc}"])
+        if self.streaming:
+            return self._parse_stream(excel_path, fmt)
         try:
-            df = pd.read_excel(excel_path, dtype=str)
-        except Exception as exc:  # broad: excel parsing errors
-            logger.exception("No se pudo leer el Excel %s", excel_path)
-            return ExcelProcessingResult(False, [f"No se pudo leer el Excel: {exc}"])
+            df, df_numbers = read_frames(excel_path, self.reader_engine, fmt)
+        except Exception as exc:  # broad: excel/csv/parquet parsing errors
+            logger.exception("No se pudo leer el archivo %s", excel_path)
+            return ParsedUpload([f"No se pudo leer el {INPUT_FORMATS[fmt]}: {exc}"])
 
         missing = self._validate_columns(df)
         if missing:
-            return ExcelProcessingResult(False, [f"Faltan columnas requeridas: {', '.join(missing)}"])
+            return ParsedUpload([f"Faltan columnas requeridas: {', '.join(missing)}"])
+        if df.empty:
+            return ParsedUpload(["El archivo no contiene conceptos"])
+
+        row_errors = self._validate_frame(df, df_numbers)
+        if row_errors:
+            error_excel_path = self._build_error_report(
+                excel_path, fmt, list(df.columns), df.itertuples(index=False, name=None), row_errors
+            )
+            return ParsedUpload(format_row_errors(row_errors), row_errors=row_errors, error_excel_path=error_excel_path)
+
+        return ParsedUpload([], items=self._build_items(df, df_numbers), header=df.iloc[0].to_dict())
+
+    def _parse_stream(self, excel_path: Path, fmt: str) -> ParsedUpload:
+        """Validate row by row without loading the sheet or building DataFrames. The built items
+        are still all kept (the payload needs them, split later by CFDI_MAX_ITEMS/CFDI_MAX_BYTES),
+        so memory grows with the number of valid rows; they are dropped at the first invalid one."""
+        rows = iter_rows(excel_path, fmt)
+        try:
+            first_row = next(rows, None)
+        except Exception as exc:  # broad: excel/csv/parquet parsing errors
+            logger.exception("No se pudo leer el archivo %s", excel_path)
+            return ParsedUpload([f"No se pudo leer el {INPUT_FORMATS[fmt]}: {exc}"])
+        if first_row is None:
+            return ParsedUpload(["El archivo no contiene conceptos"])
+        missing = [col for col in EXPECTED_COLUMNS if col not in first_row]
+        if missing:
+            rows.close()
+            return ParsedUpload([f"Faltan columnas requeridas: {', '.join(missing)}"])
 
-        # Keep numeric fields as decimals
-        df_numbers = pd.read_excel(excel_path)
-        error_rows: List[str] = []
+        header, _ = split_row(first_row)
+        columns = list(first_row)
+        row_errors: List[RowError] = []
         items: List[Dict[str, Any]] = []
-        tolerance = Decimal("0.02")
-
-        for idx, row in df.iterrows():
-            row_num = idx + 2  # account header
-            row_errors = []
-            numeric_row = df_numbers.iloc[idx]
-
-            def _dec(col: str) -> Decimal:
-                try:
-                    return to_decimal(numeric_row[col])
-                except InvalidOperation as exc:
-                    row_errors.append(f"{col}: {exc}")
-                    return Decimal("0")
-
-            quantity = _dec("Cantidad")
-            subtotal = _dec("Subtotal del Concepto")
-            iva = _dec("IVA del Concepto")
-            total = _dec("Total del Concepto")
-
-            if quantity <= 0:
-                row_errors.append("Cantidad debe ser mayor a 0")
-            if subtotal < 0 or iva < 0 or total < 0:
-                row_errors.append("Importes no pueden ser negativos")
-
-            if (total - (subtotal + iva)).copy_abs() > tolerance:
-                row_errors.append("Total no cuadra con Subtotal + IVA (tolerancia 0.02)")
-
-            identification_number = str(row.get("Pedido", "")).strip()
-            if not identification_number:
-                row_errors.append("Pedido es obligatorio (IdentificationNumber)")
-
-            tax_object = str(row.get("Objeto Impuesto", "")).strip()
-            product_code = str(row.get("ClaveProdServ", "")).strip()
-            unit_code = str(row.get("ClaveUnidad", "")).strip()
-            if not product_code:
-                row_errors.append("ClaveProdServ requerida")
-            if not unit_code:
-                row_errors.append("ClaveUnidad requerida")
-            if not tax_object:
-                row_errors.append("Objeto Impuesto requerido")
-
-            if row_errors:
-                error_rows.append(f"Fila {row_num}: " + "; ".join(row_errors))
-
-            item = {
-                "ProductCode": product_code,
-                "Description": str(row.get("Concepto", "")).strip(),
-                "IdentificationNumber": identification_number,
-                "UnitCode": unit_code,
-                "Unit": str(row.get("Unidad", "")).strip(),
-                "Quantity": float(quantity),
-                "UnitPrice": float(to_decimal(numeric_row["Precio Unitario"])),
-                "Subtotal": float(subtotal),
-                "TaxObject": tax_object,
-                "Taxes": [],
-                "Total": float(total),
-            }
-            if iva > 0:
-                item["Taxes"].append(
-                    {
-                        "Name": "IVA",
-                        "Rate": 0.16,
-                        "IsRetention": False,
-                        "Base": float(subtotal),
-                        "Total": float(iva),
-                    }
-                )
-            items.append(item)
-
-        if error_rows:
-            errors.extend(error_rows)
-            error_excel_path = self._build_error_excel(df, error_rows, excel_path)
-            return ExcelProcessingResult(False, errors, error_excel_path=error_excel_path)
-
-        payment_form = normalize_payment_form(df.iloc[0]["Forma de Pago"])
-        payment_method = str(df.iloc[0]["Metodo de Pago"]).strip().upper()
+        try:
+            for idx, row in enumerate(chain([first_row], rows)):
+                text, numbers = split_row(row)
+                errors = validate_row(idx, text, numbers)
+                if errors:
+                    row_errors.extend(errors)
+                    items.clear()  # the payload will not be built; stop keeping items around
+                elif not row_errors:
+                    items.append(build_item(text, numbers))
+        except Exception as exc:  # broad: excel/csv/parquet parsing errors
+            logger.exception("No se pudo leer el archivo %s", excel_path)
+            return ParsedUpload([f"No se pudo leer el {INPUT_FORMATS[fmt]}: {exc}"])
+
+        if row_errors:
+            error_excel_path = self._build_error_report(
+                excel_path, fmt, columns, iter_rows_values(excel_path, fmt), row_errors
+            )
+            return ParsedUpload(format_row_errors(row_errors), row_errors=row_errors, error_excel_path=error_excel_path)
+
+        return ParsedUpload([], items=items, header=header)
+
+    def build(
+        self,
+        parsed: ParsedUpload,
+        serie: str,
+        folio: int,
+        issue_date: date,
+        expedition_place: Optional[str] = None,
+        observations: Optional[str] = None,
+    ) -> ExcelProcessingResult:
+        """Assemble the CFDI payload for this serie/folio/date from an already parsed upload."""
+        if not parsed.valid:
+            return ExcelProcessingResult(
+                False, parsed.errors, error_excel_path=parsed.error_excel_path, row_errors=parsed.row_errors
+            )
+        header = parsed.header
+        errors: List[str] = []
+        payment_form = normalize_payment_form(header["Forma de Pago"])
+        payment_method = str(header["Metodo de Pago"]).strip().upper()
         if payment_method not in {"PUE", "PPD"}:
             errors.append("Metodo de Pago debe ser PUE o PPD")
-        expedition_cp = normalize_cp(expedition_place or df.iloc[0]["CP"])
+        expedition_cp = normalize_cp(expedition_place or header["CP"])
         if not expedition_cp:
             errors.append("Código Postal (Lugar de expedición) requerido")
 
@@ -214,43 +556,195 @@ class ExcelService:
             "ExpeditionPlace": expedition_cp,
             "Currency": "MXN",
             "Date": issue_date.isoformat(),
-            "Observations": observations or str(df.iloc[0].get("Observaciones", "")).strip(),
+            "Observations": observations or str(header.get("Observaciones", "")).strip(),
             "Receiver": {
-                "Rfc": str(df.iloc[0]["RFC"]).strip(),
-                "Name": str(df.iloc[0]["Razon Social"]).strip(),
-                "CfdiUse": str(df.iloc[0]["UsoCFDI"]).strip(),
-                "FiscalRegime": str(df.iloc[0]["Fiscal Regime"]).strip(),
-                "TaxZipCode": normalize_cp(df.iloc[0]["CP"]),
-                "Email": str(df.iloc[0].get("Mail", "")).strip(),
+                "Rfc": str(header["RFC"]).strip(),
+                "Name": str(header["Razon Social"]).strip(),
+                "CfdiUse": str(header["UsoCFDI"]).strip(),
+                "FiscalRegime": str(header["Fiscal Regime"]).strip(),
+                "TaxZipCode": normalize_cp(header["CP"]),
+                "Email": str(header.get("Mail", "")).strip(),
             },
             "GlobalInformation": {
-                "Periodicity": str(df.iloc[0]["Periodicidad"]).strip(),
-                "Months": str(df.iloc[0]["Mes"]).strip(),
-                "Year": int(to_decimal(df_numbers.iloc[0]["Year"])),
+                "Periodicity": str(header["Periodicidad"]).strip(),
+                "Months": str(header["Mes"]).strip(),
+                "Year": int(to_decimal(header["Year"] or None)),
             },
-            "Items": items,
+            "Items": list(parsed.items),
         }
 
         return ExcelProcessingResult(True, [], payload=payload)
 
-    def _build_error_excel(self, df: pd.DataFrame, row_errors: List[str], source_path: Path) -> Path:
-        df_errors = df.copy()
-        error_col: List[str] = [""] * len(df_errors)
+    def _validate_frame(self, df: pd.DataFrame, df_numbers: pd.DataFrame) -> List[RowError]:
+        """Run every row check as a column mask; errors come out ordered by row, then by check."""
+        # (row mask, column, message); column/message may be callables of the row position.
+        checks: List[tuple[np.ndarray, Any, Any]] = []
+        amounts: Dict[str, np.ndarray] = {}
+        invalid: Dict[str, Dict[int, str]] = {}
+        for col in AMOUNT_COLUMNS:
+            amounts[col], invalid[col] = _amount_column(df_numbers[col])
+            mask = np.zeros(len(df), dtype=bool)
+            mask[list(invalid[col])] = True
+            checks.append((mask, col, lambda pos, col=col: f"{col}: {invalid[col][pos]}"))
+
+        def exact(col: str, pos: int) -> Decimal:
+            return Decimal("0") if pos in invalid[col] else to_decimal(df_numbers[col].iat[pos])
+
+        def exact_mismatch(pos: int) -> bool:
+            subtotal, iva = exact("Subtotal del Concepto", pos), exact("IVA del Concepto", pos)
+            return (exact("Total del Concepto", pos) - (subtotal + iva)).copy_abs() > Decimal(str(TOTAL_TOLERANCE))
+
+        quantity = amounts["Cantidad"]
+        subtotal = amounts["Subtotal del Concepto"]
+        iva = amounts["IVA del Concepto"]
+        total = amounts["Total del Concepto"]
+        not_positive = _settle(
+            quantity < HALF_STEP, np.abs(quantity - HALF_STEP) < EXACT_BAND, lambda pos: exact("Cantidad", pos) <= 0
+        )
+        checks.append((not_positive, "Cantidad", "Cantidad debe ser mayor a 0"))
+        negatives = np.column_stack(
+            [
+                _settle(
+                    amounts[col] <= -HALF_STEP,
+                    np.abs(amounts[col] + HALF_STEP) < EXACT_BAND,
+                    lambda pos, col=col: exact(col, pos) < 0,
+                )
+                for col in NEGATIVE_CHECK_COLUMNS
+            ]
+        )
+        difference = np.abs(total - (subtotal + iva))
+        mismatch = _settle(
+            difference > TOTAL_TOLERANCE, np.abs(difference - TOTAL_TOLERANCE) < EXACT_BAND, exact_mismatch
+        )
+        checks.append(
+            (
+                negatives.any(axis=1),
+                lambda pos: NEGATIVE_CHECK_COLUMNS[int(negatives[pos].argmax())],
+                "Importes no pueden ser negativos",
+            )
+        )
+        checks.append(
+            (
+                mismatch,
+                "Total del Concepto",
+                "Total no cuadra con Subtotal + IVA (tolerancia 0.02)",
+            )
+        )
+        for col, message in REQUIRED_TEXT_COLUMNS:
+            checks.append(((df[col].str.strip() == "").to_numpy(), col, message))
+
+        row_errors: List[RowError] = []
+        for mask, column, message in checks:
+            for pos in np.flatnonzero(mask):
+                pos = int(pos)
+                row_errors.append(
+                    RowError(
+                        pos,
+                        column(pos) if callable(column) else column,
+                        message(pos) if callable(message) else message,
+                    )
+                )
+        row_errors.sort(key=lambda err: err.row)  # stable: keeps check order within a row
+        return row_errors
+
+    def _build_items(self, df: pd.DataFrame, df_numbers: pd.DataFrame) -> List[Dict[str, Any]]:
+        text_cols = ["ClaveProdServ", "Concepto", "Pedido", "ClaveUnidad", "Unidad", "Objeto Impuesto"]
+        # Plain column lists zipped into dicts: much faster than DataFrame.to_dict("records").
+        text_values = zip(*(df[col].tolist() for col in text_cols))
+        amount_values = zip(*(_quantized(_amount_column(df_numbers[col])[0]).tolist() for col in AMOUNT_COLUMNS))
+        return [
+            _item(dict(zip(text_cols, text)), dict(zip(AMOUNT_COLUMNS, amounts)))
+            for text, amounts in zip(text_values, amount_values)
+        ]
+
+    def build_bulk_error_report(self, entries: Iterable[Sequence[Any]]) -> Path:
+        """One workbook for a bulk run: a row per (file, row, column, error) of the files that failed."""
+        target = self.storage_dir / f"lote_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_errores.xlsx"
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Errores")
+        sheet.append(["Archivo", "Fila", "Columna", "Error"])
+        for filename, row, column, message in entries:
+            message_cell = WriteOnlyCell(sheet, value=message)
+            message_cell.font = ERROR_FONT
+            sheet.append([filename, row, column, message_cell])
+        workbook.save(target)
+        return target
+
+    def _build_error_report(
+        self,
+        source_path: Path,
+        fmt: str,
+        columns: List[str],
+        rows: Iterable[Sequence[Any]],
+        row_errors: List[RowError],
+    ) -> Path:
+        """Write the uploaded rows plus an "Errores" column, one row at a time, in the upload's format."""
+        errors_by_row: Dict[int, List[RowError]] = defaultdict(list)
         for err in row_errors:
-            # err format: "Fila 3: msg"
-            try:
-                parts = err.split(":")
-                row_num = int(parts[0].replace("Fila", "").strip())
-                idx = row_num - 2
-                error_col[idx] = parts[1].strip()
-            except Exception:
-                logger.debug("No se pudo mapear error a fila: %s", err)
-        df_errors["Errores"] = error_col
-        target = self.storage_dir / f"{source_path.stem}_errores.xlsx"
+            errors_by_row[err.row].append(err)
+        target = self.storage_dir / f"{source_path.stem}_errores.{fmt}"
         try:
-            df_errors.to_excel(target, index=False)
-        except Exception as exc:
-            logger.exception("No se pudo generar Excel de errores")
-            target = source_path.with_name(source_path.stem + "_errores_fallback.xlsx")
-            df_errors.to_excel(target, index=False)
+            self._write_error_report(target, source_path, fmt, columns, rows, errors_by_row)
+        except Exception:
+            logger.exception("No se pudo generar archivo de errores")
+            target = source_path.with_name(f"{source_path.stem}_errores_fallback.{fmt}")
+            self._write_error_report(target, source_path, fmt, columns, iter_rows_values(source_path, fmt), errors_by_row)
         return target
+
+    def _write_error_report(
+        self,
+        target: Path,
+        source_path: Path,
+        fmt: str,
+        columns: List[str],
+        rows: Iterable[Sequence[Any]],
+        errors_by_row: Mapping[int, List[RowError]],
+    ) -> None:
+        header = [*columns, "Errores"]
+        annotated = (
+            (idx, values, errors_by_row.get(idx, []), "; ".join(err.message for err in errors_by_row.get(idx, [])))
+            for idx, values in enumerate(rows)
+        )
+        if fmt == "csv":
+            encoding, sep = csv_dialect(source_path)
+            with open(target, "w", newline="", encoding=encoding) as fh:
+                writer = csv.writer(fh, delimiter=sep)
+                writer.writerow(header)
+                for _, values, _, message in annotated:
+                    writer.writerow([*("" if value is None else value for value in values), message])
+        elif fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.schema([(col, pa.string()) for col in header])
+            with pq.ParquetWriter(target, schema) as writer:
+                batch: List[List[Any]] = []
+                for _, values, _, message in annotated:
+                    batch.append([*(None if value is None else str(value) for value in values), message])
+                    if len(batch) >= 1024:
+                        writer.write_table(pa.Table.from_pylist([dict(zip(header, row)) for row in batch], schema=schema))
+                        batch.clear()
+                if batch:
+                    writer.write_table(pa.Table.from_pylist([dict(zip(header, row)) for row in batch], schema=schema))
+        else:
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("Errores")
+            sheet.append(header)
+            for _, values, errors, message in annotated:
+                if not errors:
+                    sheet.append([*values, ""])
+                    continue
+                bad_columns = {err.column for err in errors}
+                cells: List[Any] = []
+                for col, value in zip(columns, values):
+                    if col in bad_columns:
+                        cell = WriteOnlyCell(sheet, value=value)
+                        cell.fill = ERROR_FILL
+                        cell.font = ERROR_FONT
+                        cells.append(cell)
+                    else:
+                        cells.append(value)
+                message_cell = WriteOnlyCell(sheet, value=message)
+                message_cell.font = ERROR_FONT
+                sheet.append([*cells, message_cell])
+            workbook.save(target)
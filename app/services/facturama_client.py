@@ -1,11 +1,21 @@
+import asyncio
 import base64
+import math
+import os
+import random
+import re
+import time
+from datetime import date, timedelta
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
 
 import httpx
 from loguru import logger
 
 from app.core.config import settings
+from app.core.rate_limit import RateLimiter, RateLimitExceeded
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
 
 
 class FacturamaError(Exception):
@@ -18,22 +28,286 @@ class FacturamaError(Exception):
         self.url = url
 
 
+class CircuitOpenError(FacturamaError):
+    pass
+
+
+class RateLimitedError(FacturamaError):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast after `threshold` consecutive Facturama failures (5xx, 429, timeouts, connection
+    errors). After `reset_timeout` seconds open it lets a single probe request through: success
+    closes it again, failure reopens it. Client errors (4xx) mean the API is up and count as success.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    def before_request(self) -> None:
+        if self.state == "closed" or self.threshold <= 0:
+            return
+        if self.state == "open":
+            remaining = self.opened_at + self.reset_timeout - self.clock()
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"Facturama no está respondiendo; se volverá a intentar en {math.ceil(remaining)} s."
+                )
+            self.state = "half_open"
+            self._probing = False
+        if self._probing:
+            raise CircuitOpenError("Facturama no está respondiendo; se está verificando su disponibilidad.")
+        self._probing = True
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info("Facturama responde de nuevo; circuito cerrado")
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.threshold > 0 and (self.state == "half_open" or self.failures >= self.threshold):
+            if self.state != "open":
+                logger.warning("Circuito de Facturama abierto tras {} fallos seguidos", self.failures)
+            self.state = "open"
+            self.opened_at = self.clock()
+
+    def release(self) -> None:
+        """Give up a probe slot without an outcome (e.g. the request was cancelled)."""
+        self._probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        retry_in = None
+        if self.state == "open":
+            retry_in = max(round(self.opened_at + self.reset_timeout - self.clock(), 1), 0)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "threshold": self.threshold,
+            "retry_in_seconds": retry_in,
+        }
+
+
+breaker = CircuitBreaker(settings.facturama_breaker_threshold, settings.facturama_breaker_reset)
+limiter = RateLimiter(
+    {
+        "create": (settings.facturama_rate_create, settings.facturama_rate_burst),
+        "query": (settings.facturama_rate_query, settings.facturama_rate_burst),
+        "download": (settings.facturama_rate_download, settings.facturama_rate_burst),
+    },
+    settings.facturama_rate_max_wait,
+)
+
+
+class HttpPool:
+    """Shared httpx.AsyncClient (keep-alive connection pool) for all Facturama calls in this worker.
+
+    Opened on app startup and closed on shutdown. Used outside the app (scripts, tests) it is
+    created lazily, and again if the event loop changed, since connections belong to a loop.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None):
+        self.transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _build(self) -> httpx.AsyncClient:
+        http2 = settings.facturama_http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("FACTURAMA_HTTP2 activo pero falta el paquete h2; se usa HTTP/1.1")
+                http2 = False
+        return httpx.AsyncClient(
+            transport=self.transport,
+            http2=http2,
+            timeout=httpx.Timeout(settings.facturama_timeout, connect=settings.facturama_connect_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.facturama_max_connections,
+                max_keepalive_connections=settings.facturama_max_keepalive,
+                keepalive_expiry=settings.facturama_keepalive_expiry,
+            ),
+        )
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = self._build()
+            self._loop = loop
+        return self._client
+
+    async def start(self) -> None:
+        self.client()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+
+http_pool = HttpPool()
+
+
+def _timeout(seconds: float) -> httpx.Timeout:
+    return httpx.Timeout(seconds, connect=min(settings.facturama_connect_timeout, seconds))
+
+
+def _retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), settings.facturama_retry_backoff_max)
+    # full jitter: spread retries from several workers instead of hitting the API in step
+    ceiling = settings.facturama_retry_backoff * 2 ** (attempt - 1)
+    return random.uniform(0, min(ceiling, settings.facturama_retry_backoff_max))
+
+
+def date_windows(start: date, end: date, days: int) -> List[Tuple[date, date]]:
+    """Split [start, end] into windows of `days` days. Consecutive windows share their boundary
+    day so nothing is missed whether Facturama treats dateEnd as inclusive or not; the overlap is
+    removed when merging by Id."""
+    if days <= 0 or (end - start).days <= days:
+        return [(start, end)]
+    windows = []
+    current = start
+    while current < end:
+        window_end = min(current + timedelta(days=days), end)
+        windows.append((current, window_end))
+        current = window_end
+    return windows
+
+
+def cfdi_rows(response: Any) -> List[Dict[str, Any]]:
+    if isinstance(response, dict) and "Data" in response:
+        return response.get("Data") or []
+    if isinstance(response, list):
+        return response
+    raise FacturamaError("Respuesta inesperada de Facturama.", details={"response": response})
+
+
+class _ContentDecoder:
+    """Pulls the base64 `Content` string out of a JSON body fed in chunks and writes it decoded
+    to `sink`, so neither the whole string nor the whole decoded document is held in memory."""
+
+    KEY = re.compile(rb'"[Cc]ontent"\s*:\s*"')
+
+    def __init__(self, sink: BinaryIO):
+        self.sink = sink
+        self.state = "key"  # key -> value -> done
+        self.buffer = b""
+        self.pending = b""
+        self.written = 0
+
+    def feed(self, chunk: bytes) -> None:
+        if self.state == "done":
+            return
+        if self.state == "key":
+            self.buffer += chunk
+            match = self.KEY.search(self.buffer)
+            if not match:
+                self.buffer = self.buffer[-32:]  # the key may be split across chunks
+                return
+            chunk, self.buffer, self.state = self.buffer[match.end() :], b"", "value"
+        end = chunk.find(b'"')
+        if end != -1:
+            chunk, self.state = chunk[:end], "done"
+        data = self.pending + chunk.replace(b"\\", b"")  # JSON may escape "/" as "\/"
+        cut = len(data) if self.state == "done" else len(data) - len(data) % 4
+        self.pending = data[cut:]
+        if cut:
+            self.written += self.sink.write(base64.b64decode(data[:cut], validate=True))
+
+    def close(self) -> None:
+        if self.state == "value":
+            raise ValueError("Respuesta truncada: el contenido base64 no terminó")
+
+
 class FacturamaClient:
-    def __init__(self):
+    def __init__(
+        self, pool: HttpPool | None = None, circuit: CircuitBreaker | None = None, rate_limiter: RateLimiter | None = None
+    ):
         self.base_url = settings.facturama_base_url.rstrip("/")
         self.auth = (settings.facturama_user, settings.facturama_password.get_secret_value())
-        self.timeout = httpx.Timeout(30.0)
+        self.pool = pool or http_pool
+        self.circuit = circuit or breaker
+        self.rate_limiter = rate_limiter or limiter
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        timeout: float | None = None,
+        stream: bool = False,
+        bucket: str | None = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """Send a request through the shared pool and circuit breaker and raise FacturamaError on
+        an error status. Each attempt first takes a token from the rate-limit `bucket`, waiting
+        in line if the shared quota is spent.
 
-    async def _request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        Only GETs are retried (5xx, 429, timeouts, connection errors) with jittered exponential
+        backoff; a POST such as create_cfdi is sent exactly once since it isn't idempotent. With
+        `stream=True` the body is left unread and the caller must close the response.
+        """
         url = f"{self.base_url}{path}"
-        async with httpx.AsyncClient(auth=self.auth, timeout=self.timeout) as client:
+        if timeout is not None:
+            kwargs["timeout"] = _timeout(timeout)
+        retries = settings.facturama_get_retries if method == "GET" else 0
+        attempt = 0
+        while True:
+            self.circuit.before_request()
             try:
-                response = await client.request(method, url, **kwargs)
+                if bucket:
+                    await self.rate_limiter.acquire(bucket)
+                client = self.pool.client()
+                request = client.build_request(method, url, **kwargs)
+                response = await client.send(request, auth=self.auth, stream=stream)
             except httpx.RequestError as exc:
+                self.circuit.record_failure()
+                if attempt < retries:
+                    attempt += 1
+                    delay = _retry_delay(attempt)
+                    logger.warning("Error de conexión con Facturama ({}); reintento {} en {:.1f}s", exc, attempt, delay)
+                    await asyncio.sleep(delay)
+                    continue
                 logger.exception("HTTP request error to Facturama")
                 raise FacturamaError("No se pudo contactar Facturama", details=str(exc), url=url) from exc
+            except RateLimitExceeded as exc:
+                self.circuit.release()
+                raise RateLimitedError(
+                    "Hay demasiadas peticiones a Facturama en este momento; intenta de nuevo en unos segundos.",
+                    details=str(exc),
+                    url=url,
+                ) from exc
+            except BaseException:
+                self.circuit.release()
+                raise
+            if response.status_code not in RETRYABLE_STATUS:
+                self.circuit.record_success()
+                break
+            self.circuit.record_failure()
+            if attempt >= retries:
+                break
+            await response.aclose()
+            attempt += 1
+            delay = _retry_delay(attempt, response.headers.get("retry-after"))
+            logger.warning("Facturama respondió {}; reintento {} en {:.1f}s", response.status_code, attempt, delay)
+            await asyncio.sleep(delay)
 
         if response.status_code >= 400:
+            await response.aread()
+            await response.aclose()
             detail: Any | None = None
             try:
                 detail = response.json()
@@ -53,16 +327,57 @@ class FacturamaClient:
             raise FacturamaError(
                 message, status_code=response.status_code, details=error_payload, url=str(response.request.url)
             )
+        return response
+
+    async def _request(
+        self, method: str, path: str, timeout: float | None = None, bucket: str | None = None, **kwargs
+    ) -> Dict[str, Any]:
+        response = await self._send(method, path, timeout=timeout, bucket=bucket, **kwargs)
         if "application/json" in response.headers.get("content-type", ""):
             return response.json()
         return {"raw": response.content}
 
     async def create_cfdi(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        return await self._request("POST", "/3/cfdis", json=payload)
+        return await self._request(
+            "POST", "/3/cfdis", timeout=settings.facturama_create_timeout, bucket="create", json=payload
+        )
 
     async def list_cfdis(self, date_start: str, date_end: str, cfdi_type: str = "issued") -> Dict[str, Any]:
         params = {"type": cfdi_type, "dateStart": date_start, "dateEnd": date_end}
-        return await self._request("GET", "/cfdi", params=params)
+        return await self._request(
+            "GET", "/cfdi", timeout=settings.facturama_query_timeout, bucket="query", params=params
+        )
+
+    async def list_cfdis_range(self, date_start: str, date_end: str, cfdi_type: str = "issued") -> List[Dict[str, Any]]:
+        """List CFDIs for a date range, fetching ranges wider than `consultar_window_days` as
+        windows in parallel (at most `consultar_concurrency` at a time) and merging them by Id."""
+        try:
+            windows = date_windows(
+                date.fromisoformat(date_start), date.fromisoformat(date_end), settings.consultar_window_days
+            )
+        except ValueError:
+            return cfdi_rows(await self.list_cfdis(date_start, date_end, cfdi_type))
+        if len(windows) == 1:
+            return cfdi_rows(await self.list_cfdis(date_start, date_end, cfdi_type))
+
+        slots = asyncio.Semaphore(max(settings.consultar_concurrency, 1))
+
+        async def fetch(start: date, end: date) -> List[Dict[str, Any]]:
+            async with slots:
+                return cfdi_rows(await self.list_cfdis(start.isoformat(), end.isoformat(), cfdi_type))
+
+        pages = await asyncio.gather(*(fetch(start, end) for start, end in windows))
+        merged: List[Dict[str, Any]] = []
+        seen = set()
+        for rows in pages:
+            for row in rows:
+                key = row.get("Id") if isinstance(row, dict) else None
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                merged.append(row)
+        return merged
 
     async def download_document(
         self, cfdi_id: str, fmt: str, target_path: Optional[str] = None, cfdi_type: str = "issued"
@@ -71,54 +386,65 @@ class FacturamaClient:
         if fmt_lower not in {"pdf", "xml"}:
             raise FacturamaError(f"Formato no soportado: {fmt}")
         path = f"/api/Cfdi/{fmt_lower}/{cfdi_type}/{cfdi_id}"
-        try:
-            data = await self._request("GET", path)
-        except FacturamaError as exc:
-            if exc.status_code == 404:
-                logger.warning("No se encontró %s para CFDI %s (404)", fmt_upper := fmt_lower.upper(), cfdi_id)
-                return None
-            raise
-        content_b64 = data.get("Content") or data.get("content")
-        if not content_b64:
-            logger.warning("Facturama no devolvió contenido para %s (%s)", cfdi_id, fmt)
-            return None
-        if target_path:
-            try:
-                decoded = base64.b64decode(content_b64)
-                path_obj = Path(target_path)
-                path_obj.parent.mkdir(parents=True, exist_ok=True)
-                with open(path_obj, "wb") as f:
-                    f.write(decoded)
-            except Exception as exc:
-                logger.exception("No se pudo escribir archivo %s", target_path)
-                raise FacturamaError("No se pudo guardar archivo descargado", details=str(exc)) from exc
-            return target_path
-        return content_b64
+        return await self._download(path, target_path, fmt_lower.upper(), cfdi_id)
 
     async def download_zip(
         self, cfdi_id: str, target_path: Optional[str] = None, cfdi_type: str = "issued"
     ) -> Optional[str]:
-        path = f"/cfdi/zip"
+        return await self._download("/cfdi/zip", target_path, "ZIP", cfdi_id, params={"id": cfdi_id, "type": cfdi_type})
+
+    async def _download(
+        self, path: str, target_path: Optional[str], label: str, cfdi_id: str, params: Dict[str, str] | None = None
+    ) -> Optional[str]:
+        """Fetch a base64 document. With `target_path` the body is streamed and decoded in chunks
+        to a temporary file (off the event loop) that is renamed into place once complete; without
+        it the base64 string is returned. None if Facturama has no such document."""
         try:
-            data = await self._request("GET", path, params={"id": cfdi_id, "type": cfdi_type})
+            response = await self._send(
+                "GET", path, timeout=settings.facturama_download_timeout, stream=True, bucket="download", params=params
+            )
         except FacturamaError as exc:
             if exc.status_code == 404:
-                logger.warning("No se encontró ZIP para CFDI %s (404)", cfdi_id)
+                logger.warning("No se encontró {} para CFDI {} (404)", label, cfdi_id)
                 return None
             raise
-        content_b64 = data.get("Content") or data.get("content")
-        if not content_b64:
-            logger.warning("Facturama no devolvió contenido ZIP para %s", cfdi_id)
-            return None
-        if target_path:
+        if not target_path:
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            data = response.json()
+            content_b64 = data.get("Content") or data.get("content")
+            if not content_b64:
+                logger.warning("Facturama no devolvió contenido {} para {}", label, cfdi_id)
+                return None
+            return content_b64
+
+        target = Path(target_path)
+        partial = target.with_name(f".{target.name}.part")
+        try:
+            await asyncio.to_thread(target.parent.mkdir, parents=True, exist_ok=True)
+            sink = await asyncio.to_thread(open, partial, "wb")
             try:
-                decoded = base64.b64decode(content_b64)
-                path_obj = Path(target_path)
-                path_obj.parent.mkdir(parents=True, exist_ok=True)
-                with open(path_obj, "wb") as f:
-                    f.write(decoded)
-            except Exception as exc:
-                logger.exception("No se pudo escribir ZIP %s", target_path)
-                raise FacturamaError("No se pudo guardar ZIP descargado", details=str(exc)) from exc
-            return target_path
-        return content_b64
+                decoder = _ContentDecoder(sink)
+                async for chunk in response.aiter_bytes():
+                    await asyncio.to_thread(decoder.feed, chunk)
+                decoder.close()
+            finally:
+                await asyncio.to_thread(sink.close)
+            if not decoder.written:
+                await asyncio.to_thread(partial.unlink, missing_ok=True)
+                logger.warning("Facturama no devolvió contenido {} para {}", label, cfdi_id)
+                return None
+            await asyncio.to_thread(os.replace, partial, target)
+        except BaseException as exc:
+            partial.unlink(missing_ok=True)
+            if isinstance(exc, httpx.RequestError):
+                raise FacturamaError("No se pudo contactar Facturama", details=str(exc), url=path) from exc
+            if isinstance(exc, Exception):
+                logger.exception("No se pudo guardar {} {}", label, target_path)
+                raise FacturamaError(f"No se pudo guardar {label} descargado", details=str(exc)) from exc
+            raise
+        finally:
+            await response.aclose()
+        return target_path
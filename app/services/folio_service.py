@@ -1,8 +1,16 @@
-from sqlalchemy import func, select
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+from loguru import logger
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
+from app.core.db import SessionLocal
 from app.models.invoice import Invoice
-from app.models.series import Series, SeriesCounter
+from app.models.series import Series, SeriesCounter, SpareFolio
 
 
 class FolioServiceError(Exception):
@@ -22,31 +30,180 @@ class FolioService:
         return series
 
     def next_folio(self, code: str) -> int:
+        """Folio the next reservation would get (for display; use `reserve` to take it)."""
         self.ensure_series(code)
         counter = self.session.get(SeriesCounter, code)
-        if not counter:
-            max_success = (
-                self.session.scalar(
-                    select(func.max(Invoice.folio)).where(
-                        Invoice.serie == code, Invoice.status == "success"
-                    )
-                )
-                or 0
-            )
-            counter = SeriesCounter(series_code=code, last_folio=max_success)
-            self.session.add(counter)
+        return (counter.last_folio if counter else self._highest_folio(code)) + 1
+
+    def reserve(self, code: str, count: int = 1) -> int:
+        """Atomically take `count` consecutive folios and return the first one.
+
+        The counter is bumped with a single UPDATE…RETURNING (or SELECT…FOR UPDATE where the
+        backend has no RETURNING), so concurrent uploads on a serie never get the same folio.
+        Commits right away: the counter row stays locked only for the UPDATE, not while the CFDI
+        is stamped. The session must have nothing pending that shouldn't be committed.
+        """
+        self.ensure_series(code)
+        self._ensure_counter(code)
+        if self.session.get_bind().dialect.update_returning:
+            last = self.session.execute(
+                update(SeriesCounter)
+                .where(SeriesCounter.series_code == code)
+                .values(last_folio=SeriesCounter.last_folio + count)
+                .returning(SeriesCounter.last_folio)
+            ).scalar_one()
+        else:
+            counter = self.session.scalars(
+                select(SeriesCounter).where(SeriesCounter.series_code == code).with_for_update()
+            ).one()
+            counter.last_folio += count
             self.session.flush()
-        return counter.last_folio + 1
+            last = counter.last_folio
+        self.session.commit()
+        return last - count + 1
 
-    def commit_folio(self, code: str, folio: int) -> None:
+    def reclaim_failed(self, code: str) -> Optional[Invoice]:
+        """Take over the lowest folio of the serie whose stamping failed, so failed attempts
+        don't use up folios. The invoice is switched failed -> pending with a conditional UPDATE
+        (committed at once); None if there is none left to claim."""
+        candidates = self.session.scalars(
+            select(Invoice.id)
+            .where(Invoice.serie == code, Invoice.status == "failed")
+            .order_by(Invoice.folio)
+            .limit(5)
+        ).all()
+        for invoice_id in candidates:
+            claimed = self.session.execute(
+                update(Invoice).where(Invoice.id == invoice_id, Invoice.status == "failed").values(status="pending")
+            ).rowcount
+            self.session.commit()
+            if claimed:
+                return self.session.get(Invoice, invoice_id)
+        return None
+
+    def take_spare(self, code: str) -> Optional[int]:
+        """Take the lowest folio handed back with `release`, or None if there is none."""
+        candidates = self.session.scalars(
+            select(SpareFolio.folio).where(SpareFolio.series_code == code).order_by(SpareFolio.folio).limit(5)
+        ).all()
+        for folio in candidates:
+            taken = self.session.execute(
+                delete(SpareFolio).where(SpareFolio.series_code == code, SpareFolio.folio == folio)
+            ).rowcount
+            self.session.commit()
+            if taken:
+                return folio
+        return None
+
+    def release(self, code: str, folios: Iterable[int]) -> None:
+        """Hand back reserved folios that were never used. If they are the top of the counter it is
+        rewound; otherwise they are kept in `spare_folios` for the next reservations."""
+        folios = sorted(folios)
+        if not folios:
+            return
+        if folios == list(range(folios[0], folios[-1] + 1)):
+            rewound = self.session.execute(
+                update(SeriesCounter)
+                .where(SeriesCounter.series_code == code, SeriesCounter.last_folio == folios[-1])
+                .values(last_folio=folios[0] - 1)
+            ).rowcount
+            if rewound:
+                self.session.commit()
+                return
+        self.session.add_all(SpareFolio(series_code=code, folio=folio) for folio in folios)
+        self.session.commit()
+
+    def gaps(self, code: str, exclude: Iterable[int] = ()) -> List[int]:
+        """Folios up to the counter, from the first one used, that have no invoice and won't be
+        handed out again. Spare folios and `exclude` (e.g. blocks leased by this process) don't count."""
         counter = self.session.get(SeriesCounter, code)
         if not counter:
-            counter = SeriesCounter(series_code=code, last_folio=folio)
-            self.session.add(counter)
-        elif folio > counter.last_folio:
-            counter.last_folio = folio
-        self.session.flush()
+            return []
+        used = set(
+            self.session.scalars(
+                select(Invoice.folio).where(Invoice.serie == code, Invoice.folio <= counter.last_folio)
+            )
+        )
+        if not used:
+            return []
+        first = min(used)
+        used.update(self.session.scalars(select(SpareFolio.folio).where(SpareFolio.series_code == code)))
+        used.update(exclude)
+        return [folio for folio in range(first, counter.last_folio + 1) if folio not in used]
+
+    def release_gaps(self, code: str, exclude: Iterable[int] = ()) -> List[int]:
+        """Hand the reported `gaps` back with `release` (e.g. the block of a process that died) and
+        return them. Only safe while no other running process holds a leased block of the serie,
+        since its folios are reported as gaps too; a folio handed out twice fails on the
+        serie/folio unique index before anything is stamped."""
+        gaps = self.gaps(code, exclude)
+        self.release(code, gaps)
+        return gaps
+
+    def _highest_folio(self, code: str) -> int:
+        return self.session.scalar(select(func.max(Invoice.folio)).where(Invoice.serie == code)) or 0
+
+    def _ensure_counter(self, code: str) -> None:
+        if self.session.get(SeriesCounter, code):
+            return
+        self.session.add(SeriesCounter(series_code=code, last_folio=self._highest_folio(code)))
+        try:
+            self.session.commit()
+        except IntegrityError:  # created by a concurrent reservation
+            self.session.rollback()
 
     def list_series(self):
         stmt = select(Series).order_by(Series.code)
         return self.session.scalars(stmt).all()
+
+
+class FolioBlocks:
+    """Folios leased in blocks of `block_size` and handed out from memory (FOLIO_BLOCK_SIZE > 1).
+
+    Each process takes a whole block from `series_counters` at once, so a hot serie touches the
+    counter row once per block instead of once per CFDI. Folios still unused at shutdown are
+    handed back with `FolioService.release`; a process that dies leaves them as gaps, which the
+    /series page reports and can hand back (`FolioService.release_gaps`) once no other process
+    holds a block. Only single folios come from blocks: split uploads need consecutive folios and
+    reserve them directly.
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._free: Dict[str, Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.block_size > 1
+
+    def take(self, folio_service: FolioService, code: str) -> int:
+        with self._lock:
+            free = self._free.setdefault(code, deque())
+            if not free:
+                first = folio_service.reserve(code, self.block_size)
+                free.extend(range(first, first + self.block_size))
+                logger.info("Bloque de folios {} a {} apartado para la serie {}", first, free[-1], code)
+            return free.popleft()
+
+    def leased(self, code: str) -> List[int]:
+        with self._lock:
+            return list(self._free.get(code, ()))
+
+    def discard(self, code: str) -> None:
+        """Forget this process's block for `code` (after the counter was edited by hand)."""
+        with self._lock:
+            self._free.pop(code, None)
+
+    def release_all(self, session_factory: Callable[[], Session] = SessionLocal) -> None:
+        with self._lock:
+            free, self._free = self._free, {}
+        with session_factory() as session:
+            service = FolioService(session)
+            for code, folios in free.items():
+                if folios:
+                    service.release(code, folios)
+                    logger.info("{} folios sin usar de la serie {} devueltos", len(folios), code)
+
+
+folio_blocks = FolioBlocks(settings.folio_block_size)
@@ -1,25 +1,94 @@
+import asyncio
+import hashlib
 import json
-from datetime import date
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from uuid import uuid4
 
 from loguru import logger
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import select
+from sqlalchemy import delete, inspect, select, update
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
-from app.models.invoice import Invoice, InvoiceItem
-from app.services.excel_service import ExcelService, ExcelProcessingResult
+from app.core.workers import PoolBusyError, cpu_pool
+from app.models.invoice import IdempotencyClaim, Invoice, InvoiceItem
+from app.services.excel_service import ExcelService, ExcelProcessingResult, ParsedUpload, compute_totals, split_items
+from app.services.cfdi_cache import cfdi_cache
+from app.services.document_queue import document_queue, enqueue_documents
 from app.services.facturama_client import FacturamaClient, FacturamaError
-from app.services.folio_service import FolioService, FolioServiceError
+from app.services.folio_service import FolioService, FolioServiceError, folio_blocks
+from app.services.upload_cache import UploadCache, hash_file
+from app.services.upload_storage import StoredUpload
+
+Progress = Callable[[str, str], None]  # (stage, message), see stamp_jobs.STAGES
+
+IN_PROGRESS_ERROR = "Este archivo se está timbrando en otra solicitud. Revisa el Historial antes de reintentar."
+ABANDONED_ERROR = (
+    "Timbrado interrumpido antes de registrar la respuesta de Facturama; verifica en Facturama si el CFDI se emitió."
+)
+POLL_SECONDS = 1.0  # how often a duplicate request checks on the original
+
+
+def _no_progress(stage: str, message: str) -> None:
+    pass
+
+
+def idempotency_key(upload_hash: str, serie: str, issue_date: date, token: Optional[str] = None) -> str:
+    """Key stored on the invoices of one stamping request.
+
+    A client token (Idempotency-Key header or the form's hidden field) is scoped to the file, so
+    reusing it with another workbook is a new request. Without one, the same file, serie and
+    issue date are the same request.
+    """
+    parts = [token, upload_hash] if token else [upload_hash, serie, issue_date.isoformat()]
+    return hashlib.sha256(":".join(parts).encode("utf-8")).hexdigest()
+
+
+def fail_abandoned_invoices(session: Session, key: str) -> int:
+    """Mark the invoices of `key` still pending as failed, once the attempt that prepared them is
+    known to be gone, so the key stops looking in progress and `FolioService.reclaim_failed` can
+    reuse their folios. Doesn't commit; returns how many were marked."""
+    return session.execute(
+        update(Invoice)
+        .where(Invoice.idempotency_key == key, Invoice.status == "pending")
+        .values(status="failed", error_message=ABANDONED_ERROR)
+    ).rowcount
+
+
+class _KeyedLocks:
+    """asyncio locks by key, dropped once nobody holds or waits for them."""
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[None]:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key], self._locks[key]
+
+
+_in_flight = _KeyedLocks()
 
 
 class InvoicingService:
     def __init__(self, session: Session):
         self.session = session
         self.folio_service = FolioService(session)
+        self.folio_blocks = folio_blocks
         self.excel_service = ExcelService()
+        self.upload_cache = UploadCache()
         self.facturama = FacturamaClient()
 
     async def process_invoice(
@@ -29,43 +98,467 @@ class InvoicingService:
         issue_date: date,
         expedition_place: Optional[str] = None,
         observations: Optional[str] = None,
+        upload_hash: Optional[str] = None,
+        progress: Progress = _no_progress,
+        idempotency_token: Optional[str] = None,
     ) -> Dict[str, Any]:
+        """Parse, validate, reserve the folio and stamp one upload. `progress` is called as each
+        stage is reached (used by stamp jobs to report live status).
+
+        The folio is only reserved once the upload is valid, and the pending invoice is committed
+        before Facturama is called, so no database lock is held while the CFDI is stamped.
+
+        A request with the same idempotency key as one already stamped gets that result back
+        without reserving a folio or calling Facturama; while the first one is still running,
+        duplicates wait for it instead of racing it. The key is claimed in the database before
+        the upload is parsed, so this holds across worker processes too.
+        """
         try:
-            next_folio = self.folio_service.next_folio(serie)
+            self.folio_service.ensure_series(serie)
         except FolioServiceError as exc:
             return {"success": False, "errors": [str(exc)]}
 
-        excel_result: ExcelProcessingResult = self.excel_service.process(
-            excel_path, serie=serie, folio=next_folio, issue_date=issue_date, expedition_place=expedition_place, observations=observations
+        upload_hash = upload_hash or await asyncio.to_thread(hash_file, excel_path)
+        key = idempotency_key(upload_hash, serie, issue_date, idempotency_token)
+        async with _in_flight.hold(key):
+            owner = await self._claim(key)
+            if isinstance(owner, dict):
+                return owner
+            try:
+                replay = self._replay(key)
+                if replay is not None:
+                    logger.info("Solicitud repetida para {}: se devuelve el resultado original", excel_path.name)
+                    return replay
+                return await self._stamp_upload(
+                    excel_path, serie, issue_date, expedition_place, observations, upload_hash, key, progress
+                )
+            except Exception:
+                self.session.rollback()
+                raise
+            finally:
+                self._release_claim(key, owner)
+
+    async def _claim(self, key: str) -> str | Dict[str, Any]:
+        """Insert the `idempotency_claims` row for `key` and return its owner token.
+
+        If another attempt holds it, wait (up to IDEMPOTENCY_WAIT) for it to finish: the claim is
+        then taken and `_replay` answers with the original result. Claims older than
+        IDEMPOTENCY_CLAIM_TTL were left by a process that died and are taken over. Returns the
+        "still running" result when the wait runs out.
+        """
+        owner = uuid4().hex
+        deadline = time.monotonic() + settings.idempotency_wait
+        while True:
+            self.session.add(IdempotencyClaim(key=key, owner=owner))
+            try:
+                self.session.commit()
+                return owner
+            except IntegrityError:
+                self.session.rollback()
+            stale = datetime.utcnow() - timedelta(seconds=settings.idempotency_claim_ttl)
+            abandoned = self.session.execute(
+                delete(IdempotencyClaim).where(IdempotencyClaim.key == key, IdempotencyClaim.claimed_at < stale)
+            ).rowcount
+            self.session.commit()
+            if abandoned:
+                logger.warning("Timbrado abandonado con la clave {}: se retoma", key)
+                continue
+            if time.monotonic() >= deadline:
+                return {"success": False, "errors": [IN_PROGRESS_ERROR]}
+            await asyncio.sleep(POLL_SECONDS)
+
+    def _release_claim(self, key: str, owner: str) -> None:
+        self.session.execute(
+            delete(IdempotencyClaim).where(IdempotencyClaim.key == key, IdempotencyClaim.owner == owner)
+        )
+        self.session.commit()
+
+    async def _stamp_upload(
+        self,
+        excel_path: Path,
+        serie: str,
+        issue_date: date,
+        expedition_place: Optional[str],
+        observations: Optional[str],
+        upload_hash: str,
+        key: str,
+        progress: Progress,
+    ) -> Dict[str, Any]:
+        warnings = self._already_stamped_warnings(upload_hash)
+        try:
+            parsed = await self._parse_upload(excel_path, upload_hash)
+        except PoolBusyError as exc:
+            return {"success": False, "errors": [str(exc)], "warnings": warnings}
+        progress("parsed", f"{len(parsed.items)} conceptos leídos")
+        excel_result: ExcelProcessingResult = self.excel_service.build(
+            parsed,
+            serie=serie,
+            folio=0,
+            issue_date=issue_date,
+            expedition_place=expedition_place,
+            observations=observations,
         )
         if not excel_result.valid:
             return {
                 "success": False,
                 "errors": excel_result.errors,
                 "error_excel": str(excel_result.error_excel_path) if excel_result.error_excel_path else None,
+                "warnings": warnings,
             }
 
         payload = excel_result.payload or {}
-        existing_failed = self.session.scalar(
-            select(Invoice).where(
-                Invoice.serie == serie, Invoice.folio == next_folio, Invoice.status == "failed"
+        parts = self._split_payload(payload)
+        progress("validated", f"Total {compute_totals(parsed.items)['total']:,.2f} en {len(parts)} CFDI(s)")
+        try:
+            first_folio, reclaimed = self._reserve(serie, len(parts))
+        except FolioServiceError as exc:
+            return {"success": False, "errors": [str(exc)], "warnings": warnings}
+        if len(parts) > 1:
+            result = await self._process_batch(
+                payload, parts, serie, first_folio, issue_date, excel_path, upload_hash, progress, key
             )
+            result["warnings"] = warnings
+            return result
+
+        payload["Folio"] = first_folio
+        invoice = self._prepare_invoice(
+            payload, serie, first_folio, issue_date, excel_path, upload_hash, invoice=reclaimed, idempotency_key=key
         )
-        if existing_failed:
-            invoice = existing_failed
+        if isinstance(invoice, str):
+            return {"success": False, "errors": [invoice], "warnings": warnings}
+        self.session.commit()
+        progress("folio_reserved", f"Serie {serie}, folio {first_folio}")
+        result = await self._stamp(invoice, payload)
+        if result["success"]:
+            progress("stamped", f"Serie {serie}, folio {first_folio}")
+        result["warnings"] = warnings
+        return result
+
+    def _replay(self, key: str) -> Optional[Dict[str, Any]]:
+        """Result of an earlier request with this key, rebuilt from its invoices.
+
+        Runs while holding the key's claim, so invoices of the key still pending were left by an
+        attempt that died (or whose claim was taken over as abandoned): they are marked failed
+        first. None when the key never stamped anything, e.g. every attempt failed, so the upload
+        is processed again.
+        """
+        abandoned = fail_abandoned_invoices(self.session, key)
+        self.session.commit()  # even if nothing matched: the UPDATE opened a write transaction
+        if abandoned:
+            logger.warning("{} facturas pendientes de un timbrado abandonado marcadas como fallidas", abandoned)
+        invoices = self.session.scalars(
+            select(Invoice)
+            .where(Invoice.idempotency_key == key)
+            .order_by(Invoice.folio)
+            .execution_options(populate_existing=True)
+        ).all()
+
+        stamped = [invoice for invoice in invoices if invoice.status == "success"]
+        if not stamped:
+            return None
+        latest = max(stamped, key=lambda invoice: invoice.id)
+        if latest.batch_id:
+            parts = sorted((i for i in invoices if i.batch_id == latest.batch_id), key=lambda i: i.batch_part or 0)
+            results = [{**self._invoice_result(part), "part": part.batch_part} for part in parts]
+            errors = [
+                f"Parte {r['part']}/{len(results)} (folio {r['folio']}): {e}"
+                for r in results
+                if not r["success"]
+                for e in r["errors"]
+            ]
+            result = {
+                "success": not errors,
+                "batch_id": latest.batch_id,
+                "serie": latest.serie,
+                "folios": [r["folio"] for r in results if r["success"]],
+                "parts": results,
+                "errors": errors,
+            }
+        else:
+            result = self._invoice_result(latest)
+        result["replayed"] = True
+        result["warnings"] = [
+            f"Solicitud repetida: se devuelve el resultado del timbrado original ({latest.serie}-{latest.folio}), "
+            "no se volvió a timbrar."
+        ]
+        return result
+
+    def _invoice_result(self, invoice: Invoice) -> Dict[str, Any]:
+        if invoice.status != "success":
+            return {
+                "success": False,
+                "serie": invoice.serie,
+                "folio": invoice.folio,
+                "errors": [invoice.error_message or "Error al timbrar factura"],
+            }
+        return {
+            "success": True,
+            "invoice_id": invoice.id,
+            "serie": invoice.serie,
+            "folio": invoice.folio,
+            "uuid": invoice.uuid,
+            "facturama_id": invoice.facturama_id,
+        }
+
+    def _reserve(self, serie: str, count: int) -> tuple[int, Optional[Invoice]]:
+        """First folio for `count` CFDIs. A single CFDI takes over a folio whose stamping failed,
+        then a folio handed back unused, before a new one is taken (from this process's leased
+        block when FOLIO_BLOCK_SIZE is set), so failed attempts don't leave gaps."""
+        if count == 1:
+            reclaimed = self.folio_service.reclaim_failed(serie)
+            if reclaimed is not None:
+                return reclaimed.folio, reclaimed
+            spare = self.folio_service.take_spare(serie)
+            if spare is not None:
+                return spare, None
+            if self.folio_blocks.enabled:
+                return self.folio_blocks.take(self.folio_service, serie), None
+        return self.folio_service.reserve(serie, count), None
+
+    def _split_payload(self, payload: Dict[str, Any]) -> list[list[Dict[str, Any]]]:
+        items = payload.get("Items") or []
+        if not (settings.cfdi_max_items or settings.cfdi_max_bytes):
+            return [items]
+        base_bytes = len(json.dumps({**payload, "Items": []}, ensure_ascii=False).encode("utf-8"))
+        return split_items(items, settings.cfdi_max_items, settings.cfdi_max_bytes, base_bytes)
+
+    async def _process_batch(
+        self,
+        base_payload: Dict[str, Any],
+        parts: list[list[Dict[str, Any]]],
+        serie: str,
+        first_folio: int,
+        issue_date: date,
+        excel_path: Path,
+        upload_hash: str,
+        progress: Progress = _no_progress,
+        idempotency_key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Stamp each chunk of items as its own CFDI with consecutive folios.
+
+        The folios are already reserved. All invoice rows are created (pending) and committed
+        before any request goes out, so a folio clash aborts the batch without stamping anything.
+        Parts are stamped at most `cfdi_split_concurrency` at a time.
+        """
+        batch_id = uuid4().hex
+        total = len(parts)
+        jobs = []
+        for index, items in enumerate(parts):
+            folio = first_folio + index
+            payload = {**base_payload, "Folio": folio, "Items": items}
+            invoice = self._prepare_invoice(
+                payload,
+                serie,
+                folio,
+                issue_date,
+                excel_path,
+                upload_hash,
+                batch_id=batch_id,
+                batch_part=index + 1,
+                idempotency_key=idempotency_key,
+            )
+            if isinstance(invoice, str):
+                return {"success": False, "errors": [invoice]}
+            jobs.append((invoice, payload))
+        self.session.commit()
+        logger.info("Archivo {} dividido en {} CFDIs (lote {})", excel_path.name, total, batch_id)
+        progress("folio_reserved", f"Serie {serie}, folios {first_folio} a {first_folio + total - 1}")
+
+        slots = asyncio.Semaphore(max(settings.cfdi_split_concurrency, 1))
+        stamped = 0
+
+        async def stamp(invoice: Invoice, payload: Dict[str, Any]) -> Dict[str, Any]:
+            nonlocal stamped
+            async with slots:
+                result = await self._stamp(invoice, payload)
+            if result["success"]:
+                stamped += 1
+                progress("stamped", f"{stamped} de {total} CFDIs timbrados (último: folio {result['folio']})")
+            return result
+
+        results = await asyncio.gather(*(stamp(invoice, payload) for invoice, payload in jobs))
+        errors = []
+        for index, result in enumerate(results):
+            result["part"] = index + 1
+            if not result["success"]:
+                errors.extend(f"Parte {index + 1}/{total} (folio {result['folio']}): {e}" for e in result["errors"])
+        return {
+            "success": not errors,
+            "batch_id": batch_id,
+            "serie": serie,
+            "folios": [r["folio"] for r in results if r["success"]],
+            "parts": results,
+            "errors": errors,
+        }
+
+    async def process_bulk(
+        self,
+        uploads: List[StoredUpload],
+        serie: str,
+        issue_date: date,
+        expedition_place: Optional[str] = None,
+        observations: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Stamp several uploads in one run, one global invoice (or split batch) per file.
+
+        Files are parsed in parallel, then folios are reserved in file order and every invoice row
+        is committed before any request goes out, as in `_process_batch`. Invalid files are skipped
+        without taking a folio; if a reservation fails or a folio clashes, the run is aborted and the
+        invoices prepared so far are marked failed. CFDIs are stamped at most `bulk_concurrency` at
+        a time. Returns a
+        summary per file and, if any file failed, one workbook listing all of its errors.
+        """
+        try:
+            self.folio_service.ensure_series(serie)
+        except FolioServiceError as exc:
+            return {"success": False, "errors": [str(exc)], "files": [], "error_excel": None}
+        slots = asyncio.Semaphore(max(settings.bulk_concurrency, 1))
+
+        async def parse(upload: StoredUpload) -> ParsedUpload:
+            async with slots:
+                try:
+                    return await self._parse_upload(upload.path, upload.sha256)
+                except PoolBusyError as exc:
+                    return ParsedUpload([str(exc)])
+
+        parsed_uploads = await asyncio.gather(*(parse(upload) for upload in uploads))
+
+        files: List[Dict[str, Any]] = []
+        report: List[tuple] = []
+        jobs = []
+        for upload, parsed in zip(uploads, parsed_uploads):
+            filename = upload.filename or upload.path.name
+            summary = {
+                "filename": filename,
+                "status": "invalid",
+                "items": len(parsed.items),
+                "total": None,
+                "cfdi_count": 0,
+                "folios": [],
+                "errors": [],
+                "warnings": self._already_stamped_warnings(upload.sha256),
+            }
+            files.append(summary)
+            excel_result = self.excel_service.build(
+                parsed,
+                serie=serie,
+                folio=0,
+                issue_date=issue_date,
+                expedition_place=expedition_place,
+                observations=observations,
+            )
+            if not excel_result.valid:
+                summary["errors"] = excel_result.errors
+                if excel_result.row_errors:
+                    report.extend((filename, e.row_number, e.column, e.message) for e in excel_result.row_errors)
+                else:
+                    report.extend((filename, None, None, error) for error in excel_result.errors)
+                continue
+
+            parts = self._split_payload(excel_result.payload)
+            batch_id = uuid4().hex if len(parts) > 1 else None
+            try:
+                next_folio, reclaimed = self._reserve(serie, len(parts))
+            except FolioServiceError as exc:
+                return self._abort_bulk(jobs, str(exc))
+            for index, items in enumerate(parts):
+                payload = {**excel_result.payload, "Folio": next_folio, "Items": items}
+                invoice = self._prepare_invoice(
+                    payload,
+                    serie,
+                    next_folio,
+                    issue_date,
+                    upload.path,
+                    upload.sha256,
+                    batch_id=batch_id,
+                    batch_part=index + 1 if batch_id else None,
+                    invoice=reclaimed,
+                )
+                if isinstance(invoice, str):
+                    return self._abort_bulk(jobs, invoice)
+                jobs.append((summary, invoice, payload))
+                next_folio += 1
+            summary.update(status="pending", total=compute_totals(parsed.items)["total"], cfdi_count=len(parts))
+        self.session.commit()
+        logger.info("Lote de {} archivos: {} CFDIs por timbrar en la serie {}", len(uploads), len(jobs), serie)
+
+        async def stamp(summary: Dict[str, Any], invoice: Invoice, payload: Dict[str, Any]):
+            async with slots:
+                return summary, await self._stamp(invoice, payload)
+
+        for summary, result in await asyncio.gather(*(stamp(*job) for job in jobs)):
+            if result["success"]:
+                summary["folios"].append(result["folio"])
+            else:
+                errors = [f"Folio {result['folio']}: {error}" for error in result["errors"]]
+                summary["errors"].extend(errors)
+                report.extend((summary["filename"], None, None, error) for error in errors)
+        for summary in files:
+            summary["folios"].sort()
+            if summary["status"] == "pending":
+                if not summary["errors"]:
+                    summary["status"] = "success"
+                else:
+                    summary["status"] = "partial" if summary["folios"] else "failed"
+
+        error_excel = None
+        if report:
+            error_excel = await asyncio.to_thread(self.excel_service.build_bulk_error_report, report)
+        return {
+            "success": all(summary["status"] == "success" for summary in files),
+            "serie": serie,
+            "files": files,
+            "errors": [],
+            "error_excel": str(error_excel) if error_excel else None,
+        }
+
+    def _abort_bulk(self, jobs: List[tuple], error: str) -> Dict[str, Any]:
+        """Give up a bulk run before anything is stamped. Reservations commit as they go, so
+        invoices prepared for earlier files (reclaimed ones included) may already be stored as
+        pending: they are marked failed, which also lets later uploads reclaim their folios."""
+        for _, invoice, _ in jobs:
+            if inspect(invoice).persistent:  # not dropped by a rollback
+                invoice.status = "failed"
+                invoice.error_message = error
+        self.session.commit()
+        return {"success": False, "errors": [error], "files": [], "error_excel": None}
+
+    def _prepare_invoice(
+        self,
+        payload: Dict[str, Any],
+        serie: str,
+        folio: int,
+        issue_date: date,
+        excel_path: Path,
+        upload_hash: str,
+        batch_id: Optional[str] = None,
+        batch_part: Optional[int] = None,
+        invoice: Optional[Invoice] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Invoice | str:
+        """Fill in the reclaimed `invoice` or add a pending one; returns an error message on a folio clash."""
+        if invoice is not None:
             invoice.status = "pending"
             invoice.error_message = None
             invoice.request_json = json.dumps(payload, ensure_ascii=False)
             invoice.response_json = None
             invoice.issue_date = issue_date
             invoice.excel_filename = excel_path.name
+            invoice.upload_hash = upload_hash
+            invoice.batch_id = batch_id
+            invoice.batch_part = batch_part
+            invoice.idempotency_key = idempotency_key
         else:
             invoice = Invoice(
                 status="pending",
                 serie=serie,
-                folio=next_folio,
+                folio=folio,
                 issue_date=issue_date,
                 excel_filename=excel_path.name,
+                upload_hash=upload_hash,
+                batch_id=batch_id,
+                batch_part=batch_part,
+                idempotency_key=idempotency_key,
                 request_json=json.dumps(payload, ensure_ascii=False),
             )
             self.session.add(invoice)
@@ -73,8 +566,11 @@ class InvoicingService:
                 self.session.flush()
             except IntegrityError:
                 self.session.rollback()
-                return {"success": False, "errors": [f"El folio {next_folio} de la serie {serie} ya existe. Intenta de nuevo."]}
+                return f"El folio {folio} de la serie {serie} ya existe. Intenta de nuevo."
+        return invoice
 
+    async def _stamp(self, invoice: Invoice, payload: Dict[str, Any]) -> Dict[str, Any]:
+        serie, folio = invoice.serie, invoice.folio
         try:
             response = await self.facturama.create_cfdi(payload)
             invoice.response_json = json.dumps(response, ensure_ascii=False)
@@ -82,18 +578,11 @@ class InvoicingService:
             invoice.facturama_id = response.get("Id") or response.get("id")
             invoice.uuid = response.get("Uuid") or response.get("uuid")
             self._persist_items(invoice, payload.get("Items", []))
-            self.folio_service.commit_folio(serie, next_folio)
-
-            await self._store_files(invoice)
+            enqueue_documents(self.session, invoice)
             self.session.commit()
-            return {
-                "success": True,
-                "invoice_id": invoice.id,
-                "serie": serie,
-                "folio": next_folio,
-                "uuid": invoice.uuid,
-                "facturama_id": invoice.facturama_id,
-            }
+            document_queue.notify()
+            cfdi_cache.invalidate(invoice.issue_date or date.today(), date.today())
+            return self._invoice_result(invoice)
         except FacturamaError as exc:
             logger.warning("FacturamaError: %s", exc)
             invoice.status = "failed"
@@ -101,13 +590,74 @@ class InvoicingService:
             invoice.response_json = json.dumps({"error": exc.details}, ensure_ascii=False)
             self.session.commit()
             errors = self._format_facturama_errors(exc)
-            return {"success": False, "errors": errors}
+            return {"success": False, "serie": serie, "folio": folio, "errors": errors}
         except Exception as exc:
             logger.exception("Error inesperado al timbrar")
             invoice.status = "failed"
             invoice.error_message = str(exc)
             self.session.commit()
-            return {"success": False, "errors": ["Error inesperado, revisa logs"]}
+            return {"success": False, "serie": serie, "folio": folio, "errors": ["Error inesperado, revisa logs"]}
+
+    async def validate_invoice(
+        self,
+        excel_path: Path,
+        serie: str,
+        issue_date: date,
+        expedition_place: Optional[str] = None,
+        observations: Optional[str] = None,
+        upload_hash: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Dry run: validation and payload build only. No folio is reserved, nothing is written to
+        the database and Facturama is not contacted."""
+        upload_hash = upload_hash or await asyncio.to_thread(hash_file, excel_path)
+        try:
+            parsed = await self._parse_upload(excel_path, upload_hash)
+        except PoolBusyError as exc:
+            return {"valid": False, "errors": [str(exc)], "row_errors": [], "item_count": 0, "totals": None}
+        result = self.excel_service.build(
+            parsed,
+            serie=serie,
+            folio=0,
+            issue_date=issue_date,
+            expedition_place=expedition_place,
+            observations=observations,
+        )
+        return {
+            "valid": result.valid,
+            "errors": result.errors,
+            "row_errors": [
+                {"row": err.row_number, "column": err.column, "message": err.message} for err in result.row_errors
+            ],
+            "item_count": len(parsed.items),
+            "totals": compute_totals(parsed.items) if parsed.valid else None,
+            "cfdi_count": len(self._split_payload(result.payload)) if result.valid else None,
+            "error_excel": str(result.error_excel_path) if result.error_excel_path else None,
+            "upload_hash": upload_hash,
+            "warnings": self._already_stamped_warnings(upload_hash),
+        }
+
+    async def _parse_upload(self, excel_path: Path, upload_hash: str) -> ParsedUpload:
+        parsed = await asyncio.to_thread(self.upload_cache.get, upload_hash)
+        if parsed is not None:
+            logger.info("Archivo {} ya validado (caché {})", excel_path.name, upload_hash[:12])
+            return parsed
+        parsed = await cpu_pool.run(self.excel_service.parse, excel_path)
+        if parsed.valid or parsed.row_errors:  # don't cache read failures, they may be transient
+            await asyncio.to_thread(self.upload_cache.put, upload_hash, parsed)
+        return parsed
+
+    def _already_stamped_warnings(self, upload_hash: str) -> list[str]:
+        previous = self.session.scalar(
+            select(Invoice)
+            .where(Invoice.upload_hash == upload_hash, Invoice.status == "success")
+            .order_by(Invoice.id.desc())
+            .limit(1)
+        )
+        if not previous:
+            return []
+        return [
+            f"Este archivo ya se timbró antes como {previous.serie}-{previous.folio} (UUID {previous.uuid or 'N/D'})."
+        ]
 
     def _persist_items(self, invoice: Invoice, items_data):
         for item in items_data:
@@ -127,26 +677,6 @@ class InvoicingService:
             )
             self.session.add(inv_item)
 
-    async def _store_files(self, invoice: Invoice) -> None:
-        if not invoice.facturama_id:
-            logger.warning("No Facturama ID, skip descarga de archivos")
-            return
-        try:
-            pdf_path = settings.facturas_storage_dir / "pdf" / f"{invoice.serie}-{invoice.folio}.pdf"
-            xml_path = settings.facturas_storage_dir / "xml" / f"{invoice.serie}-{invoice.folio}.xml"
-            zip_path = settings.facturas_storage_dir / "zip" / f"{invoice.serie}-{invoice.folio}.zip"
-            pdf_saved = await self.facturama.download_document(invoice.facturama_id, "pdf", str(pdf_path))
-            xml_saved = await self.facturama.download_document(invoice.facturama_id, "xml", str(xml_path))
-            zip_saved = await self.facturama.download_zip(invoice.facturama_id, str(zip_path))
-            if pdf_saved:
-                invoice.pdf_path = str(pdf_path)
-            if xml_saved:
-                invoice.xml_path = str(xml_path)
-            if not zip_saved:
-                logger.warning("No se pudo obtener ZIP para CFDI %s", invoice.facturama_id)
-        except FacturamaError as exc:
-            logger.warning("No se pudieron descargar archivos: %s", exc)
-
     def _format_facturama_errors(self, exc: FacturamaError) -> list[str]:
         errors: list[str] = []
         status_txt = f"(HTTP {exc.status_code})" if exc.status_code else ""
@@ -0,0 +1,259 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+from uuid import uuid4
+
+from loguru import logger
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.models.invoice import DocumentFetch, IdempotencyClaim, StampJob
+from app.services.invoicing_service import InvoicingService, fail_abandoned_invoices, idempotency_key
+from app.services.upload_storage import StoredUpload
+
+STAGES = [
+    ("queued", "En cola"),
+    ("parsed", "Archivo leído"),
+    ("validated", "Validado"),
+    ("folio_reserved", "Folio reservado"),
+    ("stamped", "Timbrado"),
+    ("documents_stored", "PDF, XML y ZIP guardados"),
+]
+STAGE_ORDER = {key: index for index, (key, _) in enumerate(STAGES)}
+
+
+def create_job(
+    session: Session,
+    upload: StoredUpload,
+    serie: str,
+    issue_date: date,
+    expedition_place: Optional[str] = None,
+    observations: Optional[str] = None,
+    user_id: Optional[int] = None,
+    idempotency_token: Optional[str] = None,
+) -> StampJob:
+    job = StampJob(
+        id=uuid4().hex,
+        user_id=user_id,
+        status="queued",
+        stage="queued",
+        serie=serie,
+        issue_date=issue_date,
+        expedition_place=expedition_place,
+        observations=observations,
+        upload_path=str(upload.path),
+        upload_hash=upload.sha256,
+        excel_filename=upload.filename or upload.path.name,
+        idempotency_token=idempotency_token,
+    )
+    session.add(job)
+    session.commit()
+    return job
+
+
+def _invoice_ids(result: Dict[str, Any]) -> list[int]:
+    if result.get("parts"):
+        return [part["invoice_id"] for part in result["parts"] if part.get("invoice_id")]
+    return [result["invoice_id"]] if result.get("invoice_id") else []
+
+
+def job_snapshot(session: Session, job: StampJob) -> Dict[str, Any]:
+    """Public view of a job for the status endpoint and the event stream.
+
+    Once stamped, the documents stage follows the invoices' `document_fetches` rows; the job is
+    finished when it failed, or when its documents are stored or gave up retrying.
+    """
+    result = json.loads(job.result_json) if job.result_json else None
+    stage = job.stage
+    documents = None
+    if job.status == "done" and result and result.get("success"):
+        statuses = [
+            fetch.status
+            for fetch in session.scalars(
+                select(DocumentFetch).where(DocumentFetch.invoice_id.in_(_invoice_ids(result)))
+            )
+        ]
+        if statuses and all(status == "done" for status in statuses):
+            documents, stage = "done", "documents_stored"
+        elif "failed" in statuses:
+            documents = "failed"
+        else:
+            documents = "pending"
+    reached = STAGE_ORDER.get(stage, 0)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "stage": stage,
+        "stages": [{"key": key, "label": label, "done": index <= reached} for index, (key, label) in enumerate(STAGES)],
+        "message": job.message,
+        "filename": job.excel_filename,
+        "serie": job.serie,
+        "result": result,
+        "documents": documents,
+        "finished": job.status == "failed" or (job.status == "done" and documents != "pending"),
+    }
+
+
+def load_snapshot(job_id: str, session_factory: Callable[[], Session] = SessionLocal) -> Optional[Dict[str, Any]]:
+    with session_factory() as session:
+        job = session.get(StampJob, job_id)
+        return job_snapshot(session, job) if job else None
+
+
+class StampJobQueue:
+    """Background workers that run stamping jobs submitted from /timbrar.
+
+    Jobs live in `stamp_jobs`, claimed with a conditional UPDATE plus a lease like the document
+    queue, so any app process may run them. Each stage reached is committed on the job row (which
+    also renews the lease) so the page can follow it. A job whose lease expired while running is
+    marked failed instead of retried: its CFDI may already have been stamped. The invoices it left
+    pending are failed with it and its idempotency claim is dropped, so a retry isn't blocked.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        session_factory: Callable[[], Session] = SessionLocal,
+        service_factory: Callable[[Session], InvoicingService] = InvoicingService,
+    ):
+        self.workers = workers
+        self.session_factory = session_factory
+        self.service_factory = service_factory
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+
+    def start(self) -> None:
+        if self.workers <= 0 or self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self.run_once()
+            except Exception:
+                logger.exception("Error en la cola de timbrado")
+                processed = False
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.stamp_job_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> bool:
+        """Claim and run one queued job; False if there is none."""
+        self._fail_abandoned()
+        job_id = self._claim()
+        if job_id is None:
+            return False
+        await self._process(job_id)
+        return True
+
+    async def drain(self) -> int:
+        processed = 0
+        while await self.run_once():
+            processed += 1
+        return processed
+
+    def _lease(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=settings.stamp_job_lease)
+
+    def _fail_abandoned(self) -> None:
+        now = datetime.utcnow()
+        with self.session_factory() as session:
+            expired = session.scalars(
+                select(StampJob).where(StampJob.status == "running", StampJob.locked_until < now)
+            ).all()
+            for job in expired:
+                lease_end = job.locked_until
+                failed = session.execute(
+                    update(StampJob)
+                    .where(StampJob.id == job.id, StampJob.status == "running", StampJob.locked_until < now)
+                    .values(
+                        status="failed",
+                        locked_until=None,
+                        message="El proceso se interrumpió; revisa el Historial antes de volver a timbrar el archivo.",
+                    )
+                ).rowcount
+                if not failed or not job.upload_hash:
+                    continue
+                key = idempotency_key(job.upload_hash, job.serie, job.issue_date, job.idempotency_token)
+                fail_abandoned_invoices(session, key)
+                # Claims taken after the lease ran out belong to a retry, not to this job.
+                session.execute(
+                    delete(IdempotencyClaim).where(IdempotencyClaim.key == key, IdempotencyClaim.claimed_at < lease_end)
+                )
+            session.commit()
+
+    def _claim(self) -> Optional[str]:
+        with self.session_factory() as session:
+            candidates = session.scalars(
+                select(StampJob.id).where(StampJob.status == "queued").order_by(StampJob.created_at).limit(5)
+            ).all()
+            for job_id in candidates:
+                claimed = session.execute(
+                    update(StampJob)
+                    .where(StampJob.id == job_id, StampJob.status == "queued")
+                    .values(status="running", locked_until=self._lease())
+                ).rowcount
+                session.commit()
+                if claimed:
+                    return job_id
+        return None
+
+    async def _process(self, job_id: str) -> None:
+        with self.session_factory() as session:
+            job = session.get(StampJob, job_id)
+
+            def progress(stage: str, message: str) -> None:
+                job.stage = stage
+                job.message = message
+                job.locked_until = self._lease()
+                session.commit()
+
+            try:
+                result = await self.service_factory(session).process_invoice(
+                    excel_path=Path(job.upload_path),
+                    serie=job.serie,
+                    issue_date=job.issue_date,
+                    expedition_place=job.expedition_place,
+                    observations=job.observations,
+                    upload_hash=job.upload_hash,
+                    progress=progress,
+                    idempotency_token=job.idempotency_token,
+                )
+            except Exception:
+                logger.exception("Error inesperado en el trabajo de timbrado {}", job_id)
+                session.rollback()
+                result = {"success": False, "errors": ["Error inesperado, revisa logs"]}
+
+            job.result_json = json.dumps(result, ensure_ascii=False, default=str)
+            job.locked_until = None
+            if result.get("success"):
+                job.status, job.stage = "done", "stamped"
+                folios = result.get("folios") or [result.get("folio")]
+                job.message = f"Serie {job.serie}, folio(s) {', '.join(str(f) for f in folios)}"
+            else:
+                job.status = "failed"
+                job.message = "; ".join(result.get("errors") or ["Hubo errores al procesar el archivo."])[:2000]
+            session.commit()
+
+
+stamp_job_queue = StampJobQueue(settings.stamp_job_workers)
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from app.services.excel_service import ParsedUpload, RowError
+
+# Bump when parsing/validation rules change so stale entries are ignored.
+CACHE_VERSION = 1
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """On-disk LRU of parsed uploads keyed by the sha256 of the file content.
+
+    Entries are JSON files; reading one refreshes its mtime, and the oldest entries are
+    removed once there are more than `max_entries`.
+    """
+
+    def __init__(self, cache_dir: Path | None = None, max_entries: int | None = None):
+        self.cache_dir = cache_dir or settings.facturas_storage_dir / "cache"
+        self.max_entries = settings.upload_cache_max_entries if max_entries is None else max_entries
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _entry_path(self, upload_hash: str) -> Path:
+        return self.cache_dir / f"{upload_hash}.json"
+
+    def get(self, upload_hash: str) -> Optional[ParsedUpload]:
+        if not self.enabled:
+            return None
+        path = self._entry_path(upload_hash)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("Entrada de caché corrupta {}, se descarta", path.name)
+            path.unlink(missing_ok=True)
+            return None
+        if data.get("version") != CACHE_VERSION:
+            return None
+        error_path = data.get("error_excel_path")
+        if error_path and not Path(error_path).exists():
+            return None  # the report was cleaned up; parse again to regenerate it
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted meanwhile by another worker
+        return ParsedUpload(
+            errors=data["errors"],
+            items=data["items"],
+            header=data["header"],
+            row_errors=[RowError(**err) for err in data["row_errors"]],
+            error_excel_path=Path(error_path) if error_path else None,
+        )
+
+    def put(self, upload_hash: str, parsed: ParsedUpload) -> None:
+        if not self.enabled:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        data = asdict(parsed)
+        data["error_excel_path"] = str(parsed.error_excel_path) if parsed.error_excel_path else None
+        data["version"] = CACHE_VERSION
+        path = self._entry_path(upload_hash)
+        tmp = path.with_name(f"{upload_hash}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        def mtime(path: Path) -> float:
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return 0.0
+
+        entries = sorted(self.cache_dir.glob("*.json"), key=mtime)
+        for path in entries[: max(len(entries) - self.max_entries, 0)]:
+            path.unlink(missing_ok=True)
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import os
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, List
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+
+CHUNK_SIZE = 1024 * 1024
+ARCHIVE_SUFFIXES = (".xlsx", ".csv", ".parquet")  # files taken from a ZIP of workbooks
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class InvalidArchiveError(Exception):
+    pass
+
+
+@dataclass
+class StoredUpload:
+    path: Path
+    sha256: str
+    size: int
+    filename: str = ""  # name as uploaded, without the timestamp prefix
+
+
+def uploads_dir() -> Path:
+    uploads = settings.facturas_storage_dir / "uploads"
+    uploads.mkdir(parents=True, exist_ok=True)
+    return uploads
+
+
+def _copy_chunks(source: BinaryIO, target: Path, max_bytes: int) -> StoredUpload:
+    partial = target.with_name(f".{target.name}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(partial, "wb") as out:
+            while chunk := source.read(CHUNK_SIZE):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(
+                        f"El archivo excede el tamaño máximo permitido ({max_bytes // (1024 * 1024)} MB)."
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(partial, target)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    return StoredUpload(target, digest.hexdigest(), size)
+
+
+async def save_upload(upload: UploadFile, directory: Path | None = None, max_bytes: int | None = None) -> StoredUpload:
+    """Copy an upload to the uploads dir in chunks, off the event loop, hashing it on the way.
+
+    The file is written under a temporary name and renamed into place once complete, so a
+    partially written upload is never picked up.
+    """
+    directory = directory or uploads_dir()
+    max_bytes = settings.upload_max_bytes if max_bytes is None else max_bytes
+    filename = Path(upload.filename or "upload").name
+    target = directory / f"{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{filename}"
+    await upload.seek(0)
+    stored = await asyncio.to_thread(_copy_chunks, upload.file, target, max_bytes)
+    stored.filename = filename
+    return stored
+
+
+def _extract_zip(archive_path: Path, directory: Path, max_files: int, max_bytes: int) -> List[StoredUpload]:
+    stored: List[StoredUpload] = []
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            members = [
+                member
+                for member in archive.infolist()
+                if not member.is_dir()
+                and "__MACOSX" not in member.filename
+                and not Path(member.filename).name.startswith((".", "~$"))
+                and Path(member.filename).suffix.lower() in ARCHIVE_SUFFIXES
+            ]
+            if not members:
+                raise InvalidArchiveError("El ZIP no contiene archivos Excel, CSV o Parquet.")
+            if max_files and len(members) > max_files:
+                raise InvalidArchiveError(f"El ZIP contiene más de {max_files} archivos.")
+            prefix = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+            for index, member in enumerate(members):
+                filename = Path(member.filename).name
+                with archive.open(member) as source:
+                    upload = _copy_chunks(source, directory / f"{prefix}_{index}_{filename}", max_bytes)
+                upload.filename = filename
+                stored.append(upload)
+    except zipfile.BadZipFile as exc:
+        raise InvalidArchiveError("El archivo ZIP está dañado o no es un ZIP válido.") from exc
+    except BaseException:
+        for upload in stored:
+            upload.path.unlink(missing_ok=True)
+        raise
+    return stored
+
+
+async def extract_zip(
+    archive: StoredUpload, directory: Path | None = None, max_files: int = 0, max_bytes: int | None = None
+) -> List[StoredUpload]:
+    """Unpack the workbooks inside an uploaded ZIP into the uploads dir (off the event loop), each
+    one hashed and size-checked like a direct upload. Folders, hidden files and other file types
+    are skipped; nothing is left behind if a member fails."""
+    directory = directory or uploads_dir()
+    max_bytes = settings.upload_max_bytes if max_bytes is None else max_bytes
+    return await asyncio.to_thread(_extract_zip, archive.path, directory, max_files, max_bytes)
@@ -0,0 +1,75 @@
+"""Compara el tiempo de parseo de ExcelService por motor de lectura.
+
+Uso: python -m benchmarks.bench_excel_engines [filas] [repeticiones]
+"""
+
+import sys
+import tempfile
+import time
+from importlib.util import find_spec
+from pathlib import Path
+
+import pandas as pd
+
+from app.services.excel_service import EXPECTED_COLUMNS, READER_ENGINES, read_frames
+
+ENGINE_MODULES = {"openpyxl": "openpyxl", "calamine": "python_calamine"}
+
+
+def sample_row(i: int) -> dict:
+    row = {col: "" for col in EXPECTED_COLUMNS}
+    row.update(
+        {
+            "RFC": "XAXX010101000",
+            "Razon Social": "PUBLICO EN GENERAL",
+            "UsoCFDI": "S01",
+            "Fiscal Regime": "616",
+            "CP": 1000,
+            "Forma de Pago": 1,
+            "Metodo de Pago": "PUE",
+            "ClaveProdServ": "01010101",
+            "Concepto": f"Venta {i}",
+            "ClaveUnidad": "ACT",
+            "Unidad": "Actividad",
+            "Cantidad": 1,
+            "Precio Unitario": 100,
+            "Objeto Impuesto": "02",
+            "Subtotal del Concepto": 100,
+            "IVA del Concepto": 16,
+            "Total del Concepto": 116,
+            "Pedido": f"P{i}",
+            "Periodicidad": "04",
+            "Mes": "01",
+            "Year": 2026,
+        }
+    )
+    return row
+
+
+def build_workbook(path: Path, rows: int) -> Path:
+    pd.DataFrame([sample_row(i) for i in range(rows)], columns=EXPECTED_COLUMNS).to_excel(path, index=False)
+    return path
+
+
+def bench(path: Path, engine: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read_frames(path, engine)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(rows: int = 20000, repeat: int = 3) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = build_workbook(Path(tmp) / "bench.xlsx", rows)
+        print(f"{rows} filas, mejor de {repeat}")
+        for engine in sorted(READER_ENGINES):
+            if find_spec(ENGINE_MODULES[engine]) is None:
+                print(f"{engine:>10}: no instalado")
+                continue
+            print(f"{engine:>10}: {bench(path, engine, repeat):.3f}s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
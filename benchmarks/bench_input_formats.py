@@ -0,0 +1,37 @@
+"""Compara el tiempo de parseo por formato de entrada (xlsx, csv, parquet).
+
+Uso: python -m benchmarks.bench_input_formats [filas] [repeticiones]
+"""
+
+import sys
+import tempfile
+from importlib.util import find_spec
+from pathlib import Path
+
+import pandas as pd
+
+from app.services.excel_service import EXPECTED_COLUMNS
+from benchmarks.bench_excel_engines import bench, sample_row
+
+
+def main(rows: int = 20000, repeat: int = 3) -> None:
+    df = pd.DataFrame([sample_row(i) for i in range(rows)], columns=EXPECTED_COLUMNS)
+    with tempfile.TemporaryDirectory() as tmp:
+        xlsx = Path(tmp) / "bench.xlsx"
+        csv = Path(tmp) / "bench.csv"
+        parquet = Path(tmp) / "bench.parquet"
+        df.to_excel(xlsx, index=False)
+        df.to_csv(csv, index=False)
+        df.astype(str).to_parquet(parquet, index=False)
+
+        cases = [("xlsx/openpyxl", xlsx, "openpyxl"), ("csv", csv, "openpyxl"), ("parquet", parquet, "openpyxl")]
+        if find_spec("python_calamine") is not None:
+            cases.insert(1, ("xlsx/calamine", xlsx, "calamine"))
+        print(f"{rows} filas, mejor de {repeat}")
+        for label, path, engine in cases:
+            size_kb = path.stat().st_size / 1024
+            print(f"{label:>14}: {bench(path, engine, repeat):.3f}s ({size_kb:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,141 @@
+"""Prueba de carga de /timbrar e /historial contra el Facturama simulado.
+
+1. Levanta el servidor simulado:   uvicorn benchmarks.fake_facturama:app --port 8081
+2. Levanta la app apuntando a él:  FACTURAMA_BASE_URL=http://127.0.0.1:8081 uvicorn app.main:app --workers 4
+3. Ejecuta:  python -m benchmarks.bench_load --user admin --password ... [--requests 200] [--concurrency 20]
+
+Reporta throughput, latencias p50/p95/p99 por endpoint y la tasa de colisión de folios (folios que
+Facturama recibió más de una vez o que la app rechazó por duplicados).
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import re
+import time
+from collections import defaultdict
+from datetime import date
+
+import httpx
+
+from app.services.excel_service import EXPECTED_COLUMNS
+from benchmarks.bench_excel_engines import sample_row
+
+CSRF_RE = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def upload_csv(run: int, rows: int) -> bytes:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=EXPECTED_COLUMNS)
+    writer.writeheader()
+    for i in range(rows):
+        row = sample_row(i)
+        row["Pedido"] = f"R{run}-{i}"  # distinct content per upload: no cache hits
+        writer.writerow(row)
+    return out.getvalue().encode()
+
+
+async def login(client: httpx.AsyncClient, user: str, password: str) -> str:
+    page = await client.get("/login")
+    token = CSRF_RE.search(page.text).group(1)
+    resp = await client.post("/login", data={"username": user, "password": password, "csrf_token": token})
+    home = await client.get("/")
+    match = CSRF_RE.search(home.text)
+    if resp.status_code >= 400 or not match or "/login" in str(home.url):
+        raise SystemExit("No se pudo iniciar sesión; revisa --user/--password")
+    return match.group(1)
+
+
+async def run(args) -> None:
+    async with httpx.AsyncClient(base_url=args.app_url, timeout=args.timeout, follow_redirects=True) as client:
+        token = await login(client, args.user, args.password)
+        if args.fake_url:
+            async with httpx.AsyncClient() as fake:
+                await fake.post(f"{args.fake_url}/_reset")
+
+        latencies: dict[str, list[float]] = defaultdict(list)
+        outcomes: dict[str, int] = defaultdict(int)
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def timbrar(n: int) -> None:
+            files = {"excel_file": (f"carga_{n}.csv", upload_csv(n, args.rows), "text/csv")}
+            data = {"csrf_token": token, "serie": args.serie, "issue_date": date.today().isoformat()}
+            async with slots:
+                start = time.perf_counter()
+                try:
+                    resp = await client.post("/timbrar", data=data, files=files)
+                except httpx.HTTPError as exc:
+                    outcomes[type(exc).__name__] += 1
+                    return
+                finally:
+                    latencies["timbrar"].append(time.perf_counter() - start)
+            if resp.status_code >= 500:
+                outcomes[f"http_{resp.status_code}"] += 1
+            elif "timbrada correctamente" in resp.text or "Se timbraron" in resp.text:
+                outcomes["ok"] += 1
+            elif "ya existe" in resp.text:
+                outcomes["folio_duplicado"] += 1
+            else:
+                outcomes["error"] += 1
+
+        async def historial() -> None:
+            async with slots:
+                start = time.perf_counter()
+                try:
+                    await client.get("/historial")
+                except httpx.HTTPError as exc:
+                    outcomes[f"historial_{type(exc).__name__}"] += 1
+                finally:
+                    latencies["historial"].append(time.perf_counter() - start)
+
+        jobs = [timbrar(n) for n in range(args.requests)]
+        jobs += [historial() for _ in range(int(args.requests * args.historial_ratio))]
+        started = time.perf_counter()
+        await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - started
+
+        collisions = 0
+        if args.fake_url:
+            async with httpx.AsyncClient() as fake:
+                collisions = (await fake.get(f"{args.fake_url}/_stats")).json()["collisions"]
+
+    print(f"{args.requests} timbrados, concurrencia {args.concurrency}, {elapsed:.1f}s")
+    for endpoint, values in latencies.items():
+        print(
+            f"{endpoint:>10}: {len(values) / elapsed:6.1f} req/s  "
+            f"p50 {percentile(values, 50) * 1000:7.0f} ms  "
+            f"p95 {percentile(values, 95) * 1000:7.0f} ms  "
+            f"p99 {percentile(values, 99) * 1000:7.0f} ms"
+        )
+    print("resultados:", dict(outcomes))
+    stamped = outcomes["ok"] or 1
+    rate = (collisions + outcomes["folio_duplicado"]) / stamped
+    print(f"colisiones de folio: {collisions} en Facturama, {outcomes['folio_duplicado']} rechazadas ({rate:.2%})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--fake-url", default="http://127.0.0.1:8081", help="vacío para no leer estadísticas")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--serie", default="ML")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=50, help="conceptos por archivo")
+    parser.add_argument("--timeout", type=float, default=120, help="segundos por petición")
+    parser.add_argument("--historial-ratio", type=float, default=0.5, help="consultas al historial por timbrado")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Servidor local que imita la API de Facturama para pruebas de carga.
+
+Implementa POST /3/cfdis, GET /cfdi, GET /api/Cfdi/{fmt}/{type}/{id} y GET /cfdi/zip con
+latencia, tasa de error y tamaño de documentos configurables por variables de entorno:
+
+    FAKE_FACTURAMA_LATENCY_MS=150 FAKE_FACTURAMA_ERROR_RATE=0.02 FAKE_FACTURAMA_DOCUMENT_KB=80 \\
+        uvicorn benchmarks.fake_facturama:app --port 8081
+
+GET /_stats devuelve los CFDIs creados y los folios repetidos (serie+folio timbrados más de una
+vez); POST /_reset los limpia.
+"""
+
+import asyncio
+import base64
+import os
+import random
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = float(os.getenv("FAKE_FACTURAMA_LATENCY_MS", "150"))
+    jitter_ms: float = float(os.getenv("FAKE_FACTURAMA_JITTER_MS", "50"))
+    error_rate: float = float(os.getenv("FAKE_FACTURAMA_ERROR_RATE", "0"))
+    document_kb: int = int(os.getenv("FAKE_FACTURAMA_DOCUMENT_KB", "80"))
+
+
+@dataclass
+class FakeState:
+    cfdis: dict = field(default_factory=dict)  # id -> summary
+    folios: Counter = field(default_factory=Counter)  # (serie, folio) -> times stamped
+    requests: Counter = field(default_factory=Counter)  # endpoint -> count
+
+
+def create_app(config: FakeConfig | None = None) -> FastAPI:
+    config = config or FakeConfig()
+    state = FakeState()
+    documents: dict[int, str] = {}
+    app = FastAPI(title="Fake Facturama")
+    app.state.config = config
+    app.state.fake = state
+
+    async def simulate(endpoint: str):
+        state.requests[endpoint] += 1
+        delay = max(random.gauss(config.latency_ms, config.jitter_ms), 0) / 1000
+        await asyncio.sleep(delay)
+        if random.random() < config.error_rate:
+            return JSONResponse({"Message": "Error simulado"}, status_code=503)
+        return None
+
+    def document(size_kb: int) -> dict:
+        if size_kb not in documents:
+            documents[size_kb] = base64.b64encode(os.urandom(size_kb * 1024)).decode()
+        return {"ContentEncoding": "base64", "ContentLength": size_kb * 1024, "Content": documents[size_kb]}
+
+    @app.post("/3/cfdis")
+    async def create_cfdi(request: Request):
+        payload = await request.json()
+        if error := await simulate("create"):
+            return error
+        if not payload.get("Items"):
+            return JSONResponse({"Message": "La factura debe tener conceptos"}, status_code=400)
+        cfdi_id = uuid.uuid4().hex
+        serie, folio = payload.get("Serie"), payload.get("Folio")
+        state.folios[(serie, folio)] += 1
+        state.cfdis[cfdi_id] = {
+            "Id": cfdi_id,
+            "Uuid": str(uuid.uuid4()).upper(),
+            "Serie": serie,
+            "Folio": folio,
+            "Date": payload.get("Date") or datetime.now().isoformat(timespec="seconds"),
+            "Total": round(sum(float(item.get("Total", 0)) for item in payload["Items"]), 2),
+        }
+        return state.cfdis[cfdi_id]
+
+    @app.get("/cfdi")
+    async def list_cfdis(dateStart: str = "", dateEnd: str = "", type: str = "issued"):
+        if error := await simulate("list"):
+            return error
+        rows = [c for c in state.cfdis.values() if dateStart <= c["Date"][:10] <= (dateEnd or "9999")]
+        return rows
+
+    @app.get("/api/Cfdi/{fmt}/{cfdi_type}/{cfdi_id}")
+    async def download_document(fmt: str, cfdi_type: str, cfdi_id: str):
+        if error := await simulate(fmt.lower()):
+            return error
+        if cfdi_id not in state.cfdis:
+            return JSONResponse({"Message": "No encontrado"}, status_code=404)
+        return {"ContentType": fmt.lower(), **document(config.document_kb if fmt.lower() == "pdf" else 8)}
+
+    @app.get("/cfdi/zip")
+    async def download_zip(id: str, type: str = "issued"):
+        if error := await simulate("zip"):
+            return error
+        if id not in state.cfdis:
+            return JSONResponse({"Message": "No encontrado"}, status_code=404)
+        return {"ContentType": "zip", **document(config.document_kb)}
+
+    @app.get("/_stats")
+    async def stats():
+        repeated = {f"{serie}-{folio}": n for (serie, folio), n in state.folios.items() if n > 1}
+        return {
+            "cfdis": len(state.cfdis),
+            "repeated_folios": repeated,
+            "collisions": sum(n - 1 for n in repeated.values()),
+            "requests": dict(state.requests),
+        }
+
+    @app.post("/_reset")
+    async def reset():
+        state.cfdis.clear()
+        state.folios.clear()
+        state.requests.clear()
+        return {"ok": True}
+
+    return app
+
+
+app = create_app()
@@ -6,8 +6,9 @@ from sqlalchemy import engine_from_config, pool
 
 from app.core.config import settings
 from app.core.db import Base
-from app.models.invoice import Invoice, InvoiceItem  # noqa: F401
-from app.models.series import Series, SeriesCounter  # noqa: F401
+from app.models.invoice import DocumentFetch, IdempotencyClaim, Invoice, InvoiceItem, StampJob  # noqa: F401
+from app.models.rate_limit import RateLimitBucket  # noqa: F401
+from app.models.series import Series, SeriesCounter, SpareFolio  # noqa: F401
 from app.models.user import User, AuditLog  # noqa: F401
 
 # this is the Alembic Config object, which provides
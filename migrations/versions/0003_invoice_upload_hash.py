@@ -0,0 +1,20 @@
+"""Add upload_hash to invoices"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0003_invoice_upload_hash"
+down_revision = "0002_users_audit_logs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("invoices", sa.Column("upload_hash", sa.String(length=64)))
+    op.create_index("ix_invoices_upload_hash", "invoices", ["upload_hash"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_invoices_upload_hash", table_name="invoices")
+    op.drop_column("invoices", "upload_hash")
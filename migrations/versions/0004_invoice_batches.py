@@ -0,0 +1,22 @@
+"""Add batch_id/batch_part to invoices"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0004_invoice_batches"
+down_revision = "0003_invoice_upload_hash"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("invoices", sa.Column("batch_id", sa.String(length=32)))
+    op.add_column("invoices", sa.Column("batch_part", sa.Integer()))
+    op.create_index("ix_invoices_batch_id", "invoices", ["batch_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_invoices_batch_id", table_name="invoices")
+    op.drop_column("invoices", "batch_part")
+    op.drop_column("invoices", "batch_id")
@@ -0,0 +1,38 @@
+"""Add stamp_jobs for asynchronous stamping runs"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0007_stamp_jobs"
+down_revision = "0006_rate_limit_buckets"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stamp_jobs",
+        sa.Column("id", sa.String(length=32), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="queued"),
+        sa.Column("stage", sa.String(length=30), nullable=False, server_default="queued"),
+        sa.Column("message", sa.Text()),
+        sa.Column("serie", sa.String(length=10), nullable=False),
+        sa.Column("issue_date", sa.Date(), nullable=False),
+        sa.Column("expedition_place", sa.String(length=10)),
+        sa.Column("observations", sa.Text()),
+        sa.Column("upload_path", sa.String(length=255), nullable=False),
+        sa.Column("upload_hash", sa.String(length=64)),
+        sa.Column("excel_filename", sa.String(length=255)),
+        sa.Column("result_json", sa.Text()),
+        sa.Column("locked_until", sa.DateTime(timezone=True)),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_stamp_jobs_created_at", "stamp_jobs", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_stamp_jobs_created_at", table_name="stamp_jobs")
+    op.drop_table("stamp_jobs")
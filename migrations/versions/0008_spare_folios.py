@@ -0,0 +1,22 @@
+"""Add spare_folios for unused folios handed back from leased blocks"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0008_spare_folios"
+down_revision = "0007_stamp_jobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "spare_folios",
+        sa.Column("series_code", sa.String(length=10), primary_key=True),
+        sa.Column("folio", sa.Integer(), primary_key=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("spare_folios")
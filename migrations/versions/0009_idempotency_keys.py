@@ -0,0 +1,22 @@
+"""Add idempotency keys to invoices and stamp_jobs"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0009_idempotency_keys"
+down_revision = "0008_spare_folios"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("invoices", sa.Column("idempotency_key", sa.String(length=64)))
+    op.create_index("ix_invoices_idempotency_key", "invoices", ["idempotency_key"])
+    op.add_column("stamp_jobs", sa.Column("idempotency_token", sa.String(length=255)))
+
+
+def downgrade() -> None:
+    op.drop_column("stamp_jobs", "idempotency_token")
+    op.drop_index("ix_invoices_idempotency_key", table_name="invoices")
+    op.drop_column("invoices", "idempotency_key")
@@ -0,0 +1,23 @@
+"""Add idempotency_claims for stamping requests in progress"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0010_idempotency_claims"
+down_revision = "0009_idempotency_keys"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "idempotency_claims",
+        sa.Column("key", sa.String(length=64), primary_key=True),
+        sa.Column("owner", sa.String(length=32), nullable=False),
+        sa.Column("claimed_at", sa.DateTime(timezone=True), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("idempotency_claims")
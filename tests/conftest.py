@@ -0,0 +1,111 @@
+import asyncio
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.models.user  # noqa: F401
+from app.core.db import Base
+from app.models.series import Series
+from app.services.excel_service import EXPECTED_COLUMNS
+from app.services.facturama_client import FacturamaError
+
+
+def _row(**overrides):
+    row = {col: "" for col in EXPECTED_COLUMNS}
+    row.update(
+        {
+            "RFC": "XAXX010101000",
+            "Razon Social": "PUBLICO EN GENERAL",
+            "UsoCFDI": "S01",
+            "Fiscal Regime": "616",
+            "CP": 1000,
+            "Forma de Pago": 1,
+            "Metodo de Pago": "PUE",
+            "ClaveProdServ": "01010101",
+            "Concepto": "Venta",
+            "ClaveUnidad": "ACT",
+            "Unidad": "Actividad",
+            "Cantidad": 1,
+            "Precio Unitario": 100,
+            "Objeto Impuesto": "02",
+            "Subtotal del Concepto": 100,
+            "IVA del Concepto": 16,
+            "Total del Concepto": 116,
+            "Pedido": "P1",
+            "Periodicidad": "04",
+            "Mes": "01",
+            "Year": 2026,
+        }
+    )
+    row.update(overrides)
+    return row
+
+
+class FakeFacturama:
+    """Stand-in for FacturamaClient: stamps every payload, optionally slowly or failing some downloads."""
+
+    def __init__(self, create_delay=0.0, download_delay=0.0, zip_delay=0.0, failing_formats=()):
+        self.create_delay = create_delay
+        self.download_delay = download_delay
+        self.zip_delay = zip_delay
+        self.failing_formats = set(failing_formats)
+        self.calls = []
+
+    async def create_cfdi(self, payload):
+        await asyncio.sleep(self.create_delay)
+        self.calls.append(("create", payload["Folio"]))
+        return {"Id": f"id-{payload['Folio']}", "Uuid": f"uuid-{payload['Folio']}"}
+
+    async def download_document(self, cfdi_id, fmt, target=None, cfdi_type="issued"):
+        await asyncio.sleep(self.download_delay)
+        if fmt in self.failing_formats:
+            raise FacturamaError(f"{fmt.upper()} no disponible", status_code=500)
+        self.calls.append((fmt, cfdi_id))
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        Path(target).write_bytes(b"doc")
+        return target
+
+    async def download_zip(self, cfdi_id, target=None, cfdi_type="issued"):
+        await asyncio.sleep(self.zip_delay)
+        self.calls.append(("zip", cfdi_id))
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        Path(target).write_bytes(b"zip")
+        return target
+
+
+@pytest.fixture
+def make_row():
+    """Builds a valid upload row; keyword arguments override columns."""
+    return _row
+
+
+@pytest.fixture
+def make_workbook(tmp_path):
+    """Writes rows to an .xlsx in tmp_path and returns its path."""
+
+    def make(rows, name="factura.xlsx"):
+        path = tmp_path / name
+        pd.DataFrame(rows, columns=EXPECTED_COLUMNS).to_excel(path, index=False)
+        return path
+
+    return make
+
+
+@pytest.fixture
+def make_facturama():
+    return FakeFacturama
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Sessions on a file-backed SQLite database (shared across threads) with the ML serie."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"timeout": 2})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        session.add(Series(code="ML", description="Mercado Libre", is_active=True))
+        session.commit()
+    return factory
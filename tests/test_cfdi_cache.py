@@ -0,0 +1,50 @@
+from datetime import date
+
+from app.services.cfdi_cache import CfdiListCache
+
+
+def _cache(now, max_entries=10):
+    return CfdiListCache(max_entries, past_ttl=3600, today_ttl=60, clock=lambda: now[0], today=lambda: date(2026, 3, 15))
+
+
+def test_ranges_reaching_today_expire_sooner():
+    now = [0.0]
+    cache = _cache(now)
+    past = ("issued", "2026-02-01", "2026-02-28")
+    current = ("issued", "2026-03-01", "2026-03-31")
+    cache.put(past, {"Data": [1]})
+    cache.put(current, {"Data": [2]})
+
+    now[0] = 61
+    assert cache.get(current) is None
+    assert cache.get(past).data == {"Data": [1]}
+    assert cache.get(past).age == 61
+    now[0] = 3601
+    assert cache.get(past) is None
+
+
+def test_ranges_ending_in_the_backdating_window_expire_sooner():
+    now = [0.0]
+    cache = _cache(now)
+    backdated = ("issued", "2026-03-01", "2026-03-13")  # today - 2: CFDIs can still be issued on it
+    settled = ("issued", "2026-03-01", "2026-03-12")
+    cache.put(backdated, [])
+    cache.put(settled, [])
+
+    now[0] = 61
+    assert cache.get(backdated) is None
+    assert cache.get(settled) is not None
+
+
+def test_lru_eviction_and_invalidation_by_day():
+    now = [0.0]
+    cache = _cache(now, max_entries=2)
+    jan, feb, mar = (("issued", f"2026-0{m}-01", f"2026-0{m}-28") for m in (1, 2, 3))
+    cache.put(jan, [])
+    cache.put(feb, [])
+    cache.get(jan)
+    cache.put(mar, [])
+    assert cache.get(feb) is None and cache.get(jan) is not None
+
+    assert cache.invalidate(date(2026, 3, 10)) == 1
+    assert cache.get(mar) is None and cache.get(jan) is not None
@@ -0,0 +1,103 @@
+import asyncio
+import time
+import zipfile
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.models.invoice import DocumentFetch, Invoice
+from app.services.document_queue import DocumentQueue, download_documents, enqueue_documents
+
+SLOW_DOWNLOADS = {"download_delay": 0.2, "zip_delay": 5, "failing_formats": {"xml"}}  # XML fails, ZIP times out
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "facturas_storage_dir", tmp_path)
+    return tmp_path
+
+
+def _stamped_invoice(session_factory, folio=7):
+    with session_factory() as session:
+        invoice = Invoice(status="success", serie="ML", folio=folio, facturama_id=f"cfdi-{folio}", issue_date=date.today())
+        session.add(invoice)
+        session.flush()
+        enqueue_documents(session, invoice)
+        session.commit()
+        return invoice.id
+
+
+def test_downloads_run_concurrently_and_isolate_failures(storage, monkeypatch, make_facturama):
+    monkeypatch.setattr(settings, "facturama_documents_timeout", 0.5)
+    monkeypatch.setattr(settings, "facturama_remote_zip", True)
+    invoice = Invoice(serie="ML", folio=7, facturama_id="cfdi-7")
+
+    started = time.monotonic()
+    errors = asyncio.run(download_documents(make_facturama(**SLOW_DOWNLOADS), invoice))
+    assert time.monotonic() - started < 1
+
+    assert invoice.pdf_path == str(storage / "pdf" / "ML-7.pdf")
+    assert invoice.xml_path is None
+    assert set(errors) == {"xml", "zip"} and errors["zip"] == "Tiempo agotado"
+    assert not (storage / "zip" / "ML-7.zip").exists()
+
+
+def test_queue_fetches_documents_for_stamped_invoices(storage, session_factory, make_facturama):
+    invoice_id = _stamped_invoice(session_factory)
+    client = make_facturama()
+    queue = DocumentQueue(workers=0, session_factory=session_factory, client_factory=lambda: client)
+
+    assert asyncio.run(queue.drain()) == 1
+    with session_factory() as session:
+        invoice = session.get(Invoice, invoice_id)
+        job = session.scalar(select(DocumentFetch))
+        assert job.status == "done" and job.attempts == 1
+        assert invoice.pdf_path and invoice.xml_path
+    with zipfile.ZipFile(storage / "zip" / "ML-7.zip") as archive:
+        assert sorted(archive.namelist()) == ["ML-7.pdf", "ML-7.xml"]
+        assert archive.read("ML-7.pdf") == b"doc"
+    assert sorted(call for call, _ in client.calls) == ["pdf", "xml"]
+
+
+def test_zip_is_not_built_without_both_documents(storage, make_facturama):
+    invoice = Invoice(serie="ML", folio=7, facturama_id="cfdi-7")
+
+    errors = asyncio.run(download_documents(make_facturama(**SLOW_DOWNLOADS), invoice, ["xml", "zip"]))
+    assert set(errors) == {"xml", "zip"}
+    assert not (storage / "zip" / "ML-7.zip").exists()
+
+
+def test_failed_downloads_back_off_and_only_refetch_missing(storage, session_factory, monkeypatch, make_facturama):
+    monkeypatch.setattr(settings, "document_max_attempts", 2)
+    monkeypatch.setattr(settings, "facturama_documents_timeout", 0.5)
+    _stamped_invoice(session_factory)
+    client = make_facturama(**SLOW_DOWNLOADS)
+    queue = DocumentQueue(workers=0, session_factory=session_factory, client_factory=lambda: client)
+
+    assert asyncio.run(queue.drain()) == 1  # the retry is scheduled for later
+    with session_factory() as session:
+        job = session.scalar(select(DocumentFetch))
+        assert job.status == "pending" and job.attempts == 1
+        assert (job.next_attempt_at - datetime.utcnow()).total_seconds() > settings.document_retry_base - 5
+        assert "xml" in job.last_error
+        job.next_attempt_at = datetime.utcnow()
+        session.commit()
+
+    client.calls.clear()
+    asyncio.run(queue.drain())
+    assert "pdf" not in [call for call, _ in client.calls]
+    with session_factory() as session:
+        assert session.scalar(select(DocumentFetch)).status == "failed"
+
+
+def test_expired_lease_is_claimed_again(session_factory):
+    _stamped_invoice(session_factory)
+    queue = DocumentQueue(workers=0, session_factory=session_factory)
+    assert queue._claim() is not None
+    assert queue._claim() is None  # leased to the first worker
+    with session_factory() as session:
+        session.scalar(select(DocumentFetch)).locked_until = datetime(2000, 1, 1)
+        session.commit()
+    assert queue._claim() is not None
@@ -0,0 +1,158 @@
+import json
+from datetime import date
+
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from app.services import excel_service
+from app.services.excel_service import ExcelService, split_items
+
+
+def _process(tmp_path, path, **kwargs):
+    return ExcelService(storage_dir=tmp_path, **kwargs).process(path, serie="ML", folio=7, issue_date=date.today())
+
+
+def test_process_builds_payload(tmp_path, make_row, make_workbook):
+    result = _process(tmp_path, make_workbook([make_row(), make_row(Pedido="P2")]))
+    assert result.valid
+    payload = result.payload
+    assert payload["Folio"] == 7
+    assert payload["PaymentForm"] == "01"
+    assert payload["ExpeditionPlace"] == "01000"
+    assert payload["Observations"] == ""
+    assert payload["GlobalInformation"]["Year"] == 2026
+    assert [item["IdentificationNumber"] for item in payload["Items"]] == ["P1", "P2"]
+    assert payload["Items"][0]["Taxes"][0]["Total"] == 16.0
+
+
+def test_process_reports_row_errors(tmp_path, make_row, make_workbook):
+    rows = [
+        make_row(),
+        make_row(Cantidad="abc"),
+        make_row(Pedido=None, ClaveUnidad=None),
+        make_row(**{"Total del Concepto": 116.02}),
+        make_row(**{"Total del Concepto": 116.03}),
+        make_row(**{"Precio Unitario": "x"}),
+    ]
+    result = _process(tmp_path, make_workbook(rows))
+    assert not result.valid
+    assert result.errors == [
+        "Fila 3: Cantidad: No es un número válido: abc; Cantidad debe ser mayor a 0",
+        "Fila 4: Pedido es obligatorio (IdentificationNumber); ClaveUnidad requerida",
+        "Fila 6: Total no cuadra con Subtotal + IVA (tolerancia 0.02)",
+        "Fila 7: Precio Unitario: No es un número válido: x",
+    ]
+    assert result.error_excel_path.exists()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_error_report_keeps_full_messages_and_highlights_cells(tmp_path, streaming, make_row, make_workbook):
+    path = make_workbook([make_row(), make_row(Cantidad="abc")])
+    result = _process(tmp_path, path, streaming=streaming)
+    assert [(err.row_number, err.column) for err in result.row_errors] == [(3, "Cantidad"), (3, "Cantidad")]
+
+    sheet = load_workbook(result.error_excel_path).active
+    header = [cell.value for cell in sheet[1]]
+    bad_row = sheet[3]
+    assert bad_row[header.index("Errores")].value == "Cantidad: No es un número válido: abc; Cantidad debe ser mayor a 0"
+    assert bad_row[header.index("Cantidad")].fill.fill_type == "solid"
+    assert sheet[2][header.index("Cantidad")].fill.fill_type is None
+
+
+def test_reader_engines_agree(tmp_path, make_row, make_workbook):
+    pytest.importorskip("python_calamine")
+    path = make_workbook([make_row(), make_row(Pedido="P2", Cantidad=2.5)])
+    results = [_process(tmp_path, path, reader_engine=engine) for engine in ("openpyxl", "calamine")]
+    assert results[0].payload == results[1].payload
+
+
+def test_streaming_matches_frame_mode(tmp_path, make_row, make_workbook):
+    valid = make_workbook([make_row(), make_row(Pedido="P2", Cantidad=2.5)], "valid.xlsx")
+    invalid = make_workbook([make_row(), make_row(Cantidad=0), make_row(Pedido=None)], "invalid.xlsx")
+    for path in (valid, invalid):
+        frame = _process(tmp_path, path, streaming=False)
+        stream = _process(tmp_path, path, streaming=True)
+        assert (stream.valid, stream.errors, stream.payload) == (frame.valid, frame.errors, frame.payload)
+    assert stream.error_excel_path.exists()
+
+
+def test_edge_amounts_give_the_same_errors_in_both_modes(tmp_path, make_row, make_workbook):
+    path = make_workbook(
+        [
+            make_row(Cantidad=2),  # pandas reads TRUE as 1 when a 1 shares the column
+            make_row(Pedido="P2", Cantidad=True),
+            make_row(Pedido="P3", Cantidad=5e-07),  # rounds half-up to 0.000001
+            make_row(
+                Pedido="P4",
+                Cantidad=2,
+                **{"Subtotal del Concepto": 0.1, "IVA del Concepto": 0.2, "Total del Concepto": 0.3200005},
+            ),
+        ]
+    )
+    stream = _process(tmp_path, path, streaming=True)
+    assert stream.errors == [
+        "Fila 3: Cantidad: No es un número válido: True; Cantidad debe ser mayor a 0",
+        "Fila 5: Total no cuadra con Subtotal + IVA (tolerancia 0.02)",
+    ]
+    assert _process(tmp_path, path, streaming=False).errors == stream.errors
+
+
+def test_non_finite_amounts_are_row_errors_in_both_modes(tmp_path, make_row, make_workbook):
+    path = make_workbook([make_row(), make_row(Cantidad="NaN", Pedido="P2")])
+    stream = _process(tmp_path, path, streaming=True)
+    assert stream.errors == ["Fila 3: Cantidad: No es un número válido: NaN; Cantidad debe ser mayor a 0"]
+    assert stream.errors == _process(tmp_path, path, streaming=False).errors
+
+
+def test_frame_mode_converts_amounts_per_distinct_value(tmp_path, monkeypatch, make_row, make_workbook):
+    rows = [make_row(Pedido=f"P{i}", Cantidad=1 + i % 3) for i in range(600)]
+    rows[5]["Cantidad"] = "abc"
+    path = make_workbook(rows)
+    calls = []
+    to_decimal = excel_service.to_decimal
+
+    def counting(value):
+        calls.append(value)
+        return to_decimal(value)
+
+    monkeypatch.setattr(excel_service, "to_decimal", counting)
+    errors = _process(tmp_path, path).errors
+    assert errors == ["Fila 7: Cantidad: No es un número válido: abc; Cantidad debe ser mayor a 0"]
+    assert calls == ["abc"]  # validation: only the cell pandas couldn't coerce
+
+    rows[5]["Cantidad"] = 2
+    calls.clear()
+    assert len(_process(tmp_path, make_workbook(rows)).payload["Items"]) == 600
+    assert len(calls) == 8  # 3 quantities, 1 per other amount and the header's Year; not 5 per row
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_csv_and_parquet_match_excel(tmp_path, fmt, make_row, make_workbook):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    rows = [make_row(), make_row(Pedido="P2", Cantidad=2.5), make_row(Cantidad=0)]
+    xlsx = make_workbook(rows)
+    df = pd.read_excel(xlsx, dtype=object)
+    # Content decides the format, not the extension.
+    upload = tmp_path / "upload.dat"
+    if fmt == "csv":
+        df.to_csv(upload, index=False)
+    else:
+        df.astype(str).where(df.notna(), None).to_parquet(upload, index=False)
+    expected = _process(tmp_path, xlsx)
+    for streaming in (False, True):
+        result = _process(tmp_path, upload, streaming=streaming)
+        assert result.errors == expected.errors
+        assert result.error_excel_path.name == f"upload_errores.{fmt}"
+
+
+def test_split_items_by_count_and_size():
+    items = [{"IdentificationNumber": f"P{i}", "Description": "x" * 40} for i in range(5)]
+    assert [len(c) for c in split_items(items)] == [5]
+    assert [len(c) for c in split_items(items, max_items=2)] == [2, 2, 1]
+    item_bytes = len(json.dumps(items[0]).encode()) + 1
+    assert [len(c) for c in split_items(items, max_bytes=100 + 2 * item_bytes, base_bytes=100)] == [2, 2, 1]
+    # An item that doesn't fit any chunk still gets one of its own.
+    assert [len(c) for c in split_items(items, max_bytes=10)] == [1, 1, 1, 1, 1]
+    assert split_items([]) == [[]]
@@ -0,0 +1,198 @@
+import asyncio
+import base64
+import io
+import json
+import os
+from datetime import date
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services.facturama_client import (
+    CircuitBreaker,
+    CircuitOpenError,
+    FacturamaClient,
+    FacturamaError,
+    HttpPool,
+    _ContentDecoder,
+    date_windows,
+)
+
+
+def _pool(handler):
+    return HttpPool(transport=httpx.MockTransport(handler))
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "facturama_retry_backoff", 0)
+
+
+def _flaky(failures, status=503):
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        if len(calls) <= failures:
+            return httpx.Response(status, json={"Message": "Servicio no disponible"})
+        return httpx.Response(200, json={"Content": "eA=="})
+
+    return calls, handler
+
+
+def _run(client, coro_factory):
+    async def scenario():
+        try:
+            return await coro_factory(client)
+        finally:
+            await client.pool.close()
+
+    return asyncio.run(scenario())
+
+
+def test_requests_share_one_pooled_client():
+    seen = []
+
+    def handler(request):
+        seen.append((request.method, request.url.path, request.headers["authorization"].startswith("Basic ")))
+        return httpx.Response(200, json={"Id": "abc"})
+
+    pool = _pool(handler)
+
+    async def scenario():
+        client = FacturamaClient(pool, CircuitBreaker(0, 0))
+        first = pool.client()
+        await client.create_cfdi({"Folio": 1})
+        await FacturamaClient(pool, CircuitBreaker(0, 0)).list_cfdis("2026-01-01", "2026-01-31")
+        assert pool.client() is first
+        await pool.close()
+        assert pool._client is None
+
+    asyncio.run(scenario())
+    assert seen == [("POST", "/3/cfdis", True), ("GET", "/cfdi", True)]
+
+
+def test_error_responses_raise_facturama_error():
+    pool = _pool(lambda request: httpx.Response(400, json={"Message": "RFC inválido"}))
+
+    async def scenario():
+        with pytest.raises(FacturamaError) as info:
+            await FacturamaClient(pool, CircuitBreaker(0, 0)).create_cfdi({})
+        await pool.close()
+        return info.value
+
+    exc = asyncio.run(scenario())
+    assert str(exc) == "RFC inválido" and exc.status_code == 400
+
+
+def test_gets_are_retried_but_stamping_is_not():
+    calls, handler = _flaky(failures=2)
+    client = FacturamaClient(_pool(handler), CircuitBreaker(0, 0))
+    assert _run(client, lambda c: c.download_document("id", "xml")) == "eA=="
+    assert calls == ["GET"] * 3
+
+    calls, handler = _flaky(failures=1)
+    client = FacturamaClient(_pool(handler), CircuitBreaker(0, 0))
+    with pytest.raises(FacturamaError) as info:
+        _run(client, lambda c: c.create_cfdi({"Folio": 1}))
+    assert info.value.status_code == 503
+    assert calls == ["POST"]
+
+
+def test_circuit_opens_after_threshold_and_probes_after_reset():
+    now = [0.0]
+    circuit = CircuitBreaker(threshold=2, reset_timeout=30, clock=lambda: now[0])
+    calls, handler = _flaky(failures=3, status=500)
+    client = FacturamaClient(_pool(handler), circuit)
+
+    with pytest.raises(FacturamaError):
+        _run(client, lambda c: c.create_cfdi({}))
+    with pytest.raises(FacturamaError):
+        _run(client, lambda c: c.create_cfdi({}))
+    assert circuit.snapshot() == {"state": "open", "consecutive_failures": 2, "threshold": 2, "retry_in_seconds": 30}
+
+    with pytest.raises(CircuitOpenError):
+        _run(client, lambda c: c.create_cfdi({}))
+    assert len(calls) == 2  # failed fast, nothing was sent
+
+    now[0] = 31
+    with pytest.raises(FacturamaError):  # the probe fails: open again
+        _run(client, lambda c: c.create_cfdi({}))
+    assert circuit.state == "open" and len(calls) == 3
+
+    now[0] = 62
+    assert _run(client, lambda c: c.create_cfdi({})) == {"Content": "eA=="}
+    assert circuit.state == "closed" and circuit.failures == 0
+
+
+class _ChunkedStream(httpx.AsyncByteStream):
+    def __init__(self, body: bytes, size: int):
+        self.body, self.size = body, size
+
+    async def __aiter__(self):
+        for start in range(0, len(self.body), self.size):
+            yield self.body[start : start + self.size]
+
+
+def test_content_decoder_handles_any_chunking_and_escaped_slashes():
+    document = os.urandom(3000)
+    encoded = base64.b64encode(document).decode().replace("/", "\\/")
+    body = json.dumps({"ContentEncoding": "base64", "ContentType": "zip", "Content": "X"}).replace('"X"', f'"{encoded}"')
+    for size in (1, 7, 4096):
+        sink = io.BytesIO()
+        decoder = _ContentDecoder(sink)
+        raw = body.encode()
+        for start in range(0, len(raw), size):
+            decoder.feed(raw[start : start + size])
+        decoder.close()
+        assert sink.getvalue() == document
+
+
+def test_download_streams_to_disk_and_renames_atomically(tmp_path):
+    document = os.urandom(200_000)
+    body = json.dumps({"ContentType": "zip", "Content": base64.b64encode(document).decode()}).encode()
+
+    def handler(request):
+        if request.url.params.get("id") == "missing":
+            return httpx.Response(404, json={"Message": "No encontrado"})
+        if request.url.params.get("id") == "truncated":
+            return httpx.Response(200, stream=_ChunkedStream(body[: len(body) // 2], 1000))
+        return httpx.Response(200, stream=_ChunkedStream(body, 1000))
+
+    client = FacturamaClient(_pool(handler), CircuitBreaker(0, 0))
+    target = tmp_path / "zip" / "ML-1.zip"
+    assert _run(client, lambda c: c.download_zip("ok", str(target))) == str(target)
+    assert target.read_bytes() == document
+
+    assert _run(client, lambda c: c.download_zip("missing", str(tmp_path / "missing.zip"))) is None
+    with pytest.raises(FacturamaError):
+        _run(client, lambda c: c.download_zip("truncated", str(tmp_path / "truncated.zip")))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["zip"]
+    assert [p.name for p in (tmp_path / "zip").iterdir()] == ["ML-1.zip"]
+
+
+def test_date_windows_overlap_on_boundaries():
+    assert date_windows(date(2026, 1, 1), date(2026, 1, 5), 7) == [(date(2026, 1, 1), date(2026, 1, 5))]
+    windows = date_windows(date(2026, 1, 1), date(2026, 1, 20), 7)
+    assert windows == [
+        (date(2026, 1, 1), date(2026, 1, 8)),
+        (date(2026, 1, 8), date(2026, 1, 15)),
+        (date(2026, 1, 15), date(2026, 1, 20)),
+    ]
+
+
+def test_wide_ranges_are_fetched_in_windows_and_merged(monkeypatch):
+    monkeypatch.setattr(settings, "consultar_window_days", 7)
+    requested = []
+
+    def handler(request):
+        start, end = request.url.params["dateStart"], request.url.params["dateEnd"]
+        requested.append((start, end))
+        # every window repeats the CFDI issued on its first day
+        return httpx.Response(200, json={"Data": [{"Id": start}, {"Id": end}]})
+
+    client = FacturamaClient(_pool(handler), CircuitBreaker(0, 0))
+    rows = _run(client, lambda c: c.list_cfdis_range("2026-01-01", "2026-01-20"))
+    assert len(requested) == 3
+    assert [row["Id"] for row in rows] == ["2026-01-01", "2026-01-08", "2026-01-15", "2026-01-20"]
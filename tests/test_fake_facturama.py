@@ -0,0 +1,45 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.facturama_client import CircuitBreaker, FacturamaClient, FacturamaError, HttpPool
+from benchmarks.fake_facturama import FakeConfig, create_app
+
+
+def _run(app, coro_factory):
+    client = FacturamaClient(HttpPool(transport=httpx.ASGITransport(app=app)), CircuitBreaker(0, 0))
+
+    async def scenario():
+        try:
+            return await coro_factory(client)
+        finally:
+            await client.pool.close()
+
+    return asyncio.run(scenario())
+
+
+def test_fake_server_stamps_serves_documents_and_counts_collisions(tmp_path):
+    app = create_app(FakeConfig(latency_ms=0, jitter_ms=0, error_rate=0, document_kb=1))
+    items = [{"Total": 116.0}]
+
+    async def scenario(client):
+        first = await client.create_cfdi({"Serie": "ML", "Folio": 1, "Items": items})
+        await client.create_cfdi({"Serie": "ML", "Folio": 1, "Items": items})
+        await client.create_cfdi({"Serie": "ML", "Folio": 2, "Items": items})
+        saved = await client.download_document(first["Id"], "pdf", str(tmp_path / "ML-1.pdf"))
+        stats = await client.pool.client().get(f"{client.base_url}/_stats")
+        return first, saved, stats.json()
+
+    first, saved, stats = _run(app, scenario)
+    assert first["Total"] == 116.0
+    assert saved and (tmp_path / "ML-1.pdf").stat().st_size == 1024
+    assert stats["cfdis"] == 3
+    assert stats["repeated_folios"] == {"ML-1": 2}
+    assert stats["collisions"] == 1
+
+
+def test_fake_server_simulates_errors():
+    app = create_app(FakeConfig(latency_ms=0, jitter_ms=0, error_rate=1))
+    with pytest.raises(FacturamaError, match="Error simulado"):
+        _run(app, lambda client: client.create_cfdi({"Serie": "ML", "Folio": 1, "Items": [{"Total": 1}]}))
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from datetime import date
+
+from sqlalchemy import select
+
+from app.core.workers import CpuPool
+from app.models.invoice import Invoice
+from app.models.series import SeriesCounter
+from app.services import invoicing_service
+from app.services.excel_service import ExcelService
+from app.services.folio_service import FolioBlocks, FolioService
+from app.services.invoicing_service import InvoicingService
+from app.services.upload_cache import UploadCache
+
+
+def test_concurrent_reservations_never_share_a_folio(session_factory):
+    taken, errors = [], []
+
+    def reserve(count):
+        try:
+            with session_factory() as session:
+                first = FolioService(session).reserve("ML", count)
+            taken.extend(range(first, first + count))
+        except Exception as exc:  # pragma: no cover - surfaced by the assert below
+            errors.append(exc)
+
+    threads = [threading.Thread(target=reserve, args=(1 + i % 3,)) for i in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(taken) == list(range(1, len(taken) + 1))
+    with session_factory() as session:
+        assert session.get(SeriesCounter, "ML").last_folio == len(taken)
+
+
+def test_counter_starts_after_existing_invoices_and_failed_folios_are_reclaimed(session_factory):
+    with session_factory() as session:
+        session.add_all(
+            [
+                Invoice(status="success", serie="ML", folio=7),
+                Invoice(status="failed", serie="ML", folio=8),
+            ]
+        )
+        session.commit()
+        folios = FolioService(session)
+
+        assert folios.reserve("ML") == 9
+        reclaimed = folios.reclaim_failed("ML")
+        assert (reclaimed.folio, reclaimed.status) == (8, "pending")
+        assert folios.reclaim_failed("ML") is None
+        assert folios.next_folio("ML") == 10
+
+
+def test_parallel_uploads_stamp_distinct_folios(
+    session_factory,
+    tmp_path,
+    monkeypatch,
+    make_row,
+    make_workbook,
+    make_facturama,
+):
+    monkeypatch.setattr(invoicing_service, "cpu_pool", CpuPool(workers=0, queue_size=8))
+    monkeypatch.setattr(invoicing_service, "enqueue_documents", lambda session, invoice: None)
+
+    async def upload(index):
+        path = make_workbook([make_row(Pedido=f"P{index}")], name=f"sucursal_{index}.xlsx")
+        with session_factory() as session:
+            service = InvoicingService(session)
+            service.excel_service = ExcelService(storage_dir=tmp_path)
+            service.upload_cache = UploadCache(tmp_path / "cache", max_entries=10)
+            service.facturama = make_facturama(create_delay=0.05)  # others reserve and write meanwhile
+            return await service.process_invoice(path, "ML", date.today())
+
+    async def run():
+        return await asyncio.gather(*(upload(i) for i in range(6)))
+
+    results = asyncio.run(run())
+
+    assert [r["success"] for r in results] == [True] * 6
+    assert sorted(r["folio"] for r in results) == [1, 2, 3, 4, 5, 6]
+    with session_factory() as session:
+        assert session.scalars(select(Invoice.status).order_by(Invoice.folio)).all() == ["success"] * 6
+
+
+def test_leased_blocks_hand_back_unused_folios_and_gaps_are_reported(session_factory):
+    blocks = FolioBlocks(5)
+    with session_factory() as session:
+        folios = FolioService(session)
+        assert [blocks.take(folios, "ML") for _ in range(2)] == [1, 2]
+        assert session.get(SeriesCounter, "ML").last_folio == 5
+        assert blocks.leased("ML") == [3, 4, 5]
+
+        blocks.release_all(session_factory)  # top of the counter: rewound
+        session.expire_all()
+        assert session.get(SeriesCounter, "ML").last_folio == 2
+
+        assert blocks.take(folios, "ML") == 3
+        assert folios.reserve("ML") == 8  # someone else reserved after this block
+        blocks.release_all(session_factory)  # not the top any more: kept as spare folios
+        assert folios.take_spare("ML") == 4
+
+        session.add_all(Invoice(status="success", serie="ML", folio=folio) for folio in (1, 3, 4, 8))
+        session.commit()
+        assert folios.gaps("ML") == [2]  # 5 to 7 are still spare
+        assert folios.gaps("ML", exclude=[2]) == []
+
+
+def test_gaps_left_by_a_dead_process_can_be_handed_back(session_factory):
+    with session_factory() as session:
+        folios = FolioService(session)
+        assert folios.reserve("ML", 5) == 1  # a process leased 1 to 5 and died after using 1 and 3
+        session.add_all(Invoice(status="success", serie="ML", folio=folio) for folio in (1, 3))
+        session.commit()
+
+        assert folios.release_gaps("ML") == [2, 4, 5]
+        assert folios.gaps("ML") == []
+        assert [folios.take_spare("ML") for _ in range(3)] == [2, 4, 5]
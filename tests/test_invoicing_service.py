@@ -0,0 +1,229 @@
+import asyncio
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.core.workers import CpuPool
+from app.models.invoice import DocumentFetch, IdempotencyClaim, Invoice
+from app.models.series import SeriesCounter
+from app.services import invoicing_service
+from app.services.cfdi_cache import cfdi_cache
+from app.services.excel_service import ExcelService
+from app.services.folio_service import FolioServiceError
+from app.services.invoicing_service import InvoicingService
+from app.services.upload_cache import UploadCache, hash_file
+from app.services.upload_storage import StoredUpload
+
+
+@pytest.fixture
+def session(session_factory):
+    with session_factory() as session:
+        yield session
+
+
+@pytest.fixture
+def service(session, tmp_path, monkeypatch, make_facturama):
+    monkeypatch.setattr(invoicing_service, "cpu_pool", CpuPool(workers=0, queue_size=4))
+    svc = InvoicingService(session)
+    svc.excel_service = ExcelService(storage_dir=tmp_path)
+    svc.upload_cache = UploadCache(tmp_path / "cache", max_entries=10)
+    svc.facturama = make_facturama()
+    return svc
+
+
+def test_validate_invoice_is_a_dry_run(service, session, tmp_path, make_row, make_workbook):
+    path = make_workbook([make_row(), make_row(Pedido="P2")])
+    result = asyncio.run(service.validate_invoice(path, "ML", date.today()))
+
+    assert result["valid"] and result["errors"] == [] and result["row_errors"] == []
+    assert result["item_count"] == 2
+    assert result["totals"] == {"subtotal": 200.0, "iva": 32.0, "total": 232.0}
+    assert service.facturama.calls == []
+    assert session.scalar(select(func.count()).select_from(Invoice)) == 0
+    assert session.scalar(select(func.count()).select_from(SeriesCounter)) == 0
+
+
+def test_validate_invoice_reports_row_errors(service, tmp_path, make_row, make_workbook):
+    path = make_workbook([make_row(), make_row(Cantidad=0)])
+    result = asyncio.run(service.validate_invoice(path, "ML", date.today()))
+
+    assert not result["valid"]
+    assert result["row_errors"] == [{"row": 3, "column": "Cantidad", "message": "Cantidad debe ser mayor a 0"}]
+    assert result["totals"] is None
+    assert result["error_excel"].endswith("_errores.xlsx")
+
+
+def test_oversized_upload_is_split_into_consecutive_folios(
+    service,
+    session,
+    tmp_path,
+    monkeypatch,
+    make_row,
+    make_workbook,
+):
+    monkeypatch.setattr(settings, "cfdi_max_items", 2)
+    monkeypatch.setattr(settings, "facturas_storage_dir", tmp_path)
+    path = make_workbook([make_row(Pedido=f"P{i}") for i in range(5)])
+    listing = ("issued", date.today().isoformat(), date.today().isoformat())
+    cfdi_cache.put(listing, {"Data": []})
+    result = asyncio.run(service.process_invoice(path, "ML", date.today()))
+
+    assert result["success"] and result["folios"] == [1, 2, 3]
+    invoices = session.scalars(select(Invoice).order_by(Invoice.folio)).all()
+    assert [inv.batch_part for inv in invoices] == [1, 2, 3]
+    assert len({inv.batch_id for inv in invoices}) == 1
+    assert [len(inv.items) for inv in invoices] == [2, 2, 1]
+    assert session.get(SeriesCounter, "ML").last_folio == 3
+    assert sorted(service.facturama.calls) == [("create", 1), ("create", 2), ("create", 3)]
+    assert session.scalar(select(func.count()).select_from(DocumentFetch)) == 3
+    assert cfdi_cache.get(listing) is None
+
+
+def test_bulk_stamps_valid_files_in_order_and_reports_the_rest(service, session, tmp_path, make_row, make_workbook):
+    uploads = []
+    for name, rows in [
+        ("sucursal_a.xlsx", [make_row(Pedido="A1")]),
+        ("sucursal_b.xlsx", [make_row(Pedido="B1", Cantidad=0)]),
+        ("sucursal_c.xlsx", [make_row(Pedido="C1"), make_row(Pedido="C2")]),
+    ]:
+        path = make_workbook(rows, name=name)
+        uploads.append(StoredUpload(path, hash_file(path), path.stat().st_size, filename=name))
+
+    result = asyncio.run(service.process_bulk(uploads, "ML", date.today()))
+
+    assert not result["success"]
+    assert [(f["filename"], f["status"], f["folios"]) for f in result["files"]] == [
+        ("sucursal_a.xlsx", "success", [1]),
+        ("sucursal_b.xlsx", "invalid", []),
+        ("sucursal_c.xlsx", "success", [2]),
+    ]
+    assert result["files"][2]["total"] == 232.0
+    assert session.get(SeriesCounter, "ML").last_folio == 2
+    assert sorted(service.facturama.calls) == [("create", 1), ("create", 2)]
+    rows = list(load_workbook(result["error_excel"]).active.values)
+    assert rows == [("Archivo", "Fila", "Columna", "Error"), ("sucursal_b.xlsx", 2, "Cantidad", "Cantidad debe ser mayor a 0")]
+
+
+def test_bulk_abort_leaves_no_invoice_pending(service, session, monkeypatch, make_row, make_workbook):
+    session.add(Invoice(status="failed", serie="ML", folio=1))
+    session.commit()
+    uploads = []
+    for name in ("sucursal_a.xlsx", "sucursal_b.xlsx"):
+        path = make_workbook([make_row()], name=name)
+        uploads.append(StoredUpload(path, hash_file(path), path.stat().st_size, filename=name))
+    reserve, calls = service._reserve, []
+
+    def reserve_once(serie, count):
+        calls.append(count)
+        if len(calls) > 1:
+            raise FolioServiceError("La serie ML está inactiva")
+        return reserve(serie, count)
+
+    monkeypatch.setattr(service, "_reserve", reserve_once)
+    result = asyncio.run(service.process_bulk(uploads, "ML", date.today()))
+
+    assert not result["success"] and result["errors"] == ["La serie ML está inactiva"]
+    assert service.facturama.calls == []
+    session.expire_all()
+    invoice = session.scalars(select(Invoice)).one()  # folio 1 was reclaimed for sucursal_a
+    assert (invoice.folio, invoice.status, invoice.error_message) == (1, "failed", "La serie ML está inactiva")
+
+
+def test_repeated_request_returns_the_original_result(service, session, tmp_path, make_row, make_workbook):
+    path = make_workbook([make_row()])
+    first = asyncio.run(service.process_invoice(path, "ML", date.today()))
+    again = asyncio.run(service.process_invoice(path, "ML", date.today()))
+
+    assert first["success"] and again["replayed"]
+    assert (again["folio"], again["uuid"], again["invoice_id"]) == (first["folio"], first["uuid"], first["invoice_id"])
+    assert service.facturama.calls == [("create", 1)]
+    assert session.scalar(select(func.count()).select_from(Invoice)) == 1
+    assert session.get(SeriesCounter, "ML").last_folio == 1
+
+    other = asyncio.run(service.process_invoice(path, "ML", date.today(), idempotency_token="otra-pestaña"))
+    assert other["success"] and other["folio"] == 2 and not other.get("replayed")
+
+
+def test_in_flight_duplicates_wait_for_the_first_attempt(
+    service,
+    session,
+    tmp_path,
+    make_row,
+    make_workbook,
+    make_facturama,
+):
+    service.facturama = make_facturama(create_delay=0.05)
+    path = make_workbook([make_row()])
+
+    async def submit_twice():
+        return await asyncio.gather(
+            *(service.process_invoice(path, "ML", date.today(), idempotency_token="abc") for _ in range(2))
+        )
+
+    first, second = asyncio.run(submit_twice())
+    assert first["success"] and second["replayed"] and second["folio"] == first["folio"] == 1
+    assert service.facturama.calls == [("create", 1)]
+
+
+def test_duplicates_in_other_processes_wait_on_the_database_claim(
+    session_factory,
+    tmp_path,
+    monkeypatch,
+    make_row,
+    make_workbook,
+    make_facturama,
+):
+    monkeypatch.setattr(invoicing_service, "cpu_pool", CpuPool(workers=0, queue_size=4))
+    monkeypatch.setattr(invoicing_service, "enqueue_documents", lambda session, invoice: None)
+    monkeypatch.setattr(invoicing_service, "_in_flight", SimpleNamespace(hold=lambda key: nullcontext()))
+    monkeypatch.setattr(invoicing_service, "POLL_SECONDS", 0.01)
+    facturama = make_facturama(create_delay=0.05)
+    path = make_workbook([make_row()])
+
+    async def submit(worker):
+        with session_factory() as session:
+            service = InvoicingService(session)
+            service.excel_service = ExcelService(storage_dir=tmp_path / worker)
+            service.upload_cache = UploadCache(tmp_path / worker / "cache", max_entries=10)
+            service.facturama = facturama
+            return await service.process_invoice(path, "ML", date.today(), idempotency_token="abc")
+
+    async def run():
+        return await asyncio.gather(submit("a"), submit("b"))
+
+    first, second = asyncio.run(run())
+    assert first["success"] and second["replayed"] and second["folio"] == first["folio"] == 1
+    assert facturama.calls == [("create", 1)]
+    with session_factory() as session:
+        assert session.scalar(select(func.count()).select_from(IdempotencyClaim)) == 0
+
+
+def test_abandoned_claims_are_taken_over(service, session, make_row, make_workbook):
+    path = make_workbook([make_row()])
+    key = invoicing_service.idempotency_key(hash_file(path), "ML", date.today())
+    stale = datetime.utcnow() - timedelta(seconds=settings.idempotency_claim_ttl + 1)
+    session.add(IdempotencyClaim(key=key, owner="muerto", claimed_at=stale))
+    session.commit()
+
+    result = asyncio.run(service.process_invoice(path, "ML", date.today()))
+    assert result["success"] and result["folio"] == 1
+    assert session.scalar(select(func.count()).select_from(IdempotencyClaim)) == 0
+
+
+def test_invoices_left_pending_by_a_dead_attempt_do_not_block_retries(
+    service, session, monkeypatch, make_row, make_workbook
+):
+    monkeypatch.setattr(settings, "idempotency_wait", 0)
+    path = make_workbook([make_row()])
+    key = invoicing_service.idempotency_key(hash_file(path), "ML", date.today())
+    session.add(Invoice(status="pending", serie="ML", folio=1, idempotency_key=key))  # its process crashed
+    session.commit()
+
+    result = asyncio.run(service.process_invoice(path, "ML", date.today()))
+    assert result["success"] and result["folio"] == 1  # the abandoned folio was reclaimed
+    assert session.scalars(select(Invoice.status)).all() == ["success"]
@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.core.rate_limit import RateLimiter, RateLimitExceeded
+from app.models.rate_limit import RateLimitBucket
+from app.services.facturama_client import CircuitBreaker, FacturamaClient, HttpPool, RateLimitedError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+def _limiter(session_factory, clock, rate=2, burst=2, max_wait=5):
+    return RateLimiter({"create": (rate, burst), "query": (0, 0)}, max_wait, session_factory, clock, clock.sleep)
+
+
+def test_burst_then_callers_wait_for_the_next_token(session_factory):
+    clock = FakeClock()
+    limiter = _limiter(session_factory, clock)
+
+    async def scenario():
+        return [await limiter.acquire("create") for _ in range(4)]
+
+    waits = asyncio.run(scenario())
+    assert waits == [0, 0, 0.5, 0.5]
+    assert clock.sleeps == [0.5, 0.5]
+    stats = limiter.snapshot()
+    assert set(stats) == {"create"}
+    assert stats["create"]["acquired"] == 4
+    assert stats["create"]["delayed"] == 2
+    assert stats["create"]["wait_max"] == 0.5
+    assert asyncio.run(limiter.acquire("query")) == 0
+
+
+def test_workers_share_the_bucket_and_give_up_after_max_wait(session_factory):
+    clock = FakeClock()
+    first = _limiter(session_factory, clock, rate=0.1, burst=1, max_wait=5)
+    second = _limiter(session_factory, clock, rate=0.1, burst=1, max_wait=5)
+
+    assert asyncio.run(first.acquire("create")) == 0
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(second.acquire("create"))
+    assert second.snapshot()["create"]["rejected"] == 1
+    with session_factory() as session:
+        assert session.get(RateLimitBucket, "create").version == 0
+
+
+def test_client_waits_on_its_endpoint_bucket(session_factory):
+    clock = FakeClock()
+    limiter = _limiter(session_factory, clock, rate=1, burst=1, max_wait=0.5)
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"Id": "abc"})
+
+    client = FacturamaClient(HttpPool(transport=httpx.MockTransport(handler)), CircuitBreaker(0, 0), limiter)
+
+    async def scenario():
+        try:
+            await client.create_cfdi({"Folio": 1})
+            await client.list_cfdis("2026-01-01", "2026-01-31")  # query has no limit
+            with pytest.raises(RateLimitedError):
+                await client.create_cfdi({"Folio": 2})
+        finally:
+            await client.pool.close()
+
+    asyncio.run(scenario())
+    assert calls == ["/3/cfdis", "/cfdi"]
@@ -1,5 +1,8 @@
+from types import SimpleNamespace
+
 from fastapi.testclient import TestClient
 
+from app import main
 from app.main import app
 
 
@@ -7,3 +10,47 @@ def test_login_page_ok():
     client = TestClient(app)
     resp = client.get("/login")
     assert resp.status_code == 200
+
+
+def test_health_exposes_circuit_state():
+    client = TestClient(app)
+    resp = client.get("/health")
+    assert resp.status_code == 200
+    assert resp.json()["facturama"]["state"] == "closed"
+
+
+def test_lifespan_starts_in_order_and_stops_in_reverse(monkeypatch):
+    calls = []
+
+    def log(entry):
+        return lambda *args: calls.append(entry)
+
+    def alog(entry):
+        async def call(*args):
+            calls.append(entry)
+
+        return call
+
+    monkeypatch.setattr(main, "ensure_default_series", log("series"))
+    monkeypatch.setattr(main, "cpu_pool", SimpleNamespace(start=log("cpu_pool"), shutdown=log("stop cpu_pool")))
+    monkeypatch.setattr(main, "http_pool", SimpleNamespace(start=alog("http_pool"), close=alog("stop http_pool")))
+    monkeypatch.setattr(main, "document_queue", SimpleNamespace(start=log("queue"), stop=alog("stop queue")))
+    monkeypatch.setattr(main, "stamp_job_queue", SimpleNamespace(start=log("jobs"), stop=alog("stop jobs")))
+    monkeypatch.setattr(main, "folio_blocks", SimpleNamespace(release_all=log("release folios")))
+
+    with TestClient(main.app):
+        calls.append("serving")
+
+    assert calls == [
+        "series",
+        "cpu_pool",
+        "http_pool",
+        "queue",
+        "jobs",
+        "serving",
+        "stop jobs",
+        "release folios",
+        "stop queue",
+        "stop http_pool",
+        "stop cpu_pool",
+    ]
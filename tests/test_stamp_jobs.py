@@ -0,0 +1,126 @@
+import asyncio
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.workers import CpuPool
+from app.models.invoice import DocumentFetch, IdempotencyClaim, Invoice, StampJob
+from app.services import invoicing_service
+from app.services.excel_service import ExcelService
+from app.services.invoicing_service import InvoicingService
+from app.services.stamp_jobs import StampJobQueue, create_job, job_snapshot
+from app.services.upload_cache import UploadCache, hash_file
+from app.services.upload_storage import StoredUpload
+
+
+@pytest.fixture
+def session_factory(session_factory, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "facturas_storage_dir", tmp_path)
+    monkeypatch.setattr(invoicing_service, "cpu_pool", CpuPool(workers=0, queue_size=4))
+    return session_factory
+
+
+def _queue(session_factory, tmp_path, stages, make_facturama):
+    def service_factory(session):
+        service = InvoicingService(session)
+        service.excel_service = ExcelService(storage_dir=tmp_path)
+        service.upload_cache = UploadCache(tmp_path / "cache", max_entries=10)
+        service.facturama = make_facturama()
+        process_invoice = service.process_invoice
+
+        async def recording(**kwargs):
+            progress = kwargs["progress"]
+
+            def record(stage, message):
+                stages.append(stage)
+                progress(stage, message)
+
+            return await process_invoice(**{**kwargs, "progress": record})
+
+        service.process_invoice = recording
+        return service
+
+    return StampJobQueue(workers=0, session_factory=session_factory, service_factory=service_factory)
+
+
+def _submit(session_factory, path):
+    with session_factory() as session:
+        upload = StoredUpload(path, hash_file(path), path.stat().st_size, filename=path.name)
+        return create_job(session, upload, "ML", date.today()).id
+
+
+def _snapshot(session_factory, job_id):
+    with session_factory() as session:
+        return job_snapshot(session, session.get(StampJob, job_id))
+
+
+def test_job_reports_each_stage_until_documents_are_stored(
+    session_factory,
+    tmp_path,
+    make_row,
+    make_workbook,
+    make_facturama,
+):
+    stages = []
+    job_id = _submit(session_factory, make_workbook([make_row(), make_row(Pedido="P2")]))
+    assert _snapshot(session_factory, job_id)["stage"] == "queued"
+
+    assert asyncio.run(_queue(session_factory, tmp_path, stages, make_facturama).drain()) == 1
+    assert stages == ["parsed", "validated", "folio_reserved", "stamped"]
+    snapshot = _snapshot(session_factory, job_id)
+    assert snapshot["status"] == "done" and snapshot["stage"] == "stamped"
+    assert snapshot["result"]["folio"] == 1
+    assert snapshot["documents"] == "pending" and not snapshot["finished"]
+
+    with session_factory() as session:
+        session.scalar(select(DocumentFetch)).status = "done"
+        session.commit()
+    snapshot = _snapshot(session_factory, job_id)
+    assert snapshot["stage"] == "documents_stored" and snapshot["finished"]
+    assert all(stage["done"] for stage in snapshot["stages"])
+
+
+def test_invalid_upload_fails_the_job_without_a_folio(
+    session_factory,
+    tmp_path,
+    make_row,
+    make_workbook,
+    make_facturama,
+):
+    stages = []
+    job_id = _submit(session_factory, make_workbook([make_row(Cantidad=0)]))
+
+    asyncio.run(_queue(session_factory, tmp_path, stages, make_facturama).drain())
+    snapshot = _snapshot(session_factory, job_id)
+    assert stages == ["parsed"]
+    assert snapshot["status"] == "failed" and snapshot["finished"]
+    assert snapshot["result"]["error_excel"].endswith("_errores.xlsx")
+    assert "Cantidad debe ser mayor a 0" in snapshot["message"]
+
+
+def test_job_abandoned_mid_run_is_failed_not_retried(
+    session_factory,
+    tmp_path,
+    make_row,
+    make_workbook,
+    make_facturama,
+):
+    path = make_workbook([make_row()])
+    job_id = _submit(session_factory, path)
+    queue = _queue(session_factory, tmp_path, [], make_facturama)
+    assert queue._claim() == job_id
+    assert queue._claim() is None
+    key = invoicing_service.idempotency_key(hash_file(path), "ML", date.today())
+    with session_factory() as session:  # the worker died after preparing its invoice
+        session.get(StampJob, job_id).locked_until = datetime(2000, 1, 1)
+        session.add(Invoice(status="pending", serie="ML", folio=1, idempotency_key=key))
+        session.add(IdempotencyClaim(key=key, owner="muerto", claimed_at=datetime(1999, 12, 31)))
+        session.commit()
+
+    assert asyncio.run(queue.run_once()) is False
+    assert _snapshot(session_factory, job_id)["status"] == "failed"
+    with session_factory() as session:
+        assert session.scalars(select(Invoice.status)).all() == ["failed"]
+        assert session.scalars(select(IdempotencyClaim)).all() == []
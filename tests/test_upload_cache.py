@@ -0,0 +1,45 @@
+import os
+from datetime import date
+
+from app.services.excel_service import ExcelService
+from app.services.upload_cache import UploadCache, hash_file
+
+
+def test_cached_parse_rebuilds_header_fields(tmp_path, make_row, make_workbook):
+    service = ExcelService(storage_dir=tmp_path)
+    cache = UploadCache(tmp_path / "cache", max_entries=5)
+    path = make_workbook([make_row(), make_row(Pedido="P2")])
+    upload_hash = hash_file(path)
+    cache.put(upload_hash, service.parse(path))
+
+    cached = cache.get(upload_hash)
+    retry = service.build(cached, serie="B", folio=42, issue_date=date.today(), expedition_place="64000")
+    expected = service.process(path, serie="B", folio=42, issue_date=date.today(), expedition_place="64000")
+    assert retry.payload == expected.payload
+    assert retry.payload["Folio"] == 42 and retry.payload["ExpeditionPlace"] == "64000"
+
+
+def test_cache_keeps_row_errors_and_evicts_oldest(tmp_path, make_row, make_workbook):
+    service = ExcelService(storage_dir=tmp_path)
+    cache = UploadCache(tmp_path / "cache", max_entries=1)
+    invalid = make_workbook([make_row(Cantidad=0)], "invalid.xlsx")
+    valid = make_workbook([make_row()], "valid.xlsx")
+
+    cache.put("a", service.parse(invalid))
+    cached = cache.get("a")
+    assert cached.errors == ["Fila 2: Cantidad debe ser mayor a 0"]
+    assert cached.row_errors[0].column == "Cantidad"
+    assert cached.error_excel_path.exists()
+
+    os.utime(cache.cache_dir / "a.json", (0, 0))
+    cache.put("b", service.parse(valid))
+    assert cache.get("a") is None
+    assert cache.get("b").valid
+
+
+def test_cache_misses_when_error_report_was_removed(tmp_path, make_row, make_workbook):
+    cache = UploadCache(tmp_path / "cache", max_entries=5)
+    parsed = ExcelService(storage_dir=tmp_path).parse(make_workbook([make_row(Cantidad=0)]))
+    cache.put("a", parsed)
+    parsed.error_excel_path.unlink()
+    assert cache.get("a") is None
@@ -0,0 +1,54 @@
+import asyncio
+import hashlib
+import io
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+
+from app.services.upload_storage import InvalidArchiveError, UploadTooLargeError, extract_zip, save_upload
+
+
+def _upload(content: bytes, filename: str = "../factura.xlsx") -> UploadFile:
+    return UploadFile(file=io.BytesIO(content), filename=filename)
+
+
+def test_save_upload_hashes_while_copying(tmp_path):
+    content = b"x" * (3 * 1024 * 1024 + 5)
+    stored = asyncio.run(save_upload(_upload(content), tmp_path, max_bytes=0))
+    assert stored.path.parent == tmp_path
+    assert stored.path.name.endswith("_factura.xlsx")
+    assert stored.path.read_bytes() == content
+    assert stored.sha256 == hashlib.sha256(content).hexdigest()
+    assert stored.size == len(content)
+    assert [p.name for p in tmp_path.iterdir()] == [stored.path.name]
+
+
+def test_save_upload_rejects_oversized_files(tmp_path):
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(save_upload(_upload(b"x" * 2048), tmp_path, max_bytes=1024))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_extract_zip_keeps_only_workbooks(tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("enero/sucursal_a.xlsx", b"a")
+        archive.writestr("sucursal_b.csv", b"b" * 10)
+        archive.writestr("__MACOSX/._sucursal_a.xlsx", b"junk")
+        archive.writestr("notas.txt", b"x")
+    archive = asyncio.run(save_upload(_upload(buffer.getvalue(), "lote.zip"), tmp_path, max_bytes=0))
+
+    out = tmp_path / "out"
+    out.mkdir()
+    stored = asyncio.run(extract_zip(archive, out, max_files=5, max_bytes=0))
+    assert [(s.filename, s.path.read_bytes()) for s in stored] == [("sucursal_a.xlsx", b"a"), ("sucursal_b.csv", b"b" * 10)]
+    assert stored[0].sha256 == hashlib.sha256(b"a").hexdigest()
+
+    for upload in stored:
+        upload.path.unlink()
+    with pytest.raises(InvalidArchiveError):
+        asyncio.run(extract_zip(archive, out, max_files=1, max_bytes=0))
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(extract_zip(archive, out, max_files=5, max_bytes=5))
+    assert list(out.iterdir()) == []
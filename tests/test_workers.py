@@ -0,0 +1,35 @@
+import asyncio
+import time
+from datetime import date
+
+import pytest
+
+from app.core.workers import CpuPool, PoolBusyError
+from app.services.excel_service import ExcelService
+
+
+def test_pool_runs_excel_processing_in_a_subprocess(tmp_path, make_row, make_workbook):
+    pool = CpuPool(workers=1, queue_size=1)
+    path = make_workbook([make_row()])
+    try:
+        result = asyncio.run(
+            pool.run(ExcelService(storage_dir=tmp_path).process, path, serie="ML", folio=1, issue_date=date.today())
+        )
+    finally:
+        pool.shutdown()
+    assert result.valid
+    assert result.payload["Items"][0]["IdentificationNumber"] == "P1"
+
+
+def test_pool_rejects_when_queue_is_full():
+    pool = CpuPool(workers=0, queue_size=1)
+
+    async def scenario():
+        running = asyncio.ensure_future(pool.run(time.sleep, 0.2))
+        queued = asyncio.ensure_future(pool.run(time.sleep, 0))
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolBusyError):
+            await pool.run(time.sleep, 0)
+        await asyncio.gather(running, queued)
+
+    asyncio.run(scenario())